@@ -1 +1,101 @@
 """The package responsible for clients for NSFW moderation."""
+
+from typing import Optional
+
+import httpx
+
+from blob_store.base import BlobStore
+from config.app import Config
+
+from .base import NSFWClient
+from .cascade import CascadeNSFWClient
+from .clarifai import ClarifaiClient
+from .hedged import HedgedNSFWClient
+from .onnx_client import OnnxNSFWClient
+
+
+def create_nsfw_client(
+    config: Config,
+    blob_store: Optional[BlobStore] = None,
+    backend: Optional[str] = None,
+    httpx_client: Optional[httpx.AsyncClient] = None,
+    image_client: Optional[httpx.AsyncClient] = None,
+) -> NSFWClient:
+    """
+    Create the NSFW client by config.
+
+    :param backend: Backend of the client: clarifai, onnx or cascade.
+    If None, config.moderator.backend is used (wrapped in the hedging
+    client, if enabled).
+    :param httpx_client: Shared HTTPX client of the clients.
+    :param image_client: HTTPX client downloading the images by URL
+    (connecting only to the public addresses), required by the local model.
+    :raise ValueError: If the backend is unknown or the local model
+    has no image_client.
+    :raise RuntimeError: If the dependencies of the backend
+    are not installed.
+    """
+    if backend is None and config.hedging.enabled:
+        return HedgedNSFWClient(
+            primary=create_nsfw_client(
+                config,
+                blob_store,
+                backend=config.moderator.backend,
+                httpx_client=httpx_client,
+                image_client=image_client,
+            ),
+            secondary=(
+                create_nsfw_client(
+                    config,
+                    blob_store,
+                    backend=config.hedging.secondary,
+                    httpx_client=httpx_client,
+                    image_client=image_client,
+                )
+                if config.hedging.secondary is not None
+                else None
+            ),
+            percentile=config.hedging.percentile,
+            min_delay=config.hedging.min_delay,
+            budget=config.hedging.budget,
+        )
+    backend = backend or config.moderator.backend
+    if backend == "clarifai":
+        return ClarifaiClient(
+            config=config.clarifai,
+            httpx_client=httpx_client,
+            blob_store=blob_store,
+        )
+    if backend == "onnx":
+        if image_client is None:
+            raise ValueError("The local model needs image_client.")
+        return OnnxNSFWClient(
+            config=config.local_model,
+            httpx_client=image_client,
+            blob_store=blob_store,
+        )
+    if backend == "cascade":
+        if "cascade" in (
+            config.cascade.first_stage,
+            config.cascade.second_stage,
+        ):
+            raise ValueError("A cascade stage cannot be a cascade.")
+        return CascadeNSFWClient(
+            first_stage=create_nsfw_client(
+                config,
+                blob_store,
+                backend=config.cascade.first_stage,
+                httpx_client=httpx_client,
+                image_client=image_client,
+            ),
+            second_stage=create_nsfw_client(
+                config,
+                blob_store,
+                backend=config.cascade.second_stage,
+                httpx_client=httpx_client,
+                image_client=image_client,
+            ),
+            low=config.cascade.low,
+            high=config.cascade.high,
+        )
+    raise ValueError(f"Unknown moderator backend: {backend}")
@@ -1,10 +1,27 @@
 """The module responsible for the client interface for NSFW moderation."""
 
+import asyncio
 from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
 
 from schemas.moderation import ModerationRequest, ModerationResponse
 
 
+class NSFWClientThrottledError(Exception):
+    """The NSFW API throttles the requests (429) or is unavailable (5xx)."""
+
+    def __init__(self, status_code: int, retry_after: Optional[float] = None):
+        """
+        Init class.
+
+        :param status_code: HTTP status code of the response.
+        :param retry_after: Delay requested by the API (seconds).
+        """
+        super().__init__(f"NSFW API responded with {status_code}.")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
 class NSFWClient(ABC):
     """Base NSFW client interface."""
 
@@ -12,5 +29,38 @@ class NSFWClient(ABC):
     async def moderate(
         self, moderation_request: ModerationRequest
     ) -> ModerationResponse:
-        """Moderate image."""
+        """
+        Moderate image.
+
+        :raise NSFWClientThrottledError: If the request should be retried
+        later.
+        """
         pass
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Return the stats of the client (if any)."""
+        return {}
+
+    async def warm_up(self) -> None:
+        """Prepare the client for the first requests (if needed)."""
+        return None
+
+    async def close(self) -> None:
+        """Release the resources of the client (if any)."""
+        return None
+
+    async def moderate_batch(
+        self, moderation_requests: List[ModerationRequest]
+    ) -> List[ModerationResponse]:
+        """
+        Moderate several images.
+
+        The responses are returned in the order of the requests.
+        By default, the images are moderated concurrently one by one.
+        """
+        return list(
+            await asyncio.gather(
+                *(self.moderate(request) for request in moderation_requests)
+            )
+        )
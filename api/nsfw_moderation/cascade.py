@@ -0,0 +1,163 @@
+"""The module responsible for the cascade of NSFW clients."""
+
+from logging import getLogger
+from time import perf_counter
+from typing import Any, Dict, List
+
+from schemas.moderation import ModerationRequest, ModerationResponse
+from utils.latency import RollingLatency
+
+from .base import NSFWClient
+
+logger = getLogger("main.api.cascade")
+
+
+class _StageStats(object):
+    """Counters and latency of a cascade stage."""
+
+    def __init__(self):
+        """Init class."""
+        self.images = 0
+        self.decided = 0
+        self.errors = 0
+        self.latency = RollingLatency()
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the stats (hit rate - share of the images decided)."""
+        return {
+            "images": self.images,
+            "decided": self.decided,
+            "errors": self.errors,
+            "hit_rate": (
+                round(self.decided / self.images, 4) if self.images else None
+            ),
+            **self.latency.summary(),
+        }
+
+
+class CascadeNSFWClient(NSFWClient):
+    """
+    Two-stage NSFW client.
+
+    The cheap first stage scores all the images. Its verdict is final
+    if the nsfw score is outside the uncertainty band [low, high];
+    the uncertain (and failed) images are moderated by the second stage.
+    """
+
+    def __init__(
+        self,
+        first_stage: NSFWClient,
+        second_stage: NSFWClient,
+        low: float,
+        high: float,
+    ):
+        """
+        Init class.
+
+        :param first_stage: Cheap NSFW client (e.g. the local model).
+        :param second_stage: Expensive NSFW client (e.g. Clarifai).
+        :param low: Lower bound of the uncertainty band of the nsfw score.
+        :param high: Upper bound of the uncertainty band of the nsfw score.
+        :raise ValueError: If low > high.
+        """
+        if low > high:
+            raise ValueError("The lower bound of the band exceeds the upper.")
+        self.__first_stage = first_stage
+        self.__second_stage = second_stage
+        self.__low = low
+        self.__high = high
+        self.__first_stats = _StageStats()
+        self.__second_stats = _StageStats()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Return the hit rates and latency of the stages."""
+        return {
+            "first_stage": self.__first_stats.as_dict(),
+            "second_stage": self.__second_stats.as_dict(),
+        }
+
+    async def warm_up(self) -> None:
+        """Warm up both stages."""
+        await self.__first_stage.warm_up()
+        await self.__second_stage.warm_up()
+
+    async def close(self) -> None:
+        """Close both stages."""
+        await self.__first_stage.close()
+        await self.__second_stage.close()
+
+    def __is_decided(self, moderation_response: ModerationResponse) -> bool:
+        """Return True, if the verdict of the first stage is final."""
+        return moderation_response.status == "OK" and not (
+            self.__low <= moderation_response.nsfw <= self.__high
+        )
+
+    @classmethod
+    async def __run_stage(
+        cls,
+        stage: NSFWClient,
+        stats: _StageStats,
+        moderation_requests: List[ModerationRequest],
+    ) -> List[ModerationResponse]:
+        """Moderate the images with the stage and count the stats."""
+        start = perf_counter()
+        if len(moderation_requests) == 1:
+            responses = [await stage.moderate(moderation_requests[0])]
+        else:
+            responses = await stage.moderate_batch(moderation_requests)
+        stats.latency.add(perf_counter() - start)
+        stats.images += len(responses)
+        stats.errors += sum(
+            1 for response in responses if response.status == "ERROR"
+        )
+        return responses
+
+    async def moderate(
+        self, moderation_request: ModerationRequest
+    ) -> ModerationResponse:
+        """
+        Moderate nsfw.
+
+        :param moderation_request: Moderation request object.
+        :return: Moderation response of the stage that decided.
+        """
+        responses = await self.moderate_batch([moderation_request])
+        return responses[0]
+
+    async def moderate_batch(
+        self, moderation_requests: List[ModerationRequest]
+    ) -> List[ModerationResponse]:
+        """
+        Moderate several images.
+
+        :param moderation_requests: Moderation request objects.
+        :return: Moderation responses in the order of the requests.
+        """
+        responses = await self.__run_stage(
+            self.__first_stage, self.__first_stats, moderation_requests
+        )
+        uncertain: List[int] = []
+        for i, response in enumerate(responses):
+            if self.__is_decided(response):
+                self.__first_stats.decided += 1
+            else:
+                uncertain.append(i)
+        if not uncertain:
+            return responses
+
+        logger.debug(
+            "%d of %d images are escalated to the second stage.",
+            len(uncertain),
+            len(moderation_requests),
+        )
+        second_responses = await self.__run_stage(
+            self.__second_stage,
+            self.__second_stats,
+            [moderation_requests[i] for i in uncertain],
+        )
+        for i, response in zip(uncertain, second_responses):
+            if response.status == "OK":
+                self.__second_stats.decided += 1
+            responses[i] = response
+        return responses
@@ -1,20 +1,23 @@
 """The module responsible for the implementation of the Clarifai client."""
 
+import asyncio
 import base64
 import json
 import re
 from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
 from logging import getLogger
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import httpx
 from httpx import Response
 
+from blob_store.base import BlobStore
 from config.app import ClarifaiConfig
 from schemas.moderation import ModerationRequest, ModerationResponse
+from utils.http import parse_retry_after
 
-from .base import NSFWClient
+from .base import NSFWClient, NSFWClientThrottledError
 
 logger = getLogger("main.api.clarifai")
 
@@ -27,11 +30,16 @@ class ClarifaiClient(NSFWClient):
         "main/models/nsfw-recognition/versions/"
         "aa47919c9a8d4d94bfa283121281bcc4/outputs"
     )
+    # Maximum number of inputs in one request
+    MAX_BATCH_SIZE: int = 128
+    # SUCCESS and MIXED_STATUS (some of the inputs failed)
+    SUCCESS_CODES: Tuple[int, ...] = (10000, 10010)
 
     def __init__(
         self,
         config: ClarifaiConfig,
         httpx_client: Optional[httpx.AsyncClient] = None,
+        blob_store: Optional[BlobStore] = None,
     ):
         """
         Init class.
@@ -39,8 +47,11 @@ class ClarifaiClient(NSFWClient):
         :param config: Clarifai config.
         :param httpx_client: HTTPX client.
         If None is passed, a new client will be created before each request.
+        :param blob_store: Store of the images referenced by the requests.
         """
         self.__client = httpx_client
+        self.__blob_store = blob_store
+        self.__url = config.base_url or self.BASE_URL
         self.__headers: Dict[str, str] = {
             "Authorization": f"Key {config.access_token}",
             "Content-Type": "application/json",
@@ -71,6 +82,76 @@ class ClarifaiClient(NSFWClient):
         except ValueError:
             return False
 
+    @classmethod
+    def __image_data(cls, image: str) -> Dict[str, str]:
+        """
+        Return image data for Clarifai input.
+
+        :raise ValueError: If image is not url or base64.
+        """
+        if cls.__is_url(image):
+            logger.debug("Image is URL")
+            return {"url": image}
+        elif cls.__is_base64(image):
+            logger.debug("Image is base64 encoded.")
+            return {"base64": image}
+        raise ValueError("Unrecognized image format.")
+
+    async def __input(
+        self, moderation_request: ModerationRequest
+    ) -> Dict[str, Any]:
+        """
+        Return Clarifai input for the moderation request.
+
+        The image referenced by the request is read from the blob store.
+
+        :raise ValueError: If image is not url or base64.
+        :raise BlobNotFoundError: If the referenced image does not exist.
+        """
+        if moderation_request.image_bytes is not None:
+            image_data = {
+                "base64": base64.b64encode(
+                    moderation_request.image_bytes
+                ).decode()
+            }
+        elif moderation_request.blob_ref is not None:
+            if self.__blob_store is None:
+                raise ValueError("Blob store is not configured.")
+            image_bytes = await self.__blob_store.get(
+                moderation_request.blob_ref
+            )
+            image_data = {"base64": base64.b64encode(image_bytes).decode()}
+        else:
+            image_data = self.__image_data(moderation_request.image)
+        return {"id": moderation_request.id, "data": {"image": image_data}}
+
+    @classmethod
+    def __parse_output(
+        cls, moderation_request_id: str, output: Dict[str, Any]
+    ) -> ModerationResponse:
+        """Convert Clarifai output to the moderation response."""
+        if output["status"]["code"] != 10000:
+            logger.warning(
+                "Unsuccessful moderation of the image %s. "
+                "Error description: %s",
+                moderation_request_id,
+                output["status"]["description"],
+            )
+            return ModerationResponse(id=moderation_request_id, status="ERROR")
+
+        moderation_data = output["data"]["concepts"]
+        if moderation_data[0]["name"] == "nsfw":
+            nsfw = moderation_data[0]["value"]
+            sfw = moderation_data[1]["value"]
+        else:
+            nsfw = moderation_data[1]["value"]
+            sfw = moderation_data[0]["value"]
+        return ModerationResponse(
+            id=moderation_request_id,
+            sfw=sfw,
+            nsfw=nsfw,
+        )
+
     async def moderate(
         self, moderation_request: ModerationRequest
     ) -> ModerationResponse:
@@ -78,69 +159,126 @@ class ClarifaiClient(NSFWClient):
         Moderate nsfw.
 
         :param moderation_request: Moderation request object.
-        :raise ValueError: If image is not url or base64.
-        :return: JSON response from Clarifai API.
+        :return: Moderation response.
+        If the image is not url or base64, the response status is ERROR.
         """
-        try:
-            image = moderation_request.image
-            if self.__is_url(image):
-                logger.debug("Image is URL")
-                image_data: Dict[str, str] = {"url": image}
-            elif self.__is_base64(image):
-                logger.debug("Image is base64 encoded.")
-                image_data = {"base64": image}
+        responses = await self.moderate_batch([moderation_request])
+        return responses[0]
+
+    async def moderate_batch(
+        self, moderation_requests: List[ModerationRequest]
+    ) -> List[ModerationResponse]:
+        """
+        Moderate several images with multi-input requests.
+
+        The images are sent in chunks of MAX_BATCH_SIZE inputs.
+        The failure of one image does not affect the other images.
+
+        :param moderation_requests: Moderation request objects.
+        :return: Moderation responses in the order of the requests.
+        """
+        responses: Dict[str, ModerationResponse] = {}
+        inputs: List[Dict[str, Any]] = []
+        results = await asyncio.gather(
+            *(self.__input(request) for request in moderation_requests),
+            return_exceptions=True,
+        )
+        for moderation_request, result in zip(moderation_requests, results):
+            if isinstance(result, Exception):
+                logger.warning(
+                    "Invalid image %s: %r", moderation_request.id, result
+                )
+                responses[moderation_request.id] = ModerationResponse(
+                    id=moderation_request.id, status="ERROR"
+                )
+            elif isinstance(result, BaseException):
+                raise result
             else:
-                raise ValueError("Unrecognized image format.")
+                inputs.append(result)
 
+        if inputs:
             async with self.__httpx_client() as client:
-                data: Dict[str, Any] = {
-                    "inputs": [{"data": {"image": image_data}}]
-                }
-                resp: Response = await client.post(
-                    url=self.BASE_URL,
-                    headers=self.__headers,
-                    json=data,
-                )
-                if resp.status_code != 200:
-                    logger.warning(
-                        "Resp status: %d. Response: %s",
-                        resp.status_code,
-                        str(resp.json()),
+                for start in range(0, len(inputs), self.MAX_BATCH_SIZE):
+                    end = start + self.MAX_BATCH_SIZE
+                    responses.update(
+                        await self.__post_inputs(client, inputs[start:end])
                     )
 
-                resp_json: Dict[str, Any] = resp.json()
-                logger.debug(
-                    "Response json: %s", json.dumps(resp_json, indent=2)
+        return [
+            responses.get(
+                moderation_request.id,
+                ModerationResponse(id=moderation_request.id, status="ERROR"),
+            )
+            for moderation_request in moderation_requests
+        ]
+
+    async def __post_inputs(
+        self, client: httpx.AsyncClient, inputs: List[Dict[str, Any]]
+    ) -> Dict[str, ModerationResponse]:
+        """
+        Send inputs to Clarifai in one request.
+
+        :return: Moderation responses by input IDs.
+        :raise NSFWClientThrottledError: If Clarifai responded with 429/5xx.
+        """
+        input_ids: List[str] = [input_["id"] for input_ in inputs]
+        try:
+            resp: Response = await client.post(
+                url=self.__url,
+                headers=self.__headers,
+                json={"inputs": inputs},
+            )
+            if resp.status_code == 429 or resp.status_code >= 500:
+                raise NSFWClientThrottledError(
+                    resp.status_code,
+                    retry_after=parse_retry_after(
+                        resp.headers.get("Retry-After")
+                    ),
+                )
+            if resp.status_code != 200:
+                logger.warning(
+                    "Resp status: %d. Response: %s",
+                    resp.status_code,
+                    str(resp.json()),
                 )
 
-                if resp_json["status"]["code"] == 10000:
-                    logger.info("Successful request to Clarifai")
-                    moderation_data = resp_json["outputs"][0]["data"][
-                        "concepts"
-                    ]
-                    if moderation_data[0]["name"] == "nsfw":
-                        nsfw = moderation_data[0]["value"]
-                        sfw = moderation_data[1]["value"]
-                    else:
-                        nsfw = moderation_data[1]["value"]
-                        sfw = moderation_data[0]["value"]
-                    return ModerationResponse(
-                        id=moderation_request.id,
-                        sfw=sfw,
-                        nsfw=nsfw,
-                    )
-                else:
-                    logger.warning(
-                        "Unsuccessful request to Clarifai. "
-                        "Error description: %s",
-                        resp_json["status"]["description"],
-                    )
-                    return ModerationResponse(
-                        id=moderation_request.id, status="ERROR"
+            resp_json: Dict[str, Any] = resp.json()
+            logger.debug("Response json: %s", json.dumps(resp_json, indent=2))
+
+            if resp_json["status"]["code"] not in self.SUCCESS_CODES:
+                logger.warning(
+                    "Unsuccessful request to Clarifai. "
+                    "Error description: %s",
+                    resp_json["status"]["description"],
+                )
+                return {
+                    input_id: ModerationResponse(id=input_id, status="ERROR")
+                    for input_id in input_ids
+                }
+
+            logger.info(
+                "Successful request to Clarifai (%d inputs)", len(inputs)
+            )
+            responses: Dict[str, ModerationResponse] = {}
+            for i, output in enumerate(resp_json["outputs"]):
+                input_id = output.get("input", {}).get("id") or input_ids[i]
+                try:
+                    responses[input_id] = self.__parse_output(input_id, output)
+                except (KeyError, IndexError) as exc:
+                    logger.error(
+                        "Invalid output for the image %s: %s",
+                        input_id,
+                        str(exc),
                     )
+            return responses
+        except NSFWClientThrottledError:
+            raise
         except Exception as exc:
             logger.error("Unexpected error: %s", str(exc))
-            return ModerationResponse(id=moderation_request.id, status="ERROR")
+            return {
+                input_id: ModerationResponse(id=input_id, status="ERROR")
+                for input_id in input_ids
+            }
 
 
 if __name__ == "__main__":
@@ -149,8 +287,6 @@ if __name__ == "__main__":
     config = get_config()
     client = ClarifaiClient(config.clarifai)
 
-    import asyncio
-
     moderation_request = ModerationRequest(
         image="https://samples.clarifai.com/metro-north.jpg"
     )
@@ -0,0 +1,233 @@
+"""The module responsible for the hedged requests to NSFW clients."""
+
+import asyncio
+from logging import getLogger
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from schemas.moderation import ModerationRequest, ModerationResponse
+from utils.latency import RollingLatency
+
+from .base import NSFWClient, NSFWClientThrottledError
+
+logger = getLogger("main.api.hedged")
+
+Call = Callable[[NSFWClient], Awaitable[List[ModerationResponse]]]
+
+
+class HedgedNSFWClient(NSFWClient):
+    """
+    NSFW client wrapper cutting the tail latency.
+
+    If the primary client does not answer within the percentile
+    of its recent latency, a duplicate (hedged) request is sent
+    to the secondary client (or to the primary one again) and the first
+    successful answer wins (a raising call does not cancel the other
+    one). The hedges are limited by the budget: at most budget hedged
+    requests per request (on average). The images failed or throttled
+    by the primary client are moderated by the secondary one (failover).
+    """
+
+    def __init__(
+        self,
+        primary: NSFWClient,
+        secondary: Optional[NSFWClient] = None,
+        percentile: float = 95.0,
+        min_delay: float = 0.05,
+        budget: float = 0.05,
+        max_burst: float = 10.0,
+        min_samples: int = 20,
+    ):
+        """
+        Init class.
+
+        :param primary: Primary NSFW client.
+        :param secondary: NSFW client for the hedged requests
+        and the failover. If None, the primary client is used.
+        :param percentile: Percentile of the latency (0-100) after which
+        the request is hedged.
+        :param min_delay: Minimum delay before hedging (seconds).
+        It is also the delay until min_samples latencies are collected.
+        :param budget: Share of the requests that can be hedged.
+        :param max_burst: Maximum number of hedges in a row
+        (after a period without hedging).
+        :param min_samples: Number of latency samples needed
+        to use the percentile.
+        """
+        self.__primary = primary
+        self.__secondary = secondary or primary
+        self.__percentile = percentile
+        self.__min_delay = min_delay
+        self.__budget = budget
+        self.__max_burst = max_burst
+        self.__min_samples = min_samples
+        self.__hedge_tokens = max_burst
+        self.__latency = RollingLatency()
+        self.__calls = 0
+        self.__hedges = 0
+        self.__hedge_wins = 0
+        self.__failovers = 0
+
+    @property
+    def hedge_delay(self) -> float:
+        """Return the current delay before hedging (seconds)."""
+        if len(self.__latency) < self.__min_samples:
+            return self.__min_delay
+        delay = self.__latency.percentile(self.__percentile)
+        return max(self.__min_delay, delay or 0.0)
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Return the counters of the hedges and the failovers."""
+        return {
+            "calls": self.__calls,
+            "hedges": self.__hedges,
+            "hedge_wins": self.__hedge_wins,
+            "failovers": self.__failovers,
+            "hedge_delay_ms": round(self.hedge_delay * 1e3, 1),
+            **self.__latency.summary(),
+        }
+
+    async def warm_up(self) -> None:
+        """Warm up the clients."""
+        await self.__primary.warm_up()
+        if self.__secondary is not self.__primary:
+            await self.__secondary.warm_up()
+
+    async def close(self) -> None:
+        """Close the clients."""
+        await self.__primary.close()
+        if self.__secondary is not self.__primary:
+            await self.__secondary.close()
+
+    def __take_hedge_token(self) -> bool:
+        """Return True, if the budget allows one more hedge."""
+        if self.__hedge_tokens < 1:
+            return False
+        self.__hedge_tokens -= 1
+        return True
+
+    @classmethod
+    def __failed(cls, responses: List[ModerationResponse]) -> bool:
+        """Return True, if all the images failed."""
+        return all(response.status == "ERROR" for response in responses)
+
+    async def __timed(
+        self, call: Call, client: NSFWClient
+    ) -> List[ModerationResponse]:
+        """Call the client and record the latency of the successful call."""
+        start = perf_counter()
+        responses = await call(client)
+        if not self.__failed(responses):
+            self.__latency.add(perf_counter() - start)
+        return responses
+
+    async def __hedged(self, call: Call) -> List[ModerationResponse]:
+        """
+        Call the primary client and hedge the call if it is slow.
+
+        :raise Exception: The error of the last call, if all the calls
+        raised.
+        """
+        self.__calls += 1
+        self.__hedge_tokens = min(
+            self.__hedge_tokens + self.__budget, self.__max_burst
+        )
+        primary = asyncio.create_task(self.__timed(call, self.__primary))
+        pending: Set[asyncio.Task[List[ModerationResponse]]] = {primary}
+        hedge: Optional[asyncio.Task[List[ModerationResponse]]] = None
+        responses: Optional[List[ModerationResponse]] = None
+        error: Optional[BaseException] = None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_delay)
+            if not done and self.__take_hedge_token():
+                self.__hedges += 1
+                logger.debug(
+                    "Hedging the request after %.3f s.", self.hedge_delay
+                )
+                hedge = asyncio.create_task(
+                    self.__timed(call, self.__secondary)
+                )
+                pending.add(hedge)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    error = task.exception() or error
+                    if task.exception() is not None:
+                        logger.warning(
+                            "%s call failed: %r",
+                            "Hedged" if task is hedge else "Primary",
+                            task.exception(),
+                        )
+                        continue
+                    responses = task.result()
+                    if not self.__failed(responses):
+                        if task is hedge:
+                            self.__hedge_wins += 1
+                        return responses
+            if responses is not None:
+                return responses
+            assert error is not None
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def moderate(
+        self, moderation_request: ModerationRequest
+    ) -> ModerationResponse:
+        """
+        Moderate nsfw.
+
+        :param moderation_request: Moderation request object.
+        :return: The first successful moderation response.
+        """
+        responses = await self.moderate_batch([moderation_request])
+        return responses[0]
+
+    async def moderate_batch(
+        self, moderation_requests: List[ModerationRequest]
+    ) -> List[ModerationResponse]:
+        """
+        Moderate several images.
+
+        :param moderation_requests: Moderation request objects.
+        :return: Moderation responses in the order of the requests.
+        """
+
+        async def call(client: NSFWClient) -> List[ModerationResponse]:
+            """Moderate the images with the client."""
+            if len(moderation_requests) == 1:
+                return [await client.moderate(moderation_requests[0])]
+            return await client.moderate_batch(moderation_requests)
+
+        try:
+            responses = await self.__hedged(call)
+        except NSFWClientThrottledError:
+            if self.__secondary is self.__primary:
+                raise
+            responses = [
+                ModerationResponse(id=request.id, status="ERROR")
+                for request in moderation_requests
+            ]
+
+        failed = [
+            i
+            for i, response in enumerate(responses)
+            if response.status == "ERROR"
+        ]
+        if failed and self.__secondary is not self.__primary:
+            self.__failovers += len(failed)
+            logger.warning(
+                "%d images failed, failing over to the secondary client.",
+                len(failed),
+            )
+            # if throttled too, the requests are retried later
+            failover_responses = await self.__secondary.moderate_batch(
+                [moderation_requests[i] for i in failed]
+            )
+            for i, response in zip(failed, failover_responses):
+                responses[i] = response
+        return responses
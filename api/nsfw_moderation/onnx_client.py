@@ -0,0 +1,314 @@
+"""The module responsible for the local NSFW classifier (ONNX Runtime)."""
+
+import asyncio
+import base64
+import io
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from functools import partial
+from logging import getLogger
+from time import perf_counter
+from typing import Any, List, Optional, Sequence, Tuple
+
+import httpx
+
+from blob_store.base import BlobStore
+from config.app import LocalModelConfig
+from schemas.moderation import ModerationRequest, ModerationResponse
+
+from .base import NSFWClient
+
+try:
+    import numpy as np
+    import onnxruntime as ort
+    from PIL import Image
+except ImportError:  # only needed if the local model is used
+    np = None  # type: ignore[assignment]
+    ort = None
+    Image = None  # type: ignore[assignment]
+
+logger = getLogger("main.api.onnx_client")
+
+
+def preprocess_image(
+    image_bytes: bytes,
+    input_size: int,
+    layout: str,
+    mean: Sequence[float],
+    std: Sequence[float],
+) -> Any:
+    """
+    Decode the image and convert it to the model input.
+
+    Runs in the thread/process pool, so it is a module-level function.
+
+    :return: Float32 array of shape (3, size, size) for the NCHW layout
+    or (size, size, 3) for the NHWC layout.
+    :raise ValueError: If the image cannot be decoded.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # JPEG is decoded right at the reduced scale
+            image.draft("RGB", (input_size, input_size))
+            resized = image.convert("RGB").resize(
+                (input_size, input_size), Image.Resampling.BILINEAR
+            )
+            array = np.asarray(resized, dtype=np.float32) / 255.0
+    except OSError as exc:
+        raise ValueError(f"Cannot decode the image: {exc}") from exc
+    array = (
+        (array - np.asarray(mean, dtype=np.float32))
+        / np.asarray(std, dtype=np.float32)
+    ).astype(np.float32)
+    if layout == "NCHW":
+        array = array.transpose(2, 0, 1)
+    return np.ascontiguousarray(array, dtype=np.float32)
+
+
+class OnnxNSFWClient(NSFWClient):
+    """
+    Local NSFW classifier on CPU (ONNX Runtime).
+
+    The images are decoded and resized in a thread/process pool
+    and classified in batches. The model runs in one thread at a time
+    (it uses config.threads threads by itself).
+    """
+
+    def __init__(
+        self,
+        config: LocalModelConfig,
+        httpx_client: httpx.AsyncClient,
+        blob_store: Optional[BlobStore] = None,
+    ):
+        """
+        Init class.
+
+        :param config: Local model config.
+        :param httpx_client: HTTPX client to download the images by URL
+        (the URLs of the users: it must connect only to the public
+        addresses, see create_httpx_client).
+        :param blob_store: Store of the images referenced by the requests.
+        :raise RuntimeError: If onnxruntime, numpy or Pillow
+        is not installed.
+        """
+        if ort is None or np is None or Image is None:
+            raise RuntimeError(
+                "onnxruntime, numpy and Pillow are required "
+                "for the local model."
+            )
+        self.__config = config
+        self.__blob_store = blob_store
+        self.__client = httpx_client
+
+        options = ort.SessionOptions()
+        if config.threads > 0:
+            options.intra_op_num_threads = config.threads
+        self.__session = ort.InferenceSession(
+            config.path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        model_input = self.__session.get_inputs()[0]
+        self.__input_name: str = model_input.name
+        # the model may be exported with the fixed batch size
+        self.__fixed_batch = isinstance(model_input.shape[0], int)
+        self.__batch_size = (
+            model_input.shape[0]
+            if self.__fixed_batch
+            else config.max_batch_size
+        )
+        self.__nsfw_labels = list(config.nsfw_labels)
+
+        self.__decode_executor: Executor
+        if config.decode_in_processes:
+            self.__decode_executor = ProcessPoolExecutor(config.decode_workers)
+        else:
+            self.__decode_executor = ThreadPoolExecutor(
+                config.decode_workers, thread_name_prefix="decode"
+            )
+        self.__inference_executor = ThreadPoolExecutor(
+            1, thread_name_prefix="inference"
+        )
+        logger.info(
+            "Local model %s loaded (input %s, batch size %d).",
+            config.path,
+            model_input.shape,
+            self.__batch_size,
+        )
+
+    async def warm_up(self) -> None:
+        """Run the model once, so the first requests are not slow."""
+        size = self.__config.input_size
+        shape: Tuple[int, ...] = (
+            (self.__batch_size, 3, size, size)
+            if self.__config.layout == "NCHW"
+            else (self.__batch_size, size, size, 3)
+        )
+        start = perf_counter()
+        await asyncio.get_running_loop().run_in_executor(
+            self.__inference_executor,
+            self.__infer,
+            np.zeros(shape, dtype=np.float32),
+        )
+        logger.info(
+            "Local model warmed up in %.1f ms.", (perf_counter() - start) * 1e3
+        )
+
+    async def close(self) -> None:
+        """Shut down the thread/process pools."""
+        self.__decode_executor.shutdown(wait=False, cancel_futures=True)
+        self.__inference_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __download(self, url: str) -> bytes:
+        """
+        Download the image, at most max_image_size bytes.
+
+        :raise ValueError: If the image is too large.
+        :raise httpx.HTTPError: If the image cannot be downloaded.
+        """
+        max_size = self.__config.max_image_size
+        async with self.__client.stream("GET", url) as resp:
+            resp.raise_for_status()
+            content_length = resp.headers.get("Content-Length", "")
+            if content_length.isdigit() and int(content_length) > max_size:
+                raise ValueError("Image is too large.")
+            chunks: List[bytes] = []
+            size = 0
+            async for chunk in resp.aiter_bytes():
+                size += len(chunk)
+                if size > max_size:
+                    raise ValueError("Image is too large.")
+                chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def __image_bytes(
+        self, moderation_request: ModerationRequest
+    ) -> bytes:
+        """
+        Return the image of the moderation request.
+
+        :raise ValueError: If image is not url or base64
+        or the downloaded image is too large.
+        :raise BlobNotFoundError: If the referenced image does not exist.
+        :raise httpx.HTTPError: If the image cannot be downloaded.
+        """
+        if moderation_request.image_bytes is not None:
+            return moderation_request.image_bytes
+        if moderation_request.blob_ref is not None:
+            if self.__blob_store is None:
+                raise ValueError("Blob store is not configured.")
+            return await self.__blob_store.get(moderation_request.blob_ref)
+        if moderation_request.image.startswith(("http://", "https://")):
+            return await self.__download(moderation_request.image)
+        try:
+            return base64.b64decode(moderation_request.image, validate=True)
+        except ValueError:
+            raise ValueError("Unrecognized image format.")
+
+    async def __preprocess(self, moderation_request: ModerationRequest) -> Any:
+        """Return the model input for the moderation request."""
+        image_bytes = await self.__image_bytes(moderation_request)
+        return await asyncio.get_running_loop().run_in_executor(
+            self.__decode_executor,
+            partial(
+                preprocess_image,
+                image_bytes,
+                self.__config.input_size,
+                self.__config.layout,
+                self.__config.mean,
+                self.__config.std,
+            ),
+        )
+
+    def __infer(self, batch: Any, count: Optional[int] = None) -> Any:
+        """
+        Return the nsfw scores of the first count images of the batch.
+
+        The outputs are converted to probabilities with softmax
+        unless they are probabilities already (the padding
+        is not taken into account).
+        """
+        outputs = self.__session.run(None, {self.__input_name: batch})[0]
+        outputs = np.asarray(outputs, dtype=np.float32).reshape(len(batch), -1)
+        outputs = outputs[:count]
+        if (outputs < 0).any() or not np.allclose(
+            outputs.sum(axis=1), 1.0, atol=1e-3
+        ):
+            outputs = np.exp(outputs - outputs.max(axis=1, keepdims=True))
+            outputs /= outputs.sum(axis=1, keepdims=True)
+        return outputs[:, self.__nsfw_labels].sum(axis=1)
+
+    async def moderate(
+        self, moderation_request: ModerationRequest
+    ) -> ModerationResponse:
+        """
+        Moderate nsfw.
+
+        :param moderation_request: Moderation request object.
+        :return: Moderation response.
+        If the image cannot be decoded, the response status is ERROR.
+        """
+        responses = await self.moderate_batch([moderation_request])
+        return responses[0]
+
+    async def moderate_batch(
+        self, moderation_requests: List[ModerationRequest]
+    ) -> List[ModerationResponse]:
+        """
+        Moderate several images in batches of the model.
+
+        The failure of one image does not affect the other images.
+
+        :param moderation_requests: Moderation request objects.
+        :return: Moderation responses in the order of the requests.
+        """
+        responses: List[ModerationResponse] = [
+            ModerationResponse(id=request.id, status="ERROR")
+            for request in moderation_requests
+        ]
+        results = await asyncio.gather(
+            *(self.__preprocess(request) for request in moderation_requests),
+            return_exceptions=True,
+        )
+        indexes: List[int] = []
+        arrays: List[Any] = []
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                logger.warning(
+                    "Invalid image %s: %r", moderation_requests[i].id, result
+                )
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                indexes.append(i)
+                arrays.append(result)
+
+        loop = asyncio.get_running_loop()
+        for start in range(0, len(arrays), self.__batch_size):
+            end = start + self.__batch_size
+            chunk_indexes = indexes[start:end]
+            batch = np.stack(arrays[start:end])
+            count = len(batch)
+            if self.__fixed_batch and len(batch) < self.__batch_size:
+                # the model with the fixed batch size needs a full batch
+                padding = np.zeros(
+                    (self.__batch_size - len(batch), *batch.shape[1:]),
+                    dtype=np.float32,
+                )
+                batch = np.concatenate([batch, padding])
+            try:
+                scores = await loop.run_in_executor(
+                    self.__inference_executor, self.__infer, batch, count
+                )
+            except Exception as exc:
+                logger.error("Local model failed: %s", str(exc))
+                continue
+            for i, nsfw in zip(chunk_indexes, scores):
+                nsfw = min(max(float(nsfw), 0.0), 1.0)
+                responses[i] = ModerationResponse(
+                    id=moderation_requests[i].id, sfw=1.0 - nsfw, nsfw=nsfw
+                )
+        return responses
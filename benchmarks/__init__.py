@@ -0,0 +1 @@
+"""The package responsible for the performance benchmarks."""
@@ -0,0 +1,80 @@
+"""
+Microbenchmark of the queue message codecs.
+
+Compares the legacy path (base64 in the server, pydantic JSON,
+base64 validation in the moderator) with the binary frame:
+bytes per message and CPU time of encoding + decoding.
+
+Usage:
+    python -m benchmarks.codec
+"""
+
+import argparse
+import base64
+import os
+from time import process_time
+from typing import Callable, Dict, List
+
+from con_prod.codec import decode_request, encode_request
+from schemas import ModerationRequest
+
+
+def legacy_round_trip(image_bytes: bytes) -> int:
+    """Encode and decode the request as before the binary codec."""
+    image_str = base64.b64encode(image_bytes).decode("utf-8")
+    message = ModerationRequest(image=image_str).model_dump_json()
+    moderation_request = ModerationRequest.model_validate_json(message)
+    base64.b64decode(moderation_request.image, validate=True)
+    return len(message)
+
+
+def binary_round_trip(image_bytes: bytes) -> int:
+    """Encode and decode the request with the binary codec."""
+    message = encode_request(ModerationRequest(image_bytes=image_bytes))
+    decode_request(message)
+    return len(message)
+
+
+def measure(
+    round_trip: Callable[[bytes], int], image_bytes: bytes, repeat: int
+) -> Dict[str, float]:
+    """Return the message size and the mean CPU time of the round trip."""
+    size = round_trip(image_bytes)
+    start = process_time()
+    for _ in range(repeat):
+        round_trip(image_bytes)
+    return {
+        "message_bytes": size,
+        "cpu_ms": round((process_time() - start) / repeat * 1e3, 3),
+    }
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes-kb", type=int, nargs="+", default=[100, 1024, 5120, 15360]
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    results: List[Dict[str, float]] = []
+    for size_kb in args.sizes_kb:
+        image_bytes = os.urandom(size_kb * 1024)
+        legacy = measure(legacy_round_trip, image_bytes, args.repeat)
+        binary = measure(binary_round_trip, image_bytes, args.repeat)
+        results.append(
+            {
+                "image_kb": size_kb,
+                "json_bytes": legacy["message_bytes"],
+                "binary_bytes": binary["message_bytes"],
+                "json_cpu_ms": legacy["cpu_ms"],
+                "binary_cpu_ms": binary["cpu_ms"],
+            }
+        )
+    for result in results:
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
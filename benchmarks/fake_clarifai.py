@@ -0,0 +1,227 @@
+r"""
+Fake Clarifai NSFW API for the end-to-end benchmarks.
+
+Answers the model outputs requests (multi-input, at any path)
+in the Clarifai format, so the moderator can be benchmarked without paying for
+the API calls. The latency of a request is lognormal (median and sigma)
+plus a per-input cost; a share of the requests is throttled (429 with
+Retry-After), as are the requests above the concurrency limit; a share
+of the inputs fails. The score of an image depends on its hash only,
+so the same image always gets the same verdict. GET /stats returns
+the counters.
+
+Usage:
+    python -m benchmarks.fake_clarifai --port 8081 --latency-ms 300
+    CLARIFAI_BASE_URL=http://localhost:8081/outputs \
+        python -m services.moderation
+"""
+
+import argparse
+import asyncio
+import hashlib
+import math
+import random
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Clarifai status codes
+SUCCESS = 10000
+MIXED_STATUS = 10010
+INPUT_FAILED = 30002
+
+
+class FakeClarifai(object):
+    """Behaviour and counters of the fake API."""
+
+    def __init__(
+        self,
+        latency_ms: float = 300.0,
+        latency_sigma: float = 0.5,
+        per_input_ms: float = 5.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: float = 1.0,
+        max_concurrency: int = 0,
+        nsfw_rate: float = 0.1,
+        seed: int = 0,
+    ):
+        """
+        Init class.
+
+        :param latency_ms: Median latency of a request (milliseconds).
+        :param latency_sigma: Sigma of the lognormal latency (0 - fixed).
+        :param per_input_ms: Extra latency per input (milliseconds).
+        :param error_rate: Share of the inputs that fail.
+        :param throttle_rate: Share of the requests answered with 429.
+        :param retry_after: Retry-After of the 429 answers (seconds).
+        :param max_concurrency: The requests above it are answered
+        with 429 (0 - unlimited).
+        :param nsfw_rate: Share of the images scored as NSFW.
+        :param seed: Seed of the random latencies and failures.
+        """
+        self.__latency_ms = latency_ms
+        self.__latency_sigma = latency_sigma
+        self.__per_input_ms = per_input_ms
+        self.__error_rate = error_rate
+        self.__throttle_rate = throttle_rate
+        self.__retry_after = retry_after
+        self.__max_concurrency = max_concurrency
+        self.__nsfw_rate = nsfw_rate
+        self.__random = random.Random(seed)
+        self.__in_flight = 0
+        self.__stats: Dict[str, int] = {
+            "requests": 0,
+            "inputs": 0,
+            "throttled": 0,
+            "failed_inputs": 0,
+            "max_in_flight": 0,
+        }
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Return the counters."""
+        return dict(self.__stats, in_flight=self.__in_flight)
+
+    def __latency(self, inputs: int) -> float:
+        """Return the latency of the request (seconds)."""
+        latency_ms = self.__latency_ms
+        if self.__latency_sigma > 0:
+            latency_ms = self.__random.lognormvariate(
+                math.log(self.__latency_ms), self.__latency_sigma
+            )
+        return (latency_ms + self.__per_input_ms * inputs) / 1e3
+
+    def __nsfw(self, image: Dict[str, Any]) -> float:
+        """Return the NSFW score of the image (by its hash)."""
+        key = str(image.get("base64") or image.get("url") or "").encode()
+        digest = hashlib.sha256(key).digest()
+        share = int.from_bytes(digest[:8], "big") / 2**64
+        if share < self.__nsfw_rate:
+            return 0.8 + 0.2 * share / self.__nsfw_rate
+        return 0.5 * (share - self.__nsfw_rate) / (1 - self.__nsfw_rate)
+
+    def __output(self, input_: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the output of the input."""
+        input_id = input_.get("id", "")
+        if self.__random.random() < self.__error_rate:
+            self.__stats["failed_inputs"] += 1
+            return {
+                "id": input_id,
+                "status": {
+                    "code": INPUT_FAILED,
+                    "description": "Input failed (fake).",
+                },
+                "input": {"id": input_id},
+            }
+        nsfw = self.__nsfw(input_.get("data", {}).get("image", {}))
+        return {
+            "id": input_id,
+            "status": {"code": SUCCESS, "description": "Ok"},
+            "input": {"id": input_id},
+            "data": {
+                "concepts": sorted(
+                    [
+                        {"name": "nsfw", "value": nsfw},
+                        {"name": "sfw", "value": 1 - nsfw},
+                    ],
+                    key=lambda concept: -concept["value"],
+                )
+            },
+        }
+
+    async def outputs(self, body: Dict[str, Any]) -> JSONResponse:
+        """Answer the model outputs request."""
+        self.__stats["requests"] += 1
+        if (
+            self.__max_concurrency
+            and self.__in_flight >= self.__max_concurrency
+        ) or self.__random.random() < self.__throttle_rate:
+            self.__stats["throttled"] += 1
+            return JSONResponse(
+                status_code=429,
+                content={"status": {"code": 11005, "description": "Slow"}},
+                headers={"Retry-After": f"{self.__retry_after:g}"},
+            )
+
+        inputs: List[Dict[str, Any]] = body.get("inputs", [])
+        self.__stats["inputs"] += len(inputs)
+        self.__in_flight += 1
+        self.__stats["max_in_flight"] = max(
+            self.__stats["max_in_flight"], self.__in_flight
+        )
+        try:
+            await asyncio.sleep(self.__latency(len(inputs)))
+        finally:
+            self.__in_flight -= 1
+
+        outputs = [self.__output(input_) for input_ in inputs]
+        failed = any(output["status"]["code"] != SUCCESS for output in outputs)
+        return JSONResponse(
+            content={
+                "status": (
+                    {"code": MIXED_STATUS, "description": "Mixed status"}
+                    if failed
+                    else {"code": SUCCESS, "description": "Ok"}
+                ),
+                "outputs": outputs,
+            }
+        )
+
+
+def create_app(fake: FakeClarifai) -> FastAPI:
+    """Create the app of the fake API."""
+    app = FastAPI()
+
+    @app.get("/stats")
+    async def stats():
+        """Return the counters."""
+        return fake.stats
+
+    @app.post("/{path:path}")
+    async def outputs(path: str, request: Request):
+        """Answer the model outputs request (any path)."""
+        return await fake.outputs(await request.json())
+
+    return app
+
+
+def main() -> None:
+    """Run the fake API."""
+    import uvicorn
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--per-input-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--max-concurrency", type=int, default=0)
+    parser.add_argument("--nsfw-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeClarifai(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        per_input_ms=args.per_input_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        max_concurrency=args.max_concurrency,
+        nsfw_rate=args.nsfw_rate,
+        seed=args.seed,
+    )
+    uvicorn.run(
+        create_app(fake), host=args.host, port=args.port, log_level="warning"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+r"""
+End-to-end load benchmark of the server.
+
+Sends images to POST /moderate/ at the target rate (open loop, --rps)
+or by a fixed number of clients (closed loop, --concurrency). For the
+answers with 202 the result is polled by GET /moderation_result/
+(with ?wait=), so the report has both the response latency and the
+latency of the result. The images are random (unique by default),
+so the results cache does not hide the pipeline. The report
+(throughput, p50/p95/p99, 202 rate, status codes, the commit) is
+written to a JSON file to compare the runs.
+
+Run the moderator against the fake API (benchmarks.fake_clarifai)
+to benchmark without the real Clarifai calls.
+
+Usage:
+    python -m benchmarks.load --rps 50 --duration 60 --output run.json
+    python -m benchmarks.load --concurrency 32 --repeat-share 0.3 \
+        --fake-clarifai http://localhost:8081
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+
+PENDING_STATUSES = ("QUEUED", "PROCESSING")
+
+
+@dataclass
+class Sample(object):
+    """Result of one moderation request."""
+
+    status_code: Optional[int] = None
+    # POST /moderate/ (seconds)
+    latency: Optional[float] = None
+    # till the verdict is known, incl. polling (seconds)
+    result_latency: Optional[float] = None
+    # OK, REJECTED, ERROR, SHED (429/503), TIMEOUT or FAILED (no answer)
+    result: str = "FAILED"
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """Return the mean, p50, p95, p99 and max (milliseconds)."""
+    if not values:
+        return {
+            "mean": None,
+            "p50": None,
+            "p95": None,
+            "p99": None,
+            "max": None,
+        }
+    ordered = sorted(values)
+
+    def at(q: float) -> float:
+        """Return the percentile q (0-100)."""
+        index = min(int(len(ordered) * q / 100), len(ordered) - 1)
+        return round(ordered[index] * 1e3, 1)
+
+    return {
+        "mean": round(sum(ordered) / len(ordered) * 1e3, 1),
+        "p50": at(50),
+        "p95": at(95),
+        "p99": at(99),
+        "max": round(ordered[-1] * 1e3, 1),
+    }
+
+
+def git_commit() -> Optional[str]:
+    """Return the commit of the working tree (None outside git)."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class LoadGenerator(object):
+    """Sends the moderation requests and collects the samples."""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        image_kb: int = 50,
+        repeat_share: float = 0.0,
+        poll: bool = True,
+        poll_timeout: float = 60.0,
+        lane: Optional[str] = None,
+    ):
+        """
+        Init class.
+
+        :param client: HTTP client with the base URL of the server.
+        :param image_kb: Size of the images (KiB).
+        :param repeat_share: Share of the requests reusing a sent image
+        (hits of the results cache).
+        :param poll: Poll the results of the accepted (202) requests.
+        :param poll_timeout: How long the result is polled (seconds).
+        :param lane: Priority lane of the requests (None - the default).
+        """
+        self.__client = client
+        self.__image_kb = image_kb
+        self.__repeat_share = repeat_share
+        self.__poll = poll
+        self.__poll_timeout = poll_timeout
+        self.__data = {"lane": lane} if lane else {}
+        self.__sent: List[bytes] = []
+        self.samples: List[Sample] = []
+
+    def __image(self) -> bytes:
+        """Return a new random image or one of the sent ones."""
+        if self.__sent and random.random() < self.__repeat_share:
+            return random.choice(self.__sent)
+        image = os.urandom(self.__image_kb * 1024)
+        if len(self.__sent) < 1000:
+            self.__sent.append(image)
+        return image
+
+    async def __poll_result(
+        self, moderation_request_id: str, deadline: float
+    ) -> str:
+        """Poll the result till it is known or the deadline."""
+        while perf_counter() < deadline:
+            wait = min(30.0, max(1.0, deadline - perf_counter()))
+            resp = await self.__client.get(
+                f"/moderation_result/{moderation_request_id}",
+                params={"wait": int(wait)},
+                timeout=wait + 10,
+            )
+            status = resp.json().get("status", "ERROR")
+            if status not in PENDING_STATUSES:
+                return status
+        return "TIMEOUT"
+
+    async def request(self) -> None:
+        """Moderate one image and record the sample."""
+        sample = Sample()
+        self.samples.append(sample)
+        image = self.__image()
+        start = perf_counter()
+        try:
+            resp = await self.__client.post(
+                "/moderate/",
+                files={"image": ("image.jpg", image)},
+                data=self.__data,
+            )
+            sample.latency = perf_counter() - start
+            sample.status_code = resp.status_code
+            if resp.status_code in (429, 503):
+                sample.result = "SHED"
+                return
+            body = resp.json()
+            sample.result = body.get("status", "ERROR")
+            if resp.status_code == 202 and self.__poll:
+                sample.result = await self.__poll_result(
+                    body["request_id"], start + self.__poll_timeout
+                )
+            if sample.result not in ("ACCEPTED", "TIMEOUT"):
+                sample.result_latency = perf_counter() - start
+        except (httpx.HTTPError, ValueError, KeyError) as exc:
+            sample.result = "FAILED"
+            sample.latency = sample.latency or perf_counter() - start
+            print(f"Request failed: {exc!r}")
+
+    async def run_open_loop(
+        self, rps: float, duration: float, max_outstanding: int
+    ) -> None:
+        """Start the requests at the rate, whatever the answers take."""
+        tasks: Set[asyncio.Task[None]] = set()
+        start = perf_counter()
+        sent = 0
+        while perf_counter() - start < duration:
+            sent += 1
+            if len(tasks) < max_outstanding:
+                task = asyncio.create_task(self.request())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            else:
+                self.samples.append(Sample(result="DROPPED"))
+            delay = start + sent / rps - perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def run_closed_loop(self, concurrency: int, duration: float) -> None:
+        """Send the next request as soon as the previous one is done."""
+        end = perf_counter() + duration
+
+        async def client_loop() -> None:
+            """Loop of one client."""
+            while perf_counter() < end:
+                await self.request()
+
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+
+
+def build_report(
+    args: argparse.Namespace,
+    samples: List[Sample],
+    elapsed: float,
+    fake_clarifai: Optional[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """Return the report of the run."""
+    status_codes: Dict[str, int] = {}
+    results: Dict[str, int] = {}
+    for sample in samples:
+        code = str(sample.status_code or "none")
+        status_codes[code] = status_codes.get(code, 0) + 1
+        results[sample.result] = results.get(sample.result, 0) + 1
+    answered = [sample for sample in samples if sample.status_code]
+    done = [
+        sample.result_latency
+        for sample in samples
+        if sample.result_latency is not None
+    ]
+    return {
+        "label": args.label,
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "params": {
+            "url": args.url,
+            "mode": "open" if args.rps else "closed",
+            "rps": args.rps,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "image_kb": args.image_kb,
+            "repeat_share": args.repeat_share,
+            "lane": args.lane,
+        },
+        "requests": len(samples),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(done) / elapsed, 2) if elapsed else None,
+        "status_codes": status_codes,
+        "accepted_rate": (
+            round(status_codes.get("202", 0) / len(answered), 4)
+            if answered
+            else None
+        ),
+        "results": results,
+        "latency_ms": percentiles(
+            [sample.latency for sample in answered if sample.latency]
+        ),
+        "result_latency_ms": percentiles(done),
+        "fake_clarifai": fake_clarifai,
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run the load and return the report."""
+    limits = httpx.Limits(
+        max_connections=args.concurrency or args.max_outstanding,
+        max_keepalive_connections=args.concurrency or 100,
+    )
+    async with httpx.AsyncClient(
+        base_url=args.url, limits=limits, timeout=args.timeout
+    ) as client:
+        generator = LoadGenerator(
+            client,
+            image_kb=args.image_kb,
+            repeat_share=args.repeat_share,
+            poll=not args.no_poll,
+            poll_timeout=args.poll_timeout,
+            lane=args.lane,
+        )
+        start = perf_counter()
+        if args.rps:
+            await generator.run_open_loop(
+                args.rps, args.duration, args.max_outstanding
+            )
+        else:
+            await generator.run_closed_loop(args.concurrency, args.duration)
+        elapsed = perf_counter() - start
+
+        fake_clarifai: Optional[Dict[str, Any]] = None
+        if args.fake_clarifai:
+            try:
+                resp = await client.get(f"{args.fake_clarifai}/stats")
+                fake_clarifai = resp.json()
+            except httpx.HTTPError as exc:
+                print(f"Failed to get the fake API stats: {exc!r}")
+    return build_report(args, generator.samples, elapsed, fake_clarifai)
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--url", default="http://localhost:8000")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--rps", type=float, help="Open loop: requests/s.")
+    mode.add_argument(
+        "--concurrency", type=int, help="Closed loop: number of clients."
+    )
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--image-kb", type=int, default=50)
+    parser.add_argument("--repeat-share", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--poll-timeout", type=float, default=60.0)
+    parser.add_argument("--no-poll", action="store_true")
+    parser.add_argument("--lane", help="Priority lane of the requests.")
+    parser.add_argument("--max-outstanding", type=int, default=1000)
+    parser.add_argument(
+        "--fake-clarifai", help="URL of the fake API (its stats are added)."
+    )
+    parser.add_argument("--label", default="")
+    parser.add_argument("--output", default="benchmark_report.json")
+    args = parser.parse_args()
+    if not args.rps and not args.concurrency:
+        args.concurrency = 8
+
+    report = asyncio.run(run(args))
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Benchmark of the near-duplicate images index.
+
+Measures the lookup latency of HammingIndex with random hashes
+and the precision/recall of dHash on a corpus of images and their
+re-encoded, resized and metadata-stripped copies.
+
+Usage:
+    python -m benchmarks.near_duplicates --size 1000000
+    python -m benchmarks.near_duplicates --corpus path/to/images
+"""
+
+import argparse
+import io
+import random
+from pathlib import Path
+from statistics import quantiles
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+
+from PIL import Image, ImageDraw
+
+from services.near_duplicates import HammingIndex, dhash
+
+Transform = Callable[[Image.Image], bytes]
+
+
+def benchmark_lookup(
+    size: int, max_distance: int, queries: int
+) -> Dict[str, float]:
+    """Measure the lookup latency of the index with random hashes."""
+    rnd = random.Random(0)
+    index: HammingIndex[int] = HammingIndex(max_distance)
+    start = perf_counter()
+    for i in range(size):
+        index.add(rnd.getrandbits(64), i)
+    build_time = perf_counter() - start
+
+    latencies: List[float] = []
+    for _ in range(queries):
+        hash_ = rnd.getrandbits(64)
+        start = perf_counter()
+        index.search(hash_)
+        latencies.append((perf_counter() - start) * 1e6)
+    percentiles = quantiles(latencies, n=100)
+    return {
+        "size": size,
+        "max_distance": max_distance,
+        "build_s": round(build_time, 2),
+        "lookup_p50_us": round(percentiles[49], 1),
+        "lookup_p99_us": round(percentiles[98], 1),
+    }
+
+
+def _encode(image: Image.Image, fmt: str = "JPEG", **params) -> bytes:
+    """Encode the image."""
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **params)
+    return buffer.getvalue()
+
+
+TRANSFORMS: Dict[str, Transform] = {
+    "jpeg_q30": lambda image: _encode(image, quality=30),
+    "jpeg_q70": lambda image: _encode(image, quality=70),
+    "resize_50": lambda image: _encode(
+        image.resize((image.width // 2, image.height // 2))
+    ),
+    "resize_150": lambda image: _encode(
+        image.resize((image.width * 3 // 2, image.height * 3 // 2))
+    ),
+    "png": lambda image: _encode(image, fmt="PNG"),
+    "strip_metadata": lambda image: _encode(
+        Image.frombytes(image.mode, image.size, image.tobytes()), quality=95
+    ),
+}
+
+
+def _synthetic_image(rnd: random.Random) -> Image.Image:
+    """Draw a random image of shapes."""
+    image = Image.new(
+        "RGB", (640, 480), tuple(rnd.randrange(256) for _ in range(3))
+    )
+    draw = ImageDraw.Draw(image)
+    for _ in range(rnd.randint(5, 15)):
+        x0, y0 = rnd.randrange(640), rnd.randrange(480)
+        x1, y1 = x0 + rnd.randint(20, 300), y0 + rnd.randint(20, 300)
+        color = tuple(rnd.randrange(256) for _ in range(3))
+        if rnd.random() < 0.5:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+        else:
+            draw.ellipse((x0, y0, x1, y1), fill=color)
+    return image
+
+
+def _load_corpus(corpus: Path | None, size: int) -> List[Image.Image]:
+    """Return the images of the corpus or synthetic images."""
+    if corpus is None:
+        rnd = random.Random(1)
+        return [_synthetic_image(rnd) for _ in range(size)]
+    images = []
+    for path in sorted(corpus.iterdir())[:size]:
+        try:
+            with Image.open(path) as image:
+                images.append(image.convert("RGB"))
+        except OSError:
+            continue
+    return images
+
+
+def benchmark_quality(
+    images: List[Image.Image], max_distance: int
+) -> Dict[str, float]:
+    """
+    Measure the precision/recall of the near-duplicate search.
+
+    Half of the images are indexed. The copies of the indexed images must
+    be found (true positives), the other images and their copies must not.
+    """
+    half = len(images) // 2
+    indexed, others = images[:half], images[half:]
+    index: HammingIndex[int] = HammingIndex(max_distance)
+    for i, image in enumerate(indexed):
+        index.add(dhash(_encode(image, quality=90)), i)
+
+    queries: List[Tuple[int | None, bytes]] = []
+    for expected, group in ((True, indexed), (False, others)):
+        for i, image in enumerate(group):
+            for transform in TRANSFORMS.values():
+                queries.append((i if expected else None, transform(image)))
+
+    true_positives = false_positives = false_negatives = 0
+    hash_time = 0.0
+    for expected_id, image_bytes in queries:
+        start = perf_counter()
+        hash_ = dhash(image_bytes)
+        hash_time += perf_counter() - start
+        found = index.search(hash_)
+        if found is not None and found[1] == expected_id:
+            true_positives += 1
+        elif found is not None:
+            false_positives += 1
+        if expected_id is not None and (
+            found is None or found[1] != expected_id
+        ):
+            false_negatives += 1
+
+    return {
+        "images": len(images),
+        "queries": len(queries),
+        "max_distance": max_distance,
+        "precision": round(
+            true_positives / max(true_positives + false_positives, 1), 4
+        ),
+        "recall": round(
+            true_positives / max(true_positives + false_negatives, 1), 4
+        ),
+        "hash_mean_ms": round(hash_time / len(queries) * 1e3, 2),
+    }
+
+
+def main() -> None:
+    """Run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=10_000)
+    parser.add_argument("--corpus", type=Path, default=None)
+    parser.add_argument("--corpus-size", type=int, default=200)
+    parser.add_argument(
+        "--max-distance", type=int, nargs="+", default=[2, 4, 6, 8]
+    )
+    args = parser.parse_args()
+
+    images = _load_corpus(args.corpus, args.corpus_size)
+    for max_distance in args.max_distance:
+        print(benchmark_lookup(args.size, max_distance, args.queries))
+        print(benchmark_quality(images, max_distance))
+
+
+if __name__ == "__main__":
+    main()
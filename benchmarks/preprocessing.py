@@ -0,0 +1,117 @@
+"""
+Benchmark of the image preprocessing (downscale + re-encode).
+
+For each image size bucket measures the bytes sent to the NSFW API
+(base64 in JSON, as ClarifaiClient sends them) with and without
+preprocessing, the CPU time of preprocessing and the upload time
+modeled by the bandwidth and the round trip time to the API.
+
+Usage:
+    python -m benchmarks.preprocessing
+    python -m benchmarks.preprocessing --bandwidth-mbps 20 --format WEBP
+"""
+
+import argparse
+import io
+import random
+from time import process_time
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageFilter
+
+from services.preprocessing import downscale_image
+
+BUCKETS: Dict[str, Tuple[int, int]] = {
+    "0.3MP": (640, 480),
+    "2MP": (1920, 1080),
+    "12MP": (4032, 3024),
+    "24MP": (6000, 4000),
+}
+
+
+def _photo(size: Tuple[int, int], seed: int) -> bytes:
+    """
+    Return a synthetic photo-like JPEG (smooth shapes with sensor noise).
+
+    The noise makes the JPEG as large as a real photo of the same size.
+    """
+    rnd = random.Random(seed)
+    small = Image.new("RGB", (64, 48))
+    small.putdata(
+        [
+            tuple(rnd.randrange(256) for _ in range(3))  # type: ignore
+            for _ in range(64 * 48)
+        ]
+    )
+    image = small.resize(size, Image.Resampling.BICUBIC).filter(
+        ImageFilter.GaussianBlur(4)
+    )
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    image = Image.blend(image, noise, 0.15)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def _upload_ms(size: float, bandwidth_mbps: float, rtt_ms: float) -> float:
+    """Return the modeled time of sending size bytes to the API."""
+    return rtt_ms + size * 8 / (bandwidth_mbps * 1e6) * 1e3
+
+
+def benchmark_bucket(
+    name: str,
+    size: Tuple[int, int],
+    args: argparse.Namespace,
+) -> Dict[str, float | str]:
+    """Measure the preprocessing of the images of the bucket."""
+    images: List[bytes] = [_photo(size, seed) for seed in range(args.images)]
+    original = sum(len(image) for image in images) / len(images)
+
+    start = process_time()
+    processed_images = [
+        downscale_image(image, args.max_size, args.format, args.quality)
+        for image in images
+    ]
+    cpu_ms = (process_time() - start) / len(images) * 1e3
+    processed = sum(len(image) for image in processed_images) / len(images)
+
+    # base64 in the JSON body of the request
+    original_wire = original * 4 / 3
+    processed_wire = processed * 4 / 3
+    return {
+        "bucket": name,
+        "original_kb": round(original / 1024, 1),
+        "wire_kb": round(original_wire / 1024, 1),
+        "preprocessed_wire_kb": round(processed_wire / 1024, 1),
+        "upload_ms": round(
+            _upload_ms(original_wire, args.bandwidth_mbps, args.rtt_ms), 1
+        ),
+        "preprocessed_upload_ms": round(
+            _upload_ms(processed_wire, args.bandwidth_mbps, args.rtt_ms)
+            + cpu_ms,
+            1,
+        ),
+        "preprocess_cpu_ms": round(cpu_ms, 1),
+    }
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=5)
+    parser.add_argument("--max-size", type=int, default=512)
+    parser.add_argument("--format", default="JPEG", choices=["JPEG", "WEBP"])
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--bandwidth-mbps", type=float, default=50.0)
+    parser.add_argument("--rtt-ms", type=float, default=50.0)
+    parser.add_argument(
+        "--buckets", nargs="+", default=list(BUCKETS), choices=list(BUCKETS)
+    )
+    args = parser.parse_args()
+
+    for name in args.buckets:
+        print(benchmark_bucket(name, BUCKETS[name], args))
+
+
+if __name__ == "__main__":
+    main()
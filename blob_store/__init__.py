@@ -0,0 +1,29 @@
+"""The package responsible for storing images outside the queue."""
+
+from typing import Optional
+
+from redis.asyncio import Redis
+
+from config.app import BlobStoreConfig
+
+from .base import BlobNotFoundError, BlobStore
+from .filesystem import FileSystemBlobStore
+from .redis_store import RedisBlobStore
+
+
+def create_blob_store(
+    config: BlobStoreConfig, redis_client: Redis
+) -> Optional[BlobStore]:
+    """
+    Create the blob store by config.
+
+    :return: Blob store or None, if the images are put into the queue.
+    :raise ValueError: If the backend is unknown.
+    """
+    if config.backend == "inline":
+        return None
+    if config.backend == "redis":
+        return RedisBlobStore(ttl=config.ttl, redis_client=redis_client)
+    if config.backend == "filesystem":
+        return FileSystemBlobStore(directory=config.directory, ttl=config.ttl)
+    raise ValueError(f"Unknown blob store backend: {config.backend}")
@@ -0,0 +1,43 @@
+"""The module responsible for the blob store interface."""
+
+from abc import ABC, abstractmethod
+
+
+class BlobNotFoundError(LookupError):
+    """The blob does not exist or has expired."""
+
+
+class BlobStore(ABC):
+    """
+    Base blob store interface.
+
+    The store keeps the image bytes while the moderation request
+    (carrying only the reference to the blob) waits in the queue.
+    """
+
+    @abstractmethod
+    async def put(self, data: bytes) -> str:
+        """Save the blob and return its reference."""
+        pass
+
+    @abstractmethod
+    async def get(self, ref: str) -> bytes:
+        """
+        Return the blob.
+
+        :raise BlobNotFoundError: If the blob does not exist.
+        """
+        pass
+
+    @abstractmethod
+    async def delete(self, ref: str) -> None:
+        """Delete the blob (if it exists)."""
+        pass
+
+    async def purge_expired(self) -> int:
+        """
+        Delete the expired blobs and return their number.
+
+        Stores that expire blobs by themselves do nothing.
+        """
+        return 0
@@ -0,0 +1,88 @@
+"""The module responsible for the blob store based on a directory."""
+
+import asyncio
+import os
+import time
+from pathlib import Path
+from uuid import uuid4
+
+from .base import BlobNotFoundError, BlobStore
+
+
+class FileSystemBlobStore(BlobStore):
+    """
+    Blob store keeping blobs in files of a local or shared directory.
+
+    The server and the moderator must see the same directory
+    (for example, a docker volume).
+    """
+
+    def __init__(self, directory: str, ttl: int):
+        """
+        Init class.
+
+        :param directory: Directory of the blobs (created if not exists).
+        :param ttl: Time to live of the blobs (seconds).
+        Expired blobs are deleted by purge_expired.
+        """
+        self.__directory = Path(directory)
+        self.__directory.mkdir(parents=True, exist_ok=True)
+        self.__ttl = ttl
+
+    def __path(self, ref: str) -> Path:
+        """
+        Return the path of the blob.
+
+        :raise BlobNotFoundError: If the reference is not a blob name.
+        """
+        if not ref.isalnum():
+            raise BlobNotFoundError(ref)
+        return self.__directory / ref
+
+    def __write(self, ref: str, data: bytes) -> None:
+        """Write the blob atomically."""
+        tmp_path = self.__directory / f".{ref}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, self.__path(ref))
+
+    def __read(self, ref: str) -> bytes:
+        """Read the blob."""
+        try:
+            return self.__path(ref).read_bytes()
+        except FileNotFoundError:
+            raise BlobNotFoundError(ref)
+
+    def __purge_expired(self) -> int:
+        """Delete the blobs older than TTL."""
+        expired_before = time.time() - self.__ttl
+        purged = 0
+        for path in self.__directory.iterdir():
+            try:
+                if path.stat().st_mtime < expired_before:
+                    path.unlink()
+                    purged += 1
+            except FileNotFoundError:
+                continue
+        return purged
+
+    async def put(self, data: bytes) -> str:
+        """Save the blob and return its reference."""
+        ref = uuid4().hex
+        await asyncio.to_thread(self.__write, ref, data)
+        return ref
+
+    async def get(self, ref: str) -> bytes:
+        """
+        Return the blob.
+
+        :raise BlobNotFoundError: If the blob does not exist.
+        """
+        return await asyncio.to_thread(self.__read, ref)
+
+    async def delete(self, ref: str) -> None:
+        """Delete the blob (if it exists)."""
+        await asyncio.to_thread(self.__path(ref).unlink, True)
+
+    async def purge_expired(self) -> int:
+        """Delete the blobs older than TTL and return their number."""
+        return await asyncio.to_thread(self.__purge_expired)
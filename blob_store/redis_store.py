@@ -0,0 +1,58 @@
+"""The module responsible for the blob store based on Redis."""
+
+from typing import Optional
+from uuid import uuid4
+
+from redis.asyncio import Redis
+
+from utils.redis import RedisMixin
+
+from .base import BlobNotFoundError, BlobStore
+
+
+class RedisBlobStore(RedisMixin, BlobStore):
+    """Blob store keeping blobs in redis binary keys with TTL."""
+
+    KEY_PREFIX: str = "moderation_blob:"
+
+    def __init__(
+        self,
+        ttl: int,
+        redis_client: Optional[Redis] = None,
+        redis_url: Optional[str] = None,
+    ):
+        """
+        Init class.
+
+        :param ttl: Time to live of the blobs (seconds).
+        :param redis_client: Redis client.
+        :param redis_url: Redis url
+        :raise ValueError: If redis_client and redis_url are None.
+        """
+        super().__init__(redis_client=redis_client, redis_url=redis_url)
+        self.__ttl = ttl
+
+    async def put(self, data: bytes) -> str:
+        """Save the blob and return its reference."""
+        ref = uuid4().hex
+        async with self.get_redis_conn() as redis_client:
+            await redis_client.set(self.KEY_PREFIX + ref, data, ex=self.__ttl)
+        return ref
+
+    async def get(self, ref: str) -> bytes:
+        """
+        Return the blob.
+
+        :raise BlobNotFoundError: If the blob does not exist.
+        """
+        async with self.get_redis_conn() as redis_client:
+            data = await redis_client.get(self.KEY_PREFIX + ref)
+        if data is None:
+            raise BlobNotFoundError(ref)
+        # the client does not decode the responses
+        return data if isinstance(data, bytes) else data.encode()
+
+    async def delete(self, ref: str) -> None:
+        """Delete the blob (if it exists)."""
+        async with self.get_redis_conn() as redis_client:
+            await redis_client.delete(self.KEY_PREFIX + ref)
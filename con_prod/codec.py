@@ -0,0 +1,126 @@
+"""
+The module responsible for the wire format of the queue messages.
+
+Binary frame (version 1):
+    magic (1 byte, 0xC1) | version (1 byte) | header length (uint32, BE)
+    | header (JSON of the message without the image bytes)
+    | payload (raw image bytes, may be empty)
+
+0xC1 never occurs in UTF-8, so a frame can't be confused with a JSON
+message. JSON messages (written before the binary format was introduced)
+are still decoded.
+"""
+
+import base64
+import json
+import struct
+from typing import Tuple, Union
+
+from schemas import ModerationRequest, ModerationResponse
+
+MAGIC: int = 0xC1
+VERSION: int = 1
+_PREFIX = struct.Struct("!BBI")
+
+
+def _frame(header: str, payload: bytes = b"") -> bytes:
+    """Pack the header and the payload into a binary frame."""
+    header_bytes = header.encode("utf-8")
+    return b"".join(
+        (
+            _PREFIX.pack(MAGIC, VERSION, len(header_bytes)),
+            header_bytes,
+            payload,
+        )
+    )
+
+
+def _unframe(data: bytes) -> Tuple[bytes, bytes]:
+    """
+    Unpack the binary frame into the header and the payload.
+
+    :raise ValueError: If the frame is invalid or has an unknown version.
+    """
+    if len(data) < _PREFIX.size:
+        raise ValueError("Truncated frame.")
+    _, version, header_size = _PREFIX.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"Unsupported frame version: {version}")
+    header_start = _PREFIX.size
+    header_end = header_start + header_size
+    if len(data) < header_end:
+        raise ValueError("Truncated frame.")
+    return data[header_start:header_end], data[header_end:]
+
+
+def _is_frame(data: Union[str, bytes]) -> bool:
+    """Return True, if the message is a binary frame."""
+    return isinstance(data, bytes) and data[:1] == bytes((MAGIC,))
+
+
+def encode_request(
+    moderation_request: ModerationRequest, binary: bool = True
+) -> bytes:
+    """
+    Encode the moderation request.
+
+    :param moderation_request: Moderation request.
+    :param binary: If False, the request is encoded as JSON
+    (the image bytes are base64 encoded into the image field).
+    """
+    if binary:
+        return _frame(
+            moderation_request.model_dump_json(),
+            moderation_request.image_bytes or b"",
+        )
+    if moderation_request.image_bytes is not None:
+        moderation_request = moderation_request.model_copy(
+            update={
+                "image": base64.b64encode(
+                    moderation_request.image_bytes
+                ).decode(),
+                "image_bytes": None,
+            }
+        )
+    return moderation_request.model_dump_json().encode("utf-8")
+
+
+def decode_request(data: Union[str, bytes]) -> ModerationRequest:
+    """
+    Decode the moderation request (binary frame or JSON).
+
+    :raise ValueError: If the message is invalid.
+    """
+    if not _is_frame(data):
+        return ModerationRequest.model_validate_json(data)
+    header, payload = _unframe(data)  # type: ignore[arg-type]
+    fields = json.loads(header)
+    if payload:
+        fields["image_bytes"] = payload
+    return ModerationRequest.model_validate(fields)
+
+
+def encode_response(
+    moderation_response: ModerationResponse, binary: bool = True
+) -> bytes:
+    """
+    Encode the moderation response.
+
+    :param moderation_response: Moderation response.
+    :param binary: If False, the response is encoded as JSON.
+    """
+    if binary:
+        return _frame(moderation_response.model_dump_json())
+    return moderation_response.model_dump_json().encode("utf-8")
+
+
+def decode_response(data: Union[str, bytes]) -> ModerationResponse:
+    """
+    Decode the moderation response (binary frame or JSON).
+
+    :raise ValueError: If the message is invalid.
+    """
+    if not _is_frame(data):
+        return ModerationResponse.model_validate_json(data)
+    header, _ = _unframe(data)  # type: ignore[arg-type]
+    return ModerationResponse.model_validate_json(header)
@@ -1 +1,143 @@
 """The module responsible for the producer/consumer of moderation requests."""
+
+from typing import Any, Dict
+
+from redis.asyncio import Redis
+
+from config.app import (
+    MODERATION_REQUESTS_DEAD_LETTER_KEY,
+    MODERATION_REQUESTS_QUEUE_KEY,
+    MODERATION_REQUESTS_STREAM_KEY,
+    Config,
+)
+from utils.metrics import Collector, Gauge
+
+from .base import (
+    BaseModerationRequestsConsumer,
+    BaseModerationRequestsProducer,
+)
+from .consumer import ModerationRequestsConsumer
+from .lanes import lane_queue_key
+from .producer import ModerationRequestsProducer
+from .stream_consumer import StreamModerationRequestsConsumer, get_stream_stats
+from .stream_producer import StreamModerationRequestsProducer
+
+QUEUE_DEPTH = Gauge(
+    "moderation_queue_depth",
+    "Moderation requests in the queue: queued - not taken by the"
+    " moderators yet, pending - taken, but not acknowledged (stream).",
+    ("state",),
+    (("queued",), ("pending",)),
+)
+LANE_DEPTH = Gauge(
+    "moderation_queue_lane_depth",
+    "Moderation requests queued by priority lane (list backend).",
+    ("lane",),
+)
+
+
+def create_requests_producer(
+    config: Config, redis_client: Redis
+) -> BaseModerationRequestsProducer:
+    """
+    Create the moderation requests producer by config.
+
+    :raise ValueError: If the queue backend is unknown.
+    """
+    if config.queue.backend == "list":
+        return ModerationRequestsProducer(
+            redis_client=redis_client,
+            queue_key=MODERATION_REQUESTS_QUEUE_KEY,
+            binary=config.binary_messages,
+            status_ttl=config.result_ttl,
+            lanes=config.queue.lane_names,
+        )
+    if config.queue.backend == "stream":
+        return StreamModerationRequestsProducer(
+            redis_client=redis_client,
+            stream_key=MODERATION_REQUESTS_STREAM_KEY,
+            binary=config.binary_messages,
+            status_ttl=config.result_ttl,
+        )
+    raise ValueError(f"Unknown queue backend: {config.queue.backend}")
+
+
+def create_requests_consumer(
+    config: Config, redis_client: Redis
+) -> BaseModerationRequestsConsumer:
+    """
+    Create the moderation requests consumer by config.
+
+    :raise ValueError: If the queue backend is unknown.
+    """
+    if config.queue.backend == "list":
+        return ModerationRequestsConsumer(
+            redis_client=redis_client,
+            queue_key=MODERATION_REQUESTS_QUEUE_KEY,
+            status_ttl=config.result_ttl,
+            lanes=config.queue.lanes,
+            lane_max_wait=config.queue.lane_max_wait,
+        )
+    if config.queue.backend == "stream":
+        return StreamModerationRequestsConsumer(
+            redis_client=redis_client,
+            stream_key=MODERATION_REQUESTS_STREAM_KEY,
+            group=config.queue.stream_group,
+            consumer_name=config.queue.consumer_name,
+            claim_idle=config.queue.claim_idle,
+            status_ttl=config.result_ttl,
+            max_deliveries=config.queue.max_deliveries,
+            dead_letter_key=MODERATION_REQUESTS_DEAD_LETTER_KEY,
+            dead_letter_max_len=config.queue.dead_letter_max_len,
+        )
+    raise ValueError(f"Unknown queue backend: {config.queue.backend}")
+
+
+async def get_queue_stats(
+    config: Config, redis_client: Redis
+) -> Dict[str, Any]:
+    """
+    Return the stats of the moderation requests queue.
+
+    The length of the list queue is the sum of its lanes.
+    """
+    if config.queue.backend == "stream":
+        return {
+            "backend": "stream",
+            **await get_stream_stats(
+                redis_client,
+                MODERATION_REQUESTS_STREAM_KEY,
+                config.queue.stream_group,
+            ),
+        }
+    lanes = config.queue.lane_names
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for lane in lanes:
+            pipe.llen(
+                lane_queue_key(MODERATION_REQUESTS_QUEUE_KEY, lane, lanes[0])
+            )
+        lengths = await pipe.execute()
+    return {
+        "backend": config.queue.backend,
+        "length": sum(lengths),
+        "lanes": dict(zip(lanes, lengths)),
+    }
+
+
+def queue_depth_collector(config: Config, redis_client: Redis) -> Collector:
+    """Return the collector of the queue depth (read on each scrape)."""
+    queued = QUEUE_DEPTH.labels("queued")
+    pending = QUEUE_DEPTH.labels("pending")
+
+    async def collect() -> None:
+        """Read the queue depth."""
+        stats = await get_queue_stats(config, redis_client)
+        if stats["backend"] == "stream":
+            queued.set(stats["lag"])
+            pending.set(stats["pending"])
+        else:
+            queued.set(stats["length"])
+            for lane, length in stats["lanes"].items():
+                LANE_DEPTH.labels(lane).set(length)
+
+    return collect
@@ -0,0 +1,87 @@
+"""The module responsible for the moderation requests queue interface."""
+
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+from redis.asyncio import Redis
+
+from config.app import MODERATION_DEQUEUED_KEY, MODERATION_STATUS_KEY_PREFIX
+from schemas import ModerationRequest
+
+
+class BaseModerationRequestsProducer(ABC):
+    """Base moderation requests producer interface."""
+
+    @abstractmethod
+    async def produce(self, moderation_request: ModerationRequest) -> None:
+        """Produce moderation request."""
+        pass
+
+    async def produce_batch(
+        self, moderation_requests: List[ModerationRequest]
+    ) -> None:
+        """
+        Produce several moderation requests.
+
+        Queues that support pipelining produce them in one round trip.
+        """
+        for moderation_request in moderation_requests:
+            await self.produce(moderation_request)
+
+
+class BaseModerationRequestsConsumer(ABC):
+    """Base moderation requests consumer interface."""
+
+    @abstractmethod
+    async def consume(self) -> ModerationRequest:
+        """Consume moderation request."""
+        pass
+
+    @abstractmethod
+    async def consume_batch(
+        self, max_size: int, max_delay: float = 0.0
+    ) -> List[ModerationRequest]:
+        """
+        Consume a batch of moderation requests.
+
+        :param max_size: Maximum number of requests in the batch.
+        :param max_delay: Maximum time to wait for the batch to be full.
+        :return: Moderation requests.
+        """
+        pass
+
+    async def ack(self, moderation_requests: List[ModerationRequest]) -> None:
+        """
+        Acknowledge that the requests are processed.
+
+        Queues that remove a request on consuming do nothing.
+        """
+        return None
+
+
+async def mark_processing(
+    redis_client: Redis,
+    moderation_requests: List[ModerationRequest],
+    ttl: Optional[int],
+) -> None:
+    """
+    Save the PROCESSING status of the consumed requests and count them.
+
+    The counter of the consumed requests is the drain rate of the queue
+    (for the admission control of the server). One round trip.
+
+    :param ttl: Time to live of the statuses (seconds).
+    If None, the statuses are not saved.
+    """
+    if not moderation_requests:
+        return
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.incrby(MODERATION_DEQUEUED_KEY, len(moderation_requests))
+        if ttl is not None:
+            for moderation_request in moderation_requests:
+                status_key = (
+                    MODERATION_STATUS_KEY_PREFIX + moderation_request.id
+                )
+                pipe.hset(status_key, "status", "PROCESSING")
+                pipe.expire(status_key, ttl)
+        await pipe.execute()
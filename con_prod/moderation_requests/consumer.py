@@ -1,35 +1,157 @@
 """The module responsible for the consumer of moderation requests."""
 
-from typing import Optional
+from logging import getLogger
+from time import monotonic
+from typing import Dict, List, Optional, Sequence, Tuple
 
 from redis.asyncio import Redis
 
 from schemas import ModerationRequest
 from utils.redis import RedisConMixin
 
+from ..codec import decode_request
+from .base import BaseModerationRequestsConsumer, mark_processing
+from .lanes import LaneScheduler, lane_queue_key
 
-class ModerationRequestsConsumer(RedisConMixin):
-    """Moderation requests consumer based on Redis."""
+logger = getLogger("main.con_prod.moderation_requests.consumer")
+
+
+class ModerationRequestsConsumer(
+    RedisConMixin, BaseModerationRequestsConsumer
+):
+    """
+    Moderation requests consumer based on Redis list.
+
+    With priority lanes, each lane is a list and the requests are taken
+    from the lanes in the weighted fair order (see LaneScheduler).
+    """
 
     def __init__(
         self,
         queue_key: str,
         redis_client: Optional[Redis] = None,
         redis_url: Optional[str] = None,
+        status_ttl: Optional[int] = None,
+        lanes: Sequence[Tuple[str, int]] = (),
+        lane_max_wait: float = 30.0,
     ):
         """
         Init class.
 
+        :param queue_key: Key of the queue (of the default lane).
         :param redis_client: Redis client.
         :param redis_url: Redis url
-        :raise ValueError: If redis_client and redis_url are None.
+        :param status_ttl: If set, the status of the consumed requests
+        (PROCESSING) is saved with this time to live (seconds).
+        :param lanes: Names and weights of the priority lanes
+        (the first one is the default lane). If empty, there is one list.
+        :param lane_max_wait: The lane not served for so long (seconds)
+        is served next, whatever its weight.
+        :raise ValueError: If redis_client and redis_url are None
+        or a lane weight is negative.
         """
-        self.__queue_key = queue_key
+        self.__status_ttl = status_ttl
+        lanes = tuple(lanes) or (("", 1),)
+        self.__lane_keys: Dict[str, str] = {
+            name: lane_queue_key(queue_key, name, lanes[0][0])
+            for name, _ in lanes
+        }
+        self.__key_lanes = {
+            key: name for name, key in self.__lane_keys.items()
+        }
+        self.__scheduler = LaneScheduler(lanes, lane_max_wait)
         super().__init__(redis_client=redis_client, redis_url=redis_url)
 
+    async def __mark_processing(
+        self, moderation_requests: List[ModerationRequest]
+    ) -> None:
+        """Save the PROCESSING status of the requests and count them."""
+        async with self.get_redis_conn() as redis_client:
+            await mark_processing(
+                redis_client,
+                moderation_requests,
+                self.__status_ttl,
+            )
+
+    async def __blpop(
+        self, timeout: Optional[float] = None
+    ) -> Optional[bytes]:
+        """Wait for a request of the first non-empty lane in the order."""
+        order = self.__scheduler.order()
+        result = await self.blpop_first(
+            [self.__lane_keys[lane] for lane in order], timeout=timeout
+        )
+        if result is None:
+            return None
+        key, request_str = result
+        lane = self.__key_lanes[key]
+        # the lanes before the served one were empty
+        for skipped in order[: order.index(lane)]:
+            self.__scheduler.idle(skipped)
+        self.__scheduler.served(lane, 1)
+        return request_str
+
+    async def __lpop(self, count: int) -> List[bytes]:
+        """Take up to count queued requests from the lanes in the order."""
+        requests_str: List[bytes] = []
+        for lane in self.__scheduler.order():
+            popped = await self.lpop(
+                self.__lane_keys[lane], count=count - len(requests_str)
+            )
+            if not popped:
+                self.__scheduler.idle(lane)
+                continue
+            self.__scheduler.served(lane, len(popped))
+            requests_str.extend(popped)
+            if len(requests_str) >= count:
+                break
+        return requests_str
+
     async def consume(self) -> ModerationRequest:
         """Consume moderation requests."""
-        request_str = await self.blpop(self.__queue_key)
+        request_str = await self.__blpop()
         if request_str is None:
             raise ValueError
-        return ModerationRequest.model_validate_json(request_str)
+        moderation_request = decode_request(request_str)
+        await self.__mark_processing([moderation_request])
+        return moderation_request
+
+    async def consume_batch(
+        self, max_size: int, max_delay: float = 0.0
+    ) -> List[ModerationRequest]:
+        """
+        Consume a batch of moderation requests.
+
+        Waits for the first request, then collects the requests until
+        the batch is full or max_delay seconds have passed.
+        Invalid requests are skipped.
+
+        :param max_size: Maximum number of requests in the batch.
+        :param max_delay: Maximum time to wait for the batch to be full.
+        :return: Moderation requests.
+        """
+        first_request_str = await self.__blpop()
+        if first_request_str is None:
+            raise ValueError
+        requests_str: List[bytes] = [first_request_str]
+        deadline = monotonic() + max_delay
+        while len(requests_str) < max_size:
+            requests_str.extend(
+                await self.__lpop(max_size - len(requests_str))
+            )
+            remaining = deadline - monotonic()
+            if len(requests_str) >= max_size or remaining <= 0:
+                break
+            request_str = await self.__blpop(timeout=remaining)
+            if request_str is None:
+                break
+            requests_str.append(request_str)
+
+        moderation_requests: List[ModerationRequest] = []
+        for request_str in requests_str:
+            try:
+                moderation_requests.append(decode_request(request_str))
+            except ValueError as exc:
+                logger.error("Invalid moderation request: %s", str(exc))
+        await self.__mark_processing(moderation_requests)
+        return moderation_requests
@@ -0,0 +1,111 @@
+"""The module responsible for the moderation requests waiting for a retry."""
+
+from logging import getLogger
+from time import time
+from typing import List, Optional, Sequence, Tuple
+
+from redis.asyncio import Redis
+
+from schemas import ModerationRequest
+from utils.redis import RedisMixin
+
+from ..codec import decode_request, encode_request
+from .base import BaseModerationRequestsProducer
+
+logger = getLogger("main.con_prod.moderation_requests.delayed")
+
+
+class DelayedModerationRequests(RedisMixin):
+    """
+    Moderation requests waiting for a retry in a redis sorted set.
+
+    The requests throttled by the NSFW API wait here (by the retry time)
+    instead of in the moderator, so their queue entries are acknowledged
+    at once and a restart of the moderator does not lose them. When due,
+    they are put back into the queue.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        requests_producer: BaseModerationRequestsProducer,
+        max_size: int = 10000,
+        binary: bool = True,
+        redis_client: Optional[Redis] = None,
+        redis_url: Optional[str] = None,
+    ):
+        """
+        Init class.
+
+        :param key: Key of the sorted set.
+        :param requests_producer: Producer of the requests queue.
+        :param max_size: Maximum number of the waiting requests.
+        :param binary: Encode the requests as binary frames.
+        :param redis_client: Redis client.
+        :param redis_url: Redis url
+        :raise ValueError: If redis_client and redis_url are None.
+        """
+        super().__init__(redis_client=redis_client, redis_url=redis_url)
+        self.__key = key
+        self.__requests_producer = requests_producer
+        self.__max_size = max_size
+        self.__binary = binary
+
+    async def schedule(
+        self, moderation_requests: Sequence[Tuple[ModerationRequest, float]]
+    ) -> bool:
+        """
+        Schedule the requests to be queued again after their delays.
+
+        :param moderation_requests: Requests and their delays (seconds).
+        :return: False, if there are too many waiting requests
+        (nothing is scheduled then).
+        """
+        now = time()
+        async with self.get_redis_conn() as redis_client:
+            if await redis_client.zcard(self.__key) >= self.__max_size:
+                return False
+            await redis_client.zadd(
+                self.__key,
+                {
+                    encode_request(request, self.__binary): now + delay
+                    for request, delay in moderation_requests
+                },
+            )
+        return True
+
+    async def move_due(self, limit: int = 100) -> int:
+        """
+        Put the requests whose retry time has come back into the queue.
+
+        Safe to call from several moderators: a request is queued
+        by the one that removed it from the sorted set.
+
+        :return: Number of the queued requests.
+        """
+        async with self.get_redis_conn() as redis_client:
+            due: List[bytes] = await redis_client.zrangebyscore(
+                self.__key, "-inf", time(), start=0, num=limit
+            )  # type: ignore[assignment]
+            if not due:
+                return 0
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for item in due:
+                    pipe.zrem(self.__key, item)
+                removed = await pipe.execute()
+        moderation_requests: List[ModerationRequest] = []
+        for item, count in zip(due, removed):
+            if not count:
+                continue
+            try:
+                moderation_requests.append(decode_request(item))
+            except ValueError as exc:
+                logger.error("Invalid delayed request: %s", str(exc))
+        if moderation_requests:
+            await self.__requests_producer.produce_batch(moderation_requests)
+        return len(moderation_requests)
+
+    async def count(self) -> int:
+        """Return the number of the waiting requests."""
+        async with self.get_redis_conn() as redis_client:
+            return await redis_client.zcard(self.__key)
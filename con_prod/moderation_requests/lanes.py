@@ -0,0 +1,87 @@
+"""The module responsible for the priority lanes of the requests queue."""
+
+from time import monotonic
+from typing import Dict, List, Sequence, Tuple
+
+
+def lane_queue_key(queue_key: str, lane: str, default_lane: str) -> str:
+    """
+    Return the key of the lane list.
+
+    The default lane uses the queue key itself, so the requests queued
+    before the lanes were configured are still consumed.
+    """
+    if lane == default_lane:
+        return queue_key
+    return f"{queue_key}:{lane}"
+
+
+class LaneScheduler(object):
+    """
+    Weighted fair order of the lanes (stride scheduling).
+
+    Each lane has a pass increased by 1 / weight per taken request,
+    the lane with the lowest pass is served first. An empty lane
+    catches up with the served ones, so it does not bank the credit
+    while idle and then monopolize the moderators. The lanes
+    with weight 0 are served only when the others are empty.
+    The lane with a positive weight not served for max_wait seconds
+    goes first (starvation protection).
+    """
+
+    def __init__(self, lanes: Sequence[Tuple[str, int]], max_wait: float):
+        """
+        Init class.
+
+        :param lanes: Names and weights of the lanes (the first one
+        is preferred on ties).
+        :param max_wait: The lane with a positive weight not served
+        for so long (seconds) is served next.
+        :raise ValueError: If there are no lanes or a weight is negative.
+        """
+        if not lanes:
+            raise ValueError("At least one lane is required.")
+        if any(weight < 0 for _, weight in lanes):
+            raise ValueError("Lane weights must not be negative.")
+        self.__weights: Dict[str, int] = dict(lanes)
+        self.__max_wait = max_wait
+        self.__passes: Dict[str, float] = {name: 0.0 for name, _ in lanes}
+        self.__position = {name: i for i, (name, _) in enumerate(lanes)}
+        now = monotonic()
+        self.__last_served: Dict[str, float] = {name: now for name, _ in lanes}
+        self.__pass = 0.0
+
+    def order(self) -> List[str]:
+        """Return the lanes in the order they are to be served."""
+        now = monotonic()
+        starving = sorted(
+            (
+                name
+                for name, served in self.__last_served.items()
+                if self.__weights[name] and now - served >= self.__max_wait
+            ),
+            key=lambda name: self.__last_served[name],
+        )
+        weighted = sorted(
+            (name for name in self.__passes if name not in starving),
+            key=lambda name: (
+                self.__weights[name] == 0,
+                self.__passes[name],
+                self.__position[name],
+            ),
+        )
+        return starving + weighted
+
+    def served(self, lane: str, count: int) -> None:
+        """Account the requests taken from the lane."""
+        self.__last_served[lane] = monotonic()
+        weight = self.__weights[lane]
+        if weight == 0:
+            return
+        self.__pass = max(self.__pass, self.__passes[lane])
+        self.__passes[lane] = self.__pass + count / weight
+
+    def idle(self, lane: str) -> None:
+        """Account that the lane was found empty."""
+        self.__last_served[lane] = monotonic()
+        self.__passes[lane] = max(self.__passes[lane], self.__pass)
@@ -1,34 +1,85 @@
 """The module responsible for producing moderation requests."""
 
-from typing import Optional
+from time import time
+from typing import List, Optional, Sequence
 
 from redis.asyncio import Redis
 
+from config.app import MODERATION_STATUS_KEY_PREFIX
 from schemas import ModerationRequest
 from utils.redis import RedisProdMixin
 
+from ..codec import encode_request
+from .base import BaseModerationRequestsProducer
+from .lanes import lane_queue_key
 
-class ModerationRequestsProducer(RedisProdMixin):
-    """Moderation requests producer based on Redis."""
+
+class ModerationRequestsProducer(
+    RedisProdMixin, BaseModerationRequestsProducer
+):
+    """Moderation requests producer based on Redis list."""
 
     def __init__(
         self,
         queue_key: str,
         redis_client: Optional[Redis] = None,
         redis_url: Optional[str] = None,
+        binary: bool = True,
+        status_ttl: Optional[int] = None,
+        lanes: Sequence[str] = (),
     ):
         """
         Init class.
 
+        :param queue_key: Key of the queue (of the default lane).
         :param redis_client: Redis client.
         :param redis_url: Redis url
+        :param binary: If False, the messages are encoded as JSON
+        (readable by the consumers not supporting the binary format).
+        :param status_ttl: If set, the request status (QUEUED) is saved
+        with this time to live (seconds).
+        :param lanes: Names of the priority lanes, each one is a list.
+        The first one is the default lane of the requests without
+        a lane or with an unknown one. If empty, there is one list.
         :raise ValueError: If redis_client and redis_url are None.
         """
         self.__queue_key = queue_key
+        self.__lanes = tuple(lanes)
+        self.__binary = binary
+        self.__status_ttl = status_ttl
         super().__init__(redis_client=redis_client, redis_url=redis_url)
 
     async def produce(self, moderation_request: ModerationRequest) -> None:
-        """Produce moderation requests."""
-        await self.rpush(
-            self.__queue_key, moderation_request.model_dump_json()
-        )
+        """Produce moderation requests (in one round trip)."""
+        await self.produce_batch([moderation_request])
+
+    def __lane_key(self, moderation_request: ModerationRequest) -> str:
+        """Set the lane of the request and return the key of its list."""
+        if not self.__lanes:
+            return self.__queue_key
+        lane = moderation_request.lane
+        if lane is None or lane not in self.__lanes:
+            lane = moderation_request.lane = self.__lanes[0]
+        return lane_queue_key(self.__queue_key, lane, self.__lanes[0])
+
+    async def produce_batch(
+        self, moderation_requests: List[ModerationRequest]
+    ) -> None:
+        """Produce several moderation requests (in one round trip)."""
+        async with self.get_redis_conn() as redis_client:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for moderation_request in moderation_requests:
+                    moderation_request.enqueued_at = time()
+                    queue_key = self.__lane_key(moderation_request)
+                    message = encode_request(
+                        moderation_request, binary=self.__binary
+                    )
+                    if self.__status_ttl is not None:
+                        status_key = (
+                            MODERATION_STATUS_KEY_PREFIX
+                            + moderation_request.id
+                        )
+                        pipe.hset(status_key, "status", "QUEUED")
+                        pipe.expire(status_key, self.__status_ttl)
+                    pipe.rpush(queue_key, message)
+                await pipe.execute()
@@ -0,0 +1,389 @@
+"""The module responsible for consuming moderation requests from a stream."""
+
+import os
+import socket
+from logging import getLogger
+from time import monotonic
+from typing import Any, Dict, List, Optional, Tuple
+
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from schemas import ModerationRequest
+from utils.redis import RedisMixin
+
+from ..codec import decode_request
+from .base import BaseModerationRequestsConsumer, mark_processing
+
+logger = getLogger("main.con_prod.moderation_requests.stream_consumer")
+
+StreamEntry = Tuple[bytes, Optional[Dict[bytes, bytes]]]
+
+
+def default_consumer_name() -> str:
+    """Return the consumer name unique for the process: <hostname>-<pid>."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+async def get_stream_stats(
+    redis_client: Redis, stream_key: str, group: str
+) -> Dict[str, Any]:
+    """
+    Return the stats of the stream and its consumer group.
+
+    length - number of entries in the stream;
+    lag - number of entries not delivered to the group yet;
+    pending - number of delivered, but not acknowledged entries;
+    consumers - pending entries and idle time (ms) of each consumer.
+    """
+    stats: Dict[str, Any] = {
+        "length": 0,
+        "lag": 0,
+        "pending": 0,
+        "consumers": {},
+    }
+    try:
+        stats["length"] = await redis_client.xlen(stream_key)
+        groups = await redis_client.xinfo_groups(stream_key)
+        for group_info in groups:
+            if group_info["name"] in (group, group.encode()):
+                stats["pending"] = group_info["pending"]
+                lag = group_info.get("lag")
+                # without lag (Redis < 7): the acknowledged entries
+                # are deleted, the rest of the stream is not delivered
+                stats["lag"] = (
+                    max(stats["length"] - stats["pending"], 0)
+                    if lag is None
+                    else lag
+                )
+                break
+        else:
+            stats["lag"] = stats["length"]
+            return stats
+        consumers = await redis_client.xinfo_consumers(stream_key, group)
+    except ResponseError:
+        # the stream or the group does not exist yet
+        return stats
+    for consumer_info in consumers:
+        name = consumer_info["name"]
+        if isinstance(name, bytes):
+            name = name.decode()
+        stats["consumers"][name] = {
+            "pending": consumer_info["pending"],
+            "idle_ms": consumer_info["idle"],
+        }
+    return stats
+
+
+class StreamModerationRequestsConsumer(
+    RedisMixin, BaseModerationRequestsConsumer
+):
+    """
+    Moderation requests consumer based on Redis stream consumer group.
+
+    A request stays pending until it is acknowledged (then it is deleted
+    from the stream). The requests pending for longer than claim_idle
+    (the moderator crashed or hung) are reclaimed by the other consumers
+    of the group. The requests delivered more than max_deliveries times
+    (they crash or hang the moderators) are moved to the dead-letter
+    stream.
+    """
+
+    def __init__(
+        self,
+        stream_key: str,
+        group: str,
+        consumer_name: Optional[str] = None,
+        redis_client: Optional[Redis] = None,
+        redis_url: Optional[str] = None,
+        claim_idle: float = 60.0,
+        status_ttl: Optional[int] = None,
+        max_deliveries: int = 5,
+        dead_letter_key: Optional[str] = None,
+        dead_letter_max_len: int = 10000,
+    ):
+        """
+        Init class.
+
+        :param stream_key: Key of the stream.
+        :param group: Name of the consumer group (created if not exists).
+        :param consumer_name: Name of the consumer in the group.
+        If None, <hostname>-<pid> is used.
+        :param redis_client: Redis client.
+        :param redis_url: Redis url
+        :param claim_idle: The requests pending for so long (seconds)
+        are reclaimed from other consumers. It is also the interval
+        of the reclaim checks.
+        :param status_ttl: If set, the status of the consumed requests
+        (PROCESSING) is saved with this time to live (seconds).
+        :param max_deliveries: The reclaimed requests delivered more
+        times are not processed again.
+        :param dead_letter_key: Key of the stream of the requests
+        delivered too many times. If None, they are dropped.
+        :param dead_letter_max_len: Approximate maximum length
+        of the dead-letter stream.
+        :raise ValueError: If redis_client and redis_url are None.
+        """
+        super().__init__(redis_client=redis_client, redis_url=redis_url)
+        self.__stream_key = stream_key
+        self.__group = group
+        self.__consumer_name = consumer_name or default_consumer_name()
+        self.__claim_idle = claim_idle
+        self.__status_ttl = status_ttl
+        self.__max_deliveries = max_deliveries
+        self.__dead_letter_key = dead_letter_key
+        self.__dead_letter_max_len = dead_letter_max_len
+        self.__group_created = False
+        self.__last_claim = 0.0
+        self.__claim_cursor = "0-0"
+        # stream entry IDs of the unacknowledged requests
+        self.__entry_ids: Dict[str, bytes] = {}
+
+    @property
+    def consumer_name(self) -> str:
+        """Return the name of the consumer in the group."""
+        return self.__consumer_name
+
+    async def __create_group(self, redis_client: Redis) -> None:
+        """Create the consumer group (and the stream) if not exists."""
+        if self.__group_created:
+            return
+        try:
+            await redis_client.xgroup_create(
+                self.__stream_key, self.__group, id="0", mkstream=True
+            )
+            logger.info(
+                "Consumer group %s of %s created.",
+                self.__group,
+                self.__stream_key,
+            )
+        except ResponseError as exc:
+            if "BUSYGROUP" not in str(exc):
+                raise
+        self.__group_created = True
+
+    async def __dead_letter(
+        self, redis_client: Redis, entries: List[StreamEntry]
+    ) -> List[StreamEntry]:
+        """
+        Move the entries delivered too many times to the dead-letter stream.
+
+        :param entries: The reclaimed entries.
+        :return: The entries to process again.
+        """
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for entry_id, _ in entries:
+                pipe.xpending_range(
+                    self.__stream_key,
+                    self.__group,
+                    min=entry_id,
+                    max=entry_id,
+                    count=1,
+                )
+            pending = await pipe.execute()
+        alive: List[StreamEntry] = []
+        dead: List[StreamEntry] = []
+        for entry, entry_pending in zip(entries, pending):
+            # XAUTOCLAIM has already counted the new delivery
+            if (
+                entry_pending
+                and entry_pending[0]["times_delivered"] > self.__max_deliveries
+            ):
+                dead.append(entry)
+            else:
+                alive.append(entry)
+        if not dead:
+            return alive
+
+        logger.error(
+            "%d requests of %s were delivered more than %d times: %s",
+            len(dead),
+            self.__stream_key,
+            self.__max_deliveries,
+            "dead-lettered" if self.__dead_letter_key else "dropped",
+        )
+        dead_ids = [entry_id for entry_id, _ in dead]
+        async with redis_client.pipeline(transaction=False) as pipe:
+            if self.__dead_letter_key is not None:
+                for _, fields in dead:
+                    if fields:
+                        pipe.xadd(
+                            self.__dead_letter_key,
+                            fields,  # type: ignore[arg-type]
+                            maxlen=self.__dead_letter_max_len,
+                            approximate=True,
+                        )
+            pipe.xack(self.__stream_key, self.__group, *dead_ids)
+            pipe.xdel(self.__stream_key, *dead_ids)
+            await pipe.execute()
+        return alive
+
+    async def __claim(
+        self, redis_client: Redis, count: int
+    ) -> List[StreamEntry]:
+        """
+        Reclaim the stale pending entries (at most once per claim_idle).
+
+        The entries delivered too many times are dead-lettered.
+        """
+        if monotonic() - self.__last_claim < self.__claim_idle:
+            return []
+        self.__last_claim = monotonic()
+        next_cursor, entries, *_ = await redis_client.xautoclaim(
+            self.__stream_key,
+            self.__group,
+            self.__consumer_name,
+            min_idle_time=int(self.__claim_idle * 1000),
+            start_id=self.__claim_cursor,
+            count=count,
+        )
+        self.__claim_cursor = (
+            next_cursor.decode()
+            if isinstance(next_cursor, bytes)
+            else next_cursor
+        )
+        if entries:
+            logger.warning(
+                "Reclaimed %d stale requests from %s.",
+                len(entries),
+                self.__stream_key,
+            )
+            entries = await self.__dead_letter(redis_client, entries)
+        return entries
+
+    async def __read(
+        self, redis_client: Redis, count: int, block: float
+    ) -> List[StreamEntry]:
+        """Read new entries (waiting at most block seconds)."""
+        try:
+            result = await redis_client.xreadgroup(
+                self.__group,
+                self.__consumer_name,
+                {self.__stream_key: ">"},
+                count=count,
+                block=max(int(block * 1000), 1),
+            )
+        except ResponseError as exc:
+            if "NOGROUP" not in str(exc):
+                raise
+            # the stream was deleted
+            self.__group_created = False
+            return []
+        # RESP2 reply: [[stream key, entries]] (None on timeout)
+        if not isinstance(result, list) or not result:
+            return []
+        _, entries = result[0]
+        return list(entries)
+
+    async def __decode(
+        self, redis_client: Redis, entries: List[StreamEntry]
+    ) -> List[ModerationRequest]:
+        """
+        Decode the entries into moderation requests.
+
+        Deleted and invalid entries are acknowledged at once,
+        so they are not reclaimed again.
+        """
+        moderation_requests: List[ModerationRequest] = []
+        invalid_ids: List[bytes] = []
+        for entry_id, fields in entries:
+            if not fields or b"message" not in fields:
+                invalid_ids.append(entry_id)
+                continue
+            try:
+                moderation_request = decode_request(fields[b"message"])
+            except ValueError as exc:
+                logger.error("Invalid moderation request: %s", str(exc))
+                invalid_ids.append(entry_id)
+                continue
+            self.__entry_ids[moderation_request.id] = entry_id
+            moderation_requests.append(moderation_request)
+        if invalid_ids:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.xack(self.__stream_key, self.__group, *invalid_ids)
+                pipe.xdel(self.__stream_key, *invalid_ids)
+                await pipe.execute()
+        return moderation_requests
+
+    async def consume(self) -> ModerationRequest:
+        """Consume moderation request."""
+        moderation_requests: List[ModerationRequest] = []
+        while not moderation_requests:
+            moderation_requests = await self.consume_batch(max_size=1)
+        return moderation_requests[0]
+
+    async def consume_batch(
+        self, max_size: int, max_delay: float = 0.0
+    ) -> List[ModerationRequest]:
+        """
+        Consume a batch of moderation requests.
+
+        The stale requests of other consumers are reclaimed first.
+        Otherwise, waits for the first new request, then collects
+        the requests until the batch is full or max_delay seconds
+        have passed. Invalid requests are skipped.
+
+        :param max_size: Maximum number of requests in the batch.
+        :param max_delay: Maximum time to wait for the batch to be full.
+        :return: Moderation requests.
+        """
+        async with self.get_redis_conn() as redis_client:
+            entries: List[StreamEntry] = []
+            while not entries:
+                await self.__create_group(redis_client)
+                entries = await self.__claim(redis_client, max_size)
+                if not entries:
+                    entries = await self.__read(
+                        redis_client, max_size, self.__claim_idle
+                    )
+
+            deadline = monotonic() + max_delay
+            while len(entries) < max_size:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                new_entries = await self.__read(
+                    redis_client, max_size - len(entries), remaining
+                )
+                if not new_entries:
+                    break
+                entries.extend(new_entries)
+
+            moderation_requests = await self.__decode(redis_client, entries)
+            consumed = False
+            try:
+                await mark_processing(
+                    redis_client,
+                    moderation_requests,
+                    self.__status_ttl,
+                )
+                consumed = True
+            finally:
+                if not consumed:
+                    # not returned, so never acknowledged by the moderator
+                    # (the entries are reclaimed later)
+                    for moderation_request in moderation_requests:
+                        self.__entry_ids.pop(moderation_request.id, None)
+        return moderation_requests
+
+    async def ack(self, moderation_requests: List[ModerationRequest]) -> None:
+        """Acknowledge the processed requests and delete them."""
+        entry_ids: List[bytes] = []
+        for moderation_request in moderation_requests:
+            entry_id = self.__entry_ids.pop(moderation_request.id, None)
+            if entry_id is not None:
+                entry_ids.append(entry_id)
+        if not entry_ids:
+            return
+        async with self.get_redis_conn() as redis_client:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.xack(self.__stream_key, self.__group, *entry_ids)
+                pipe.xdel(self.__stream_key, *entry_ids)
+                await pipe.execute()
+
+    async def stats(self) -> Dict[str, Any]:
+        """Return the stats of the stream and its consumer group."""
+        async with self.get_redis_conn() as redis_client:
+            return await get_stream_stats(
+                redis_client, self.__stream_key, self.__group
+            )
@@ -0,0 +1,73 @@
+"""The module responsible for producing moderation requests to a stream."""
+
+from time import time
+from typing import List, Optional
+
+from redis.asyncio import Redis
+
+from config.app import MODERATION_STATUS_KEY_PREFIX
+from schemas import ModerationRequest
+from utils.redis import RedisMixin
+
+from ..codec import encode_request
+from .base import BaseModerationRequestsProducer
+
+
+class StreamModerationRequestsProducer(
+    RedisMixin, BaseModerationRequestsProducer
+):
+    """
+    Moderation requests producer based on Redis stream.
+
+    The stream is not trimmed (the requests are deleted when they are
+    acknowledged), its length is limited by the admission control.
+    """
+
+    def __init__(
+        self,
+        stream_key: str,
+        redis_client: Optional[Redis] = None,
+        redis_url: Optional[str] = None,
+        binary: bool = True,
+        status_ttl: Optional[int] = None,
+    ):
+        """
+        Init class.
+
+        :param stream_key: Key of the stream.
+        :param redis_client: Redis client.
+        :param redis_url: Redis url
+        :param binary: If False, the messages are encoded as JSON.
+        :param status_ttl: If set, the request status (QUEUED) is saved
+        with this time to live (seconds).
+        :raise ValueError: If redis_client and redis_url are None.
+        """
+        self.__stream_key = stream_key
+        self.__binary = binary
+        self.__status_ttl = status_ttl
+        super().__init__(redis_client=redis_client, redis_url=redis_url)
+
+    async def produce(self, moderation_request: ModerationRequest) -> None:
+        """Produce moderation requests (in one round trip)."""
+        await self.produce_batch([moderation_request])
+
+    async def produce_batch(
+        self, moderation_requests: List[ModerationRequest]
+    ) -> None:
+        """Produce several moderation requests (in one round trip)."""
+        async with self.get_redis_conn() as redis_client:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for moderation_request in moderation_requests:
+                    moderation_request.enqueued_at = time()
+                    message = encode_request(
+                        moderation_request, binary=self.__binary
+                    )
+                    if self.__status_ttl is not None:
+                        status_key = (
+                            MODERATION_STATUS_KEY_PREFIX
+                            + moderation_request.id
+                        )
+                        pipe.hset(status_key, "status", "QUEUED")
+                        pipe.expire(status_key, self.__status_ttl)
+                    pipe.xadd(self.__stream_key, {"message": message})
+                await pipe.execute()
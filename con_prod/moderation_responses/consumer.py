@@ -1,14 +1,17 @@
-"""Module responsible for implementing the producer of moderation results."""
+"""Module responsible for implementing the consumer of moderation results."""
 
-from typing import Optional
+from typing import List, Optional
 
 from redis.asyncio import Redis
 
-from schemas import ModerationResponse
-from utils.redis import RedisConMixin
+from config.app import MODERATION_STATUS_KEY_PREFIX
+from schemas import ModerationStatus
+from utils.redis import RedisMixin
 
+from ..codec import decode_response
 
-class ModerationResponsesConsumer(RedisConMixin):
+
+class ModerationResponsesConsumer(RedisMixin):
     """Moderation responses consumer based on redis."""
 
     def __init__(
@@ -25,11 +28,57 @@ class ModerationResponsesConsumer(RedisConMixin):
         """
         super().__init__(redis_client=redis_client, redis_url=redis_url)
 
-    async def consume(
-        self, moderation_request_id, timeout: Optional[float] = None
-    ) -> Optional[ModerationResponse]:
-        """Consume moderation responses."""
-        response_str = await self.blpop(moderation_request_id, timeout=timeout)
-        if response_str is None:
-            return None
-        return ModerationResponse.model_validate_json(response_str)
+    async def get_status(
+        self, moderation_request_id: str
+    ) -> Optional[ModerationStatus]:
+        """
+        Return the status of the moderation request.
+
+        The status is not deleted, so it can be read several times
+        until it expires.
+
+        :param moderation_request_id: Moderation request ID.
+        :return: Status of the request or None, if the request is unknown
+        (or its status has expired).
+        """
+        statuses = await self.get_statuses([moderation_request_id])
+        return statuses[0]
+
+    async def get_statuses(
+        self, moderation_request_ids: List[str]
+    ) -> List[Optional[ModerationStatus]]:
+        """
+        Return the statuses of the moderation requests (in one round trip).
+
+        :param moderation_request_ids: Moderation request IDs.
+        :return: Statuses in the order of the IDs (None for the unknown
+        or expired requests).
+        """
+        if not moderation_request_ids:
+            return []
+        async with self.get_redis_conn() as redis_client:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for moderation_request_id in moderation_request_ids:
+                    pipe.hgetall(
+                        MODERATION_STATUS_KEY_PREFIX + moderation_request_id
+                    )
+                results = await pipe.execute()
+
+        statuses: List[Optional[ModerationStatus]] = []
+        for moderation_request_id, fields in zip(
+            moderation_request_ids, results
+        ):
+            if not fields or b"status" not in fields:
+                statuses.append(None)
+                continue
+            response = None
+            if b"result" in fields:
+                response = decode_response(fields[b"result"])
+            statuses.append(
+                ModerationStatus(
+                    id=moderation_request_id,
+                    status=fields[b"status"].decode(),
+                    response=response,
+                )
+            )
+        return statuses
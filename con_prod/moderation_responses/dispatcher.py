@@ -0,0 +1,219 @@
+"""The module responsible for dispatching moderation results to waiters."""
+
+import asyncio
+from logging import getLogger
+from time import perf_counter
+from typing import Dict, Iterable, Optional, Set
+
+from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
+
+from config.app import MODERATION_STATUS_KEY_PREFIX
+from schemas import ModerationResponse
+from utils.metrics import Histogram
+from utils.redis import RedisConMixin
+
+from ..codec import decode_response
+
+logger = getLogger("main.con_prod.moderation_responses.dispatcher")
+
+RESULT_WAIT = Histogram(
+    "moderation_result_wait_seconds",
+    "Time waited for the moderation result (result - received,"
+    " timeout - not received in time).",
+    ("outcome",),
+    (("result",), ("timeout",)),
+)
+
+
+class ModerationResponsesDispatcher(RedisConMixin):
+    """
+    Moderation responses dispatcher based on redis pub/sub.
+
+    One subscription per process receives all the responses and resolves
+    the futures of the waiters (or puts them into the queues
+    of the subscribers), so the waiters don't hold redis connections.
+    """
+
+    def __init__(
+        self,
+        channel: str,
+        redis_client: Optional[Redis] = None,
+        redis_url: Optional[str] = None,
+        reconnect_delay: float = 1.0,
+    ):
+        """
+        Init class.
+
+        :param channel: Channel the responses are published to.
+        :param redis_client: Redis client.
+        :param redis_url: Redis url
+        :param reconnect_delay: Delay before resubscribing after an error.
+        :raise ValueError: If redis_client and redis_url are None.
+        """
+        super().__init__(redis_client=redis_client, redis_url=redis_url)
+        self.__channel = channel
+        self.__reconnect_delay = reconnect_delay
+        self.__waiters: Dict[str, asyncio.Future[ModerationResponse]] = {}
+        # the waiters of the same request share the future
+        self.__waiter_counts: Dict[str, int] = {}
+        self.__subscribers: Dict[
+            str, Set[asyncio.Queue[ModerationResponse]]
+        ] = {}
+        self.__task: Optional[asyncio.Task[None]] = None
+        self.__subscribed = asyncio.Event()
+
+    @property
+    def waiters(self) -> int:
+        """Return the number of waiting requests."""
+        return len(self.__waiters) + len(self.__subscribers)
+
+    def subscribe(
+        self,
+        moderation_request_ids: Iterable[str],
+        queue: "asyncio.Queue[ModerationResponse]",
+    ) -> None:
+        """
+        Put the responses to the requests into the queue when published.
+
+        The responses published before subscribing are not put,
+        read them from the request statuses.
+        """
+        for moderation_request_id in moderation_request_ids:
+            self.__subscribers.setdefault(moderation_request_id, set()).add(
+                queue
+            )
+
+    def unsubscribe(
+        self,
+        moderation_request_ids: Iterable[str],
+        queue: "asyncio.Queue[ModerationResponse]",
+    ) -> None:
+        """Stop putting the responses to the requests into the queue."""
+        for moderation_request_id in moderation_request_ids:
+            queues = self.__subscribers.get(moderation_request_id)
+            if queues is None:
+                continue
+            queues.discard(queue)
+            if not queues:
+                del self.__subscribers[moderation_request_id]
+
+    async def start(self) -> None:
+        """Subscribe to the channel and start dispatching."""
+        self.__task = asyncio.create_task(self.__listen())
+        await self.__subscribed.wait()
+
+    async def stop(self) -> None:
+        """Stop dispatching."""
+        if self.__task is not None:
+            self.__task.cancel()
+            await asyncio.gather(self.__task, return_exceptions=True)
+            self.__task = None
+
+    async def __listen(self) -> None:
+        """Receive the responses and resolve the futures of the waiters."""
+        while True:
+            try:
+                async with self.get_redis_conn() as redis_client:
+                    pubsub: PubSub = redis_client.pubsub(
+                        ignore_subscribe_messages=True
+                    )
+                    async with pubsub:
+                        await pubsub.subscribe(self.__channel)
+                        self.__subscribed.set()
+                        logger.info("Subscribed to %s", self.__channel)
+                        async for message in pubsub.listen():
+                            self.__dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error(
+                    "Subscription to %s failed: %s", self.__channel, str(exc)
+                )
+                # the waiters fall back to the statuses of the requests
+                self.__subscribed.set()
+                await asyncio.sleep(self.__reconnect_delay)
+
+    def __dispatch(self, message: bytes) -> None:
+        """Resolve the future of the response waiter (if any)."""
+        try:
+            moderation_response = decode_response(message)
+        except ValueError as exc:
+            logger.error("Invalid moderation response: %s", str(exc))
+            return
+        future = self.__waiters.get(moderation_response.id)
+        if future is not None and not future.done():
+            future.set_result(moderation_response)
+        for queue in self.__subscribers.get(moderation_response.id, ()):
+            queue.put_nowait(moderation_response)
+
+    async def __get_result(
+        self, moderation_request_id: str
+    ) -> Optional[ModerationResponse]:
+        """Return the response saved in the request status (if any)."""
+        async with self.get_redis_conn() as redis_client:
+            response_str = await redis_client.hget(
+                MODERATION_STATUS_KEY_PREFIX + moderation_request_id, "result"
+            )
+        if response_str is None:
+            return None
+        return decode_response(response_str)
+
+    async def wait(
+        self,
+        moderation_request_id: str,
+        timeout: Optional[float] = None,
+        check_first: bool = False,
+    ) -> Optional[ModerationResponse]:
+        """
+        Wait for the moderation response.
+
+        If the response is not received in time (or was published while
+        the subscription was broken), it is read from the request status.
+
+        :param moderation_request_id: Moderation request ID.
+        :param timeout: Timeout (seconds).
+        :param check_first: Read the request status right after
+        registering the waiter, for requests that may be already done.
+        :return: Moderation response or None, if there is no response yet.
+        """
+        start = perf_counter()
+        moderation_response = await self.__wait(
+            moderation_request_id, timeout, check_first
+        )
+        RESULT_WAIT.labels(
+            "timeout" if moderation_response is None else "result"
+        ).observe(perf_counter() - start)
+        return moderation_response
+
+    async def __wait(
+        self,
+        moderation_request_id: str,
+        timeout: Optional[float],
+        check_first: bool,
+    ) -> Optional[ModerationResponse]:
+        """Wait for the moderation response (see wait)."""
+        future = self.__waiters.get(moderation_request_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.__waiters[moderation_request_id] = future
+        self.__waiter_counts[moderation_request_id] = (
+            self.__waiter_counts.get(moderation_request_id, 0) + 1
+        )
+        try:
+            if check_first:
+                moderation_response = await self.__get_result(
+                    moderation_request_id
+                )
+                if moderation_response is not None:
+                    return moderation_response
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.__waiter_counts[moderation_request_id] -= 1
+            if not self.__waiter_counts[moderation_request_id]:
+                del self.__waiter_counts[moderation_request_id]
+                del self.__waiters[moderation_request_id]
+
+        return await self.__get_result(moderation_request_id)
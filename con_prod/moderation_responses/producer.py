@@ -4,27 +4,53 @@ from typing import Optional
 
 from redis.asyncio import Redis
 
+from config.app import MODERATION_STATUS_KEY_PREFIX
 from schemas import ModerationResponse
-from utils.redis import RedisProdMixin
+from utils.redis import RedisMixin
 
+from ..codec import encode_response
 
-class ModerationResponsesProducer(RedisProdMixin):
+
+class ModerationResponsesProducer(RedisMixin):
     """Moderation responses producer based on Redis."""
 
     def __init__(
         self,
         redis_client: Optional[Redis] = None,
         redis_url: Optional[str] = None,
+        binary: bool = True,
+        channel: Optional[str] = None,
+        ttl: Optional[int] = None,
     ):
         """
         Init class.
 
         :param redis_client: Redis client.
         :param redis_url: Redis url
+        :param binary: If False, the messages are encoded as JSON
+        (readable by the consumers not supporting the binary format).
+        :param channel: Channel to publish the responses to
+        (in addition to saving them in the request status).
+        :param ttl: Time to live of the request status with the response
+        (seconds). If None, the status does not expire.
         :raise ValueError: If redis_client and redis_url are None.
         """
+        self.__binary = binary
+        self.__channel = channel
+        self.__ttl = ttl
         super().__init__(redis_client=redis_client, redis_url=redis_url)
 
     async def produce(self, moderation_resp: ModerationResponse) -> None:
-        """Produce moderation response."""
-        await self.rpush(moderation_resp.id, moderation_resp.model_dump_json())
+        """Produce moderation response (in one round trip)."""
+        message = encode_response(moderation_resp, binary=self.__binary)
+        async with self.get_redis_conn() as redis_client:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                status_key = MODERATION_STATUS_KEY_PREFIX + moderation_resp.id
+                pipe.hset(
+                    status_key, mapping={"status": "DONE", "result": message}
+                )
+                if self.__ttl is not None:
+                    pipe.expire(status_key, self.__ttl)
+                if self.__channel is not None:
+                    pipe.publish(self.__channel, message)
+                await pipe.execute()
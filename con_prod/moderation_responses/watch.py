@@ -0,0 +1,136 @@
+"""The module responsible for watching the results of several requests."""
+
+import asyncio
+from typing import Iterable, List, Optional, Set, Tuple
+
+from schemas import ModerationResponse, ModerationStatus
+
+from .consumer import ModerationResponsesConsumer
+from .dispatcher import ModerationResponsesDispatcher
+
+# request ID and its status (None if the request is unknown or expired)
+WatchEvent = Tuple[str, Optional[ModerationStatus]]
+
+
+class ModerationResponsesWatch(object):
+    """
+    Watch of the results of several moderation requests.
+
+    The results are pushed by the dispatcher as soon as they are
+    published. If no result arrives within the timeout, the statuses
+    of the watched requests are read (in case a result was published
+    while the subscription was broken). Call close when done.
+    """
+
+    def __init__(
+        self,
+        responses_dispatcher: ModerationResponsesDispatcher,
+        responses_consumer: ModerationResponsesConsumer,
+        max_requests: int = 1000,
+    ):
+        """
+        Init class.
+
+        :param responses_dispatcher: Moderation responses dispatcher.
+        :param responses_consumer: Moderation responses consumer.
+        :param max_requests: Maximum number of the watched requests.
+        """
+        self.__dispatcher = responses_dispatcher
+        self.__consumer = responses_consumer
+        self.__max_requests = max_requests
+        self.__queue: asyncio.Queue[ModerationResponse] = asyncio.Queue()
+        self.__pending: Set[str] = set()
+
+    @property
+    def pending(self) -> int:
+        """Return the number of the requests without results."""
+        return len(self.__pending)
+
+    def __done(self, moderation_request_ids: Iterable[str]) -> None:
+        """Stop watching the requests."""
+        moderation_request_ids = list(moderation_request_ids)
+        self.__dispatcher.unsubscribe(moderation_request_ids, self.__queue)
+        self.__pending.difference_update(moderation_request_ids)
+
+    async def __read_statuses(
+        self, moderation_request_ids: List[str]
+    ) -> List[WatchEvent]:
+        """Read the statuses and stop watching the done requests."""
+        statuses = await self.__consumer.get_statuses(moderation_request_ids)
+        events = list(zip(moderation_request_ids, statuses))
+        self.__done(
+            moderation_request_id
+            for moderation_request_id, status in events
+            if status is None or status.response is not None
+        )
+        return events
+
+    async def add(self, moderation_request_ids: List[str]) -> List[WatchEvent]:
+        """
+        Start watching the requests.
+
+        :param moderation_request_ids: Moderation request IDs.
+        :return: Current statuses of the requests. The done and unknown
+        requests are not watched.
+        :raise ValueError: If too many requests are watched.
+        """
+        new_ids = [
+            moderation_request_id
+            for moderation_request_id in dict.fromkeys(moderation_request_ids)
+            if moderation_request_id not in self.__pending
+        ]
+        if len(self.__pending) + len(new_ids) > self.__max_requests:
+            raise ValueError(
+                f"At most {self.__max_requests} requests can be watched."
+            )
+        # subscribe first, so no result is missed while reading the statuses
+        self.__dispatcher.subscribe(new_ids, self.__queue)
+        self.__pending.update(new_ids)
+        try:
+            return await self.__read_statuses(new_ids)
+        except BaseException:
+            self.__done(new_ids)
+            raise
+
+    async def next(self, timeout: float) -> List[WatchEvent]:
+        """
+        Wait for the results of the watched requests.
+
+        :param timeout: How long to wait for a pushed result (seconds).
+        Then the statuses are read.
+        :return: Statuses of the done (or expired) requests,
+        may be empty.
+        """
+        try:
+            responses = [await asyncio.wait_for(self.__queue.get(), timeout)]
+        except asyncio.TimeoutError:
+            pending = list(self.__pending)
+            if not pending:
+                return []
+            events = await self.__read_statuses(pending)
+            return [
+                (moderation_request_id, status)
+                for moderation_request_id, status in events
+                if status is None or status.response is not None
+            ]
+
+        while not self.__queue.empty():
+            responses.append(self.__queue.get_nowait())
+        # a result can be pushed and read from the status at the same time
+        done = [
+            response for response in responses if response.id in self.__pending
+        ]
+        self.__done(response.id for response in done)
+        return [
+            (
+                response.id,
+                ModerationStatus(
+                    id=response.id, status="DONE", response=response
+                ),
+            )
+            for response in done
+        ]
+
+    def close(self) -> None:
+        """Stop watching all the requests."""
+        self.__done(list(self.__pending))
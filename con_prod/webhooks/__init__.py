@@ -0,0 +1 @@
+"""Package responsible for the queue of the webhooks."""
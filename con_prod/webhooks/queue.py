@@ -0,0 +1,115 @@
+"""The module responsible for the queue of the webhooks."""
+
+from time import time
+from typing import Dict, List, Optional
+
+from redis.asyncio import Redis
+
+from config.app import (
+    WEBHOOKS_DEAD_LETTER_KEY,
+    WEBHOOKS_QUEUE_KEY,
+    WEBHOOKS_RETRY_KEY,
+)
+from schemas import WebhookJob
+from utils.redis import RedisMixin
+
+
+class WebhooksQueue(RedisMixin):
+    """
+    Queue of the webhooks based on redis.
+
+    The jobs are delivered from a list; the failed ones wait for a retry
+    in a sorted set (by the retry time) and the jobs that failed
+    too many times are kept in the dead-letter list.
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[Redis] = None,
+        redis_url: Optional[str] = None,
+        dead_letter_max_len: int = 10000,
+    ):
+        """
+        Init class.
+
+        :param redis_client: Redis client.
+        :param redis_url: Redis url
+        :param dead_letter_max_len: Maximum number of the jobs
+        in the dead-letter list (the oldest ones are dropped).
+        :raise ValueError: If redis_client and redis_url are None.
+        """
+        super().__init__(redis_client=redis_client, redis_url=redis_url)
+        self.__dead_letter_max_len = dead_letter_max_len
+
+    async def push(self, jobs: List[WebhookJob]) -> None:
+        """Put the jobs into the queue (in one round trip)."""
+        if not jobs:
+            return
+        async with self.get_redis_conn() as redis_client:
+            await redis_client.rpush(
+                WEBHOOKS_QUEUE_KEY, *(job.model_dump_json() for job in jobs)
+            )
+
+    async def pop(self, timeout: float = 1.0) -> Optional[WebhookJob]:
+        """
+        Take the job from the queue.
+
+        :param timeout: How long to wait for a job (seconds).
+        :return: Job or None, if the queue is empty.
+        """
+        async with self.get_redis_conn() as redis_client:
+            item = await redis_client.blpop([WEBHOOKS_QUEUE_KEY], timeout)
+        if item is None:
+            return None
+        return WebhookJob.model_validate_json(item[1])
+
+    async def retry_later(self, job: WebhookJob, delay: float) -> None:
+        """Schedule the job to be delivered again after the delay."""
+        async with self.get_redis_conn() as redis_client:
+            await redis_client.zadd(
+                WEBHOOKS_RETRY_KEY, {job.model_dump_json(): time() + delay}
+            )
+
+    async def move_due(self, limit: int = 100) -> int:
+        """
+        Move the jobs whose retry time has come to the queue.
+
+        Safe to call from several workers: a job is moved by the worker
+        that removed it from the sorted set.
+
+        :return: Number of the moved jobs.
+        """
+        async with self.get_redis_conn() as redis_client:
+            due: List[bytes] = await redis_client.zrangebyscore(
+                WEBHOOKS_RETRY_KEY, "-inf", time(), start=0, num=limit
+            )  # type: ignore[assignment]
+            if not due:
+                return 0
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for item in due:
+                    pipe.zrem(WEBHOOKS_RETRY_KEY, item)
+                removed = await pipe.execute()
+            moved = [item for item, count in zip(due, removed) if count]
+            if moved:
+                await redis_client.rpush(WEBHOOKS_QUEUE_KEY, *moved)
+        return len(moved)
+
+    async def dead_letter(self, job: WebhookJob) -> None:
+        """Put the job that failed too many times into the dead-letter list."""
+        async with self.get_redis_conn() as redis_client:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.lpush(WEBHOOKS_DEAD_LETTER_KEY, job.model_dump_json())
+                pipe.ltrim(
+                    WEBHOOKS_DEAD_LETTER_KEY, 0, self.__dead_letter_max_len - 1
+                )
+                await pipe.execute()
+
+    async def stats(self) -> Dict[str, int]:
+        """Return the numbers of the queued, scheduled and dead jobs."""
+        async with self.get_redis_conn() as redis_client:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.llen(WEBHOOKS_QUEUE_KEY)
+                pipe.zcard(WEBHOOKS_RETRY_KEY)
+                pipe.llen(WEBHOOKS_DEAD_LETTER_KEY)
+                queued, scheduled, dead = await pipe.execute()
+        return {"queued": queued, "scheduled": scheduled, "dead": dead}
@@ -2,15 +2,22 @@
 
 import os
 from dataclasses import dataclass
+from typing import Optional, Tuple
 
 from dotenv import load_dotenv
 
 
 @dataclass
 class ClarifaiConfig(object):
-    """Clarifai config."""
+    """
+    Clarifai config.
+
+    base_url: URL of the model outputs endpoint (if None, the public
+    Clarifai API), e.g. of the fake server of the benchmarks.
+    """
 
     access_token: str
+    base_url: Optional[str] = None
 
 
 @dataclass
@@ -18,6 +25,330 @@ class RedisConfig(object):
     """Redis config."""
 
     url: str
+    max_connections: int = 100
+    pool_timeout: float = 10.0
+    health_check_interval: int = 30
+
+
+@dataclass
+class ModeratorConfig(object):
+    """Moderator config."""
+
+    concurrency: int = 4
+    rate_limit: Optional[float] = 1.0
+    rate_burst: int = 1
+    batch_size: int = 1
+    batch_max_delay: float = 0.05
+    backend: str = "clarifai"
+    max_retries: int = 5
+    retry_base_delay: float = 1.0
+    retry_max_delay: float = 30.0
+    max_delayed: int = 10000
+
+
+@dataclass
+class PreprocessingConfig(object):
+    """
+    Image preprocessing (before moderation) config.
+
+    The images are downscaled to fit max_size x max_size and re-encoded
+    to format (JPEG or WEBP) without metadata. workers - number
+    of processes (0 - the number of CPUs).
+    """
+
+    enabled: bool = False
+    max_size: int = 512
+    format: str = "JPEG"
+    quality: int = 85
+    workers: int = 0
+
+
+@dataclass
+class AdaptiveConcurrencyConfig(object):
+    """
+    Adaptive (AIMD) concurrency limit config.
+
+    If enabled, max_limit workers are started and the number
+    of the requests in progress is adjusted between min_limit
+    and max_limit by the latency and the throttling of the NSFW API.
+    """
+
+    enabled: bool = False
+    initial_limit: int = 4
+    min_limit: int = 1
+    max_limit: int = 32
+    backoff: float = 0.5
+    latency_tolerance: float = 2.0
+
+
+@dataclass
+class HttpClientConfig(object):
+    """HTTP client (of the NSFW API) config."""
+
+    http2: bool = True
+    max_connections: int = 20
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 60.0
+    timeout: float = 30.0
+    connect_timeout: float = 5.0
+    pool_timeout: float = 10.0
+
+
+@dataclass
+class LocalModelConfig(object):
+    """
+    Local NSFW classifier (ONNX model) config.
+
+    The image is resized to input_size x input_size, scaled to [0, 1]
+    and normalized with mean/std (per RGB channel). nsfw_labels are
+    the indices of the model outputs summed into the nsfw score.
+    The images downloaded by URL larger than max_image_size (bytes)
+    are rejected.
+    """
+
+    path: str = "models/nsfw.onnx"
+    input_size: int = 224
+    layout: str = "NCHW"
+    mean: Tuple[float, ...] = (0.0, 0.0, 0.0)
+    std: Tuple[float, ...] = (1.0, 1.0, 1.0)
+    nsfw_labels: Tuple[int, ...] = (1,)
+    max_batch_size: int = 32
+    threads: int = 0
+    decode_workers: int = 4
+    decode_in_processes: bool = False
+    max_image_size: int = 20 * 1024 * 1024
+
+
+@dataclass
+class ResultCacheConfig(object):
+    """Moderation results cache config."""
+
+    ttl: int = 86400
+    lru_size: int = 10000
+
+
+@dataclass
+class UrlModerationConfig(object):
+    """
+    Config of the moderation of the images by URL.
+
+    The results are cached by the canonical URL (for RESULT_CACHE_TTL).
+    If revalidate is True, the cached result of the URL checked longer
+    than revalidate_after seconds ago is reused only if the HEAD request
+    returns the same ETag/Last-Modified.
+    """
+
+    revalidate: bool = True
+    revalidate_after: int = 300
+    head_timeout: float = 2.0
+
+
+@dataclass
+class BatchConfig(object):
+    """
+    Batch moderation config.
+
+    max_in_flight: maximum number of images of one batch waiting
+    for moderation (so a huge batch does not starve interactive traffic).
+    max_files: maximum number of image parts (they are kept in memory
+    while the batch is processed; archives are spooled to disk).
+    """
+
+    max_images: int = 10000
+    max_files: int = 100
+    max_in_flight: int = 32
+    max_image_size: int = 20 * 1024 * 1024
+    timeout: float = 60.0
+
+
+@dataclass
+class PushConfig(object):
+    """
+    Config of pushing the moderation results (SSE and WebSocket).
+
+    heartbeat: the interval of keep-alive messages (SSE) and of reading
+    the statuses of the watched requests (seconds).
+    timeout: maximum duration of the SSE stream (seconds).
+    """
+
+    max_requests: int = 1000
+    heartbeat: float = 15.0
+    timeout: float = 300.0
+
+
+@dataclass
+class WebhooksConfig(object):
+    """
+    Webhook delivery config.
+
+    The failed deliveries (network errors, 408, 429 and 5xx) are retried
+    with an exponential randomized delay, then put into the dead-letter
+    list. secret: if set, the body is signed (X-Signature header,
+    HMAC-SHA256).
+    """
+
+    max_concurrency: int = 64
+    per_host_concurrency: int = 4
+    max_attempts: int = 8
+    retry_base_delay: float = 1.0
+    retry_max_delay: float = 300.0
+    timeout: float = 10.0
+    secret: Optional[str] = None
+    dead_letter_max_len: int = 10000
+
+
+@dataclass
+class MetricsConfig(object):
+    """
+    Prometheus metrics config.
+
+    The server exposes GET /metrics, the moderator serves it on port
+    (0 - not served).
+    """
+
+    enabled: bool = True
+    port: int = 9100
+
+
+@dataclass
+class ServerTimingConfig(object):
+    """
+    Config of the request stage timing.
+
+    enabled: return the Server-Timing header with the durations of the
+    stages (incl. the moderator ones). Off by default: the header tells
+    the clients how the service works inside (debugging only).
+    slow_request_threshold: log the timeline of the requests that take
+    longer (seconds, 0 - disabled).
+    """
+
+    enabled: bool = False
+    slow_request_threshold: float = 0.0
+
+
+@dataclass
+class NearDuplicatesConfig(object):
+    """
+    Near-duplicate images index config.
+
+    max_size: number of the newest results kept in the index.
+    refresh_interval: how often the results of the other server
+    processes are read (seconds).
+    """
+
+    enabled: bool = False
+    max_distance: int = 4
+    max_size: int = 100000
+    refresh_interval: float = 5.0
+
+
+@dataclass
+class BlobStoreConfig(object):
+    """
+    Blob store config.
+
+    backend: "redis", "filesystem" or "inline" (the image is put
+    into the queue message).
+    """
+
+    backend: str = "redis"
+    directory: str = "/tmp/image_moderator/blobs"
+    ttl: int = 3600
+
+
+@dataclass
+class CascadeConfig(object):
+    """
+    Cascade of the NSFW clients config.
+
+    The verdict of the first stage is final if its nsfw score is
+    outside [low, high] (the uncertainty band around the NSFW threshold).
+    """
+
+    first_stage: str = "onnx"
+    second_stage: str = "clarifai"
+    low: float = 0.5
+    high: float = 0.9
+
+
+@dataclass
+class HedgingConfig(object):
+    """
+    Hedged requests config.
+
+    secondary: backend of the hedged requests and the failover
+    (None - the same backend as the moderator).
+    """
+
+    enabled: bool = False
+    secondary: Optional[str] = None
+    percentile: float = 95.0
+    min_delay: float = 0.05
+    budget: float = 0.05
+
+
+@dataclass
+class QueueConfig(object):
+    """
+    Moderation requests queue config.
+
+    backend: "list" (LPOP, a request is lost if the moderator crashes)
+    or "stream" (consumer group, the unacknowledged requests
+    of the crashed moderators are reclaimed by the others).
+    max_deliveries: the stream requests delivered more times
+    are moved to the dead-letter stream.
+    lanes: priority lanes (list backend) with their weights.
+    The moderators take the requests of the busy lanes in proportion
+    to the weights (weight 0 - only when the other lanes are empty).
+    The first lane is the default one.
+    lane_max_wait: a lane not served for so long (seconds) is served
+    next, whatever its weight (starvation protection).
+    batch_lane: lane of the /moderate/batch requests.
+    """
+
+    backend: str = "list"
+    stream_group: str = "moderators"
+    claim_idle: float = 60.0
+    max_deliveries: int = 5
+    dead_letter_max_len: int = 10000
+    consumer_name: Optional[str] = None
+    lanes: Tuple[Tuple[str, int], ...] = (("interactive", 8), ("bulk", 1))
+    lane_max_wait: float = 30.0
+    batch_lane: str = "bulk"
+
+    @property
+    def default_lane(self) -> str:
+        """Return the lane of the requests without a lane."""
+        return self.lanes[0][0]
+
+    @property
+    def lane_names(self) -> Tuple[str, ...]:
+        """Return the names of the lanes."""
+        return tuple(name for name, _ in self.lanes)
+
+
+@dataclass
+class AdmissionConfig(object):
+    """
+    Admission control config (server).
+
+    The wait of a new request is predicted from the depth of its lane
+    and the drain rate of the moderators, sampled every interval
+    seconds (smoothing - weight of the new drain rate sample).
+    sync_budget: if the predicted wait is longer (seconds, None or 0 -
+    the moderation timeout), 202 is returned without waiting.
+    max_wait: if the predicted wait is longer (seconds, 0 - never),
+    the requests are rejected with 503.
+    max_depth: if the queue is that deep (0 - unlimited), the requests
+    are rejected with 429 (protects the Redis memory).
+    """
+
+    enabled: bool = True
+    interval: float = 1.0
+    smoothing: float = 0.3
+    sync_budget: Optional[float] = None
+    max_wait: float = 120.0
+    max_depth: int = 10000
 
 
 @dataclass
@@ -26,8 +357,43 @@ class Config(object):
 
     debug: bool
     moderation_timeout: float
+    result_ttl: int
     clarifai: ClarifaiConfig
     redis: RedisConfig
+    moderator: ModeratorConfig
+    result_cache: ResultCacheConfig
+    url_moderation: UrlModerationConfig
+    batch: BatchConfig
+    push: PushConfig
+    webhooks: WebhooksConfig
+    metrics: MetricsConfig
+    server_timing: ServerTimingConfig
+    near_duplicates: NearDuplicatesConfig
+    blob_store: BlobStoreConfig
+    queue: QueueConfig
+    admission: AdmissionConfig
+    http_client: HttpClientConfig
+    local_model: LocalModelConfig
+    adaptive_concurrency: AdaptiveConcurrencyConfig
+    preprocessing: PreprocessingConfig
+    cascade: CascadeConfig
+    hedging: HedgingConfig
+    nsfw_threshold: float = 0.7
+    binary_messages: bool = True
+
+
+def _floats(value: str) -> Tuple[float, ...]:
+    """Parse comma-separated floats."""
+    return tuple(float(item) for item in value.split(","))
+
+
+def _lanes(value: str) -> Tuple[Tuple[str, int], ...]:
+    """Parse comma-separated lanes with weights (name:weight)."""
+    lanes = []
+    for item in value.split(","):
+        name, _, weight = item.strip().partition(":")
+        lanes.append((name, int(weight or 1)))
+    return tuple(lanes)
 
 
 def get_config() -> Config:
@@ -40,13 +406,211 @@ def get_config() -> Config:
     return Config(
         debug=os.getenv("DEBUG", "1") == "1",
         moderation_timeout=float(os.getenv("MODERATION_TIMEOUT", 5.0)),
+        result_ttl=int(os.getenv("RESULT_TTL", 3600)),
         clarifai=ClarifaiConfig(
             access_token=os.getenv("CLARIFAI_ACCESS_TOKEN", "clarifai PAT"),
+            base_url=os.getenv("CLARIFAI_BASE_URL") or None,
         ),
         redis=RedisConfig(
-            url=os.getenv("REDIS_URL", "redis://localhost:6379")
+            url=os.getenv("REDIS_URL", "redis://localhost:6379"),
+            max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 100)),
+            pool_timeout=float(os.getenv("REDIS_POOL_TIMEOUT", 10.0)),
+            health_check_interval=int(
+                os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30)
+            ),
+        ),
+        moderator=ModeratorConfig(
+            concurrency=int(os.getenv("MODERATOR_CONCURRENCY", 4)),
+            rate_limit=float(os.getenv("MODERATOR_RATE_LIMIT", 1.0)) or None,
+            rate_burst=int(os.getenv("MODERATOR_RATE_BURST", 1)),
+            batch_size=int(os.getenv("MODERATOR_BATCH_SIZE", 1)),
+            batch_max_delay=float(
+                os.getenv("MODERATOR_BATCH_MAX_DELAY", 0.05)
+            ),
+            backend=os.getenv("MODERATOR_BACKEND", "clarifai"),
+            max_retries=int(os.getenv("MODERATOR_MAX_RETRIES", 5)),
+            retry_base_delay=float(
+                os.getenv("MODERATOR_RETRY_BASE_DELAY", 1.0)
+            ),
+            retry_max_delay=float(
+                os.getenv("MODERATOR_RETRY_MAX_DELAY", 30.0)
+            ),
+            max_delayed=int(os.getenv("MODERATOR_MAX_DELAYED", 10000)),
+        ),
+        result_cache=ResultCacheConfig(
+            ttl=int(os.getenv("RESULT_CACHE_TTL", 86400)),
+            lru_size=int(os.getenv("RESULT_CACHE_LRU_SIZE", 10000)),
+        ),
+        url_moderation=UrlModerationConfig(
+            revalidate=os.getenv("URL_MODERATION_REVALIDATE", "1") == "1",
+            revalidate_after=int(
+                os.getenv("URL_MODERATION_REVALIDATE_AFTER", 300)
+            ),
+            head_timeout=float(os.getenv("URL_MODERATION_HEAD_TIMEOUT", 2.0)),
+        ),
+        batch=BatchConfig(
+            max_images=int(os.getenv("BATCH_MAX_IMAGES", 10000)),
+            max_files=int(os.getenv("BATCH_MAX_FILES", 100)),
+            max_in_flight=int(os.getenv("BATCH_MAX_IN_FLIGHT", 32)),
+            max_image_size=int(
+                os.getenv("BATCH_MAX_IMAGE_SIZE", 20 * 1024 * 1024)
+            ),
+            timeout=float(os.getenv("BATCH_TIMEOUT", 60.0)),
+        ),
+        push=PushConfig(
+            max_requests=int(os.getenv("PUSH_MAX_REQUESTS", 1000)),
+            heartbeat=float(os.getenv("PUSH_HEARTBEAT", 15.0)),
+            timeout=float(os.getenv("PUSH_TIMEOUT", 300.0)),
+        ),
+        webhooks=WebhooksConfig(
+            max_concurrency=int(os.getenv("WEBHOOKS_MAX_CONCURRENCY", 64)),
+            per_host_concurrency=int(
+                os.getenv("WEBHOOKS_PER_HOST_CONCURRENCY", 4)
+            ),
+            max_attempts=int(os.getenv("WEBHOOKS_MAX_ATTEMPTS", 8)),
+            retry_base_delay=float(
+                os.getenv("WEBHOOKS_RETRY_BASE_DELAY", 1.0)
+            ),
+            retry_max_delay=float(
+                os.getenv("WEBHOOKS_RETRY_MAX_DELAY", 300.0)
+            ),
+            timeout=float(os.getenv("WEBHOOKS_TIMEOUT", 10.0)),
+            secret=os.getenv("WEBHOOKS_SECRET") or None,
+            dead_letter_max_len=int(
+                os.getenv("WEBHOOKS_DEAD_LETTER_MAX_LEN", 10000)
+            ),
+        ),
+        metrics=MetricsConfig(
+            enabled=os.getenv("METRICS_ENABLED", "1") == "1",
+            port=int(os.getenv("METRICS_PORT", 9100)),
+        ),
+        server_timing=ServerTimingConfig(
+            enabled=os.getenv("SERVER_TIMING_ENABLED", "0") == "1",
+            slow_request_threshold=float(
+                os.getenv("SLOW_REQUEST_THRESHOLD", 0.0)
+            ),
+        ),
+        near_duplicates=NearDuplicatesConfig(
+            enabled=os.getenv("NEAR_DUPLICATES_ENABLED", "0") == "1",
+            max_distance=int(os.getenv("NEAR_DUPLICATES_MAX_DISTANCE", 4)),
+            max_size=int(os.getenv("NEAR_DUPLICATES_MAX_SIZE", 100000)),
+            refresh_interval=float(
+                os.getenv("NEAR_DUPLICATES_REFRESH_INTERVAL", 5.0)
+            ),
+        ),
+        blob_store=BlobStoreConfig(
+            backend=os.getenv("BLOB_STORE", "redis"),
+            directory=os.getenv(
+                "BLOB_STORE_DIR", "/tmp/image_moderator/blobs"
+            ),
+            ttl=int(os.getenv("BLOB_STORE_TTL", 3600)),
+        ),
+        queue=QueueConfig(
+            backend=os.getenv("QUEUE_BACKEND", "list"),
+            stream_group=os.getenv("QUEUE_STREAM_GROUP", "moderators"),
+            claim_idle=float(os.getenv("QUEUE_CLAIM_IDLE", 60.0)),
+            max_deliveries=int(os.getenv("QUEUE_MAX_DELIVERIES", 5)),
+            dead_letter_max_len=int(
+                os.getenv("QUEUE_DEAD_LETTER_MAX_LEN", 10000)
+            ),
+            consumer_name=os.getenv("QUEUE_CONSUMER_NAME") or None,
+            lanes=_lanes(os.getenv("QUEUE_LANES", "interactive:8,bulk:1")),
+            lane_max_wait=float(os.getenv("QUEUE_LANE_MAX_WAIT", 30.0)),
+            batch_lane=os.getenv("QUEUE_BATCH_LANE", "bulk"),
+        ),
+        admission=AdmissionConfig(
+            enabled=os.getenv("ADMISSION_ENABLED", "1") == "1",
+            interval=float(os.getenv("ADMISSION_INTERVAL", 1.0)),
+            smoothing=float(os.getenv("ADMISSION_SMOOTHING", 0.3)),
+            sync_budget=float(os.getenv("ADMISSION_SYNC_BUDGET", 0.0)) or None,
+            max_wait=float(os.getenv("ADMISSION_MAX_WAIT", 120.0)),
+            max_depth=int(os.getenv("ADMISSION_MAX_DEPTH", 10000)),
+        ),
+        http_client=HttpClientConfig(
+            http2=os.getenv("HTTP_CLIENT_HTTP2", "1") == "1",
+            max_connections=int(os.getenv("HTTP_CLIENT_MAX_CONNECTIONS", 20)),
+            max_keepalive_connections=int(
+                os.getenv("HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS", 20)
+            ),
+            keepalive_expiry=float(
+                os.getenv("HTTP_CLIENT_KEEPALIVE_EXPIRY", 60.0)
+            ),
+            timeout=float(os.getenv("HTTP_CLIENT_TIMEOUT", 30.0)),
+            connect_timeout=float(
+                os.getenv("HTTP_CLIENT_CONNECT_TIMEOUT", 5.0)
+            ),
+            pool_timeout=float(os.getenv("HTTP_CLIENT_POOL_TIMEOUT", 10.0)),
+        ),
+        local_model=LocalModelConfig(
+            path=os.getenv("LOCAL_MODEL_PATH", "models/nsfw.onnx"),
+            input_size=int(os.getenv("LOCAL_MODEL_INPUT_SIZE", 224)),
+            layout=os.getenv("LOCAL_MODEL_LAYOUT", "NCHW"),
+            mean=_floats(os.getenv("LOCAL_MODEL_MEAN", "0,0,0")),
+            std=_floats(os.getenv("LOCAL_MODEL_STD", "1,1,1")),
+            nsfw_labels=tuple(
+                int(label)
+                for label in _floats(os.getenv("LOCAL_MODEL_NSFW_LABELS", "1"))
+            ),
+            max_batch_size=int(os.getenv("LOCAL_MODEL_MAX_BATCH_SIZE", 32)),
+            threads=int(os.getenv("LOCAL_MODEL_THREADS", 0)),
+            decode_workers=int(os.getenv("LOCAL_MODEL_DECODE_WORKERS", 4)),
+            decode_in_processes=(
+                os.getenv("LOCAL_MODEL_DECODE_IN_PROCESSES", "0") == "1"
+            ),
+            max_image_size=int(
+                os.getenv("LOCAL_MODEL_MAX_IMAGE_SIZE", 20 * 1024 * 1024)
+            ),
+        ),
+        adaptive_concurrency=AdaptiveConcurrencyConfig(
+            enabled=os.getenv("ADAPTIVE_CONCURRENCY_ENABLED", "0") == "1",
+            initial_limit=int(
+                os.getenv("ADAPTIVE_CONCURRENCY_INITIAL_LIMIT", 4)
+            ),
+            min_limit=int(os.getenv("ADAPTIVE_CONCURRENCY_MIN_LIMIT", 1)),
+            max_limit=int(os.getenv("ADAPTIVE_CONCURRENCY_MAX_LIMIT", 32)),
+            backoff=float(os.getenv("ADAPTIVE_CONCURRENCY_BACKOFF", 0.5)),
+            latency_tolerance=float(
+                os.getenv("ADAPTIVE_CONCURRENCY_LATENCY_TOLERANCE", 2.0)
+            ),
+        ),
+        preprocessing=PreprocessingConfig(
+            enabled=os.getenv("PREPROCESSING_ENABLED", "0") == "1",
+            max_size=int(os.getenv("PREPROCESSING_MAX_SIZE", 512)),
+            format=os.getenv("PREPROCESSING_FORMAT", "JPEG"),
+            quality=int(os.getenv("PREPROCESSING_QUALITY", 85)),
+            workers=int(os.getenv("PREPROCESSING_WORKERS", 0)),
+        ),
+        cascade=CascadeConfig(
+            first_stage=os.getenv("CASCADE_FIRST_STAGE", "onnx"),
+            second_stage=os.getenv("CASCADE_SECOND_STAGE", "clarifai"),
+            low=float(os.getenv("CASCADE_LOW", 0.5)),
+            high=float(os.getenv("CASCADE_HIGH", 0.9)),
+        ),
+        hedging=HedgingConfig(
+            enabled=os.getenv("HEDGING_ENABLED", "0") == "1",
+            secondary=os.getenv("HEDGING_SECONDARY") or None,
+            percentile=float(os.getenv("HEDGING_PERCENTILE", 95.0)),
+            min_delay=float(os.getenv("HEDGING_MIN_DELAY", 0.05)),
+            budget=float(os.getenv("HEDGING_BUDGET", 0.05)),
         ),
+        nsfw_threshold=float(os.getenv("NSFW_THRESHOLD", 0.7)),
+        binary_messages=os.getenv("BINARY_MESSAGES", "1") == "1",
     )
 
 
 MODERATION_REQUESTS_QUEUE_KEY: str = "moderation_requests"
+MODERATION_REQUESTS_STREAM_KEY: str = "moderation_requests_stream"
+# Requests of the stream delivered too many times (stream)
+MODERATION_REQUESTS_DEAD_LETTER_KEY: str = "moderation_requests_dead"
+MODERATION_RESPONSES_CHANNEL: str = "moderation_responses"
+# Moderation requests waiting for a retry (sorted set by the retry time)
+MODERATION_REQUESTS_DELAYED_KEY: str = "moderation_requests_delayed"
+# Number of the requests taken by the moderators (drain rate)
+MODERATION_DEQUEUED_KEY: str = "moderation_requests_dequeued"
+# Hash with the status and the result of the moderation request
+MODERATION_STATUS_KEY_PREFIX: str = "moderation_status:"
+# Webhooks to deliver, scheduled retries (sorted set by the retry time)
+# and the failed ones
+WEBHOOKS_QUEUE_KEY: str = "moderation_webhooks"
+WEBHOOKS_RETRY_KEY: str = "moderation_webhooks_retry"
+WEBHOOKS_DEAD_LETTER_KEY: str = "moderation_webhooks_dead"
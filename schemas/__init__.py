@@ -1,3 +1,9 @@
 """The package responsible for the DTO."""
 
-from .moderation import ModerationRequest, ModerationResponse
+from .moderation import (
+    ModerationRequest,
+    ModerationResponse,
+    ModerationStatus,
+    UrlModerationRequest,
+)
+from .webhook import WebhookJob
@@ -1,9 +1,9 @@
 """The module responsible for the schemes for moderation."""
 
-from typing import Literal
+from typing import Dict, Literal, Optional
 from uuid import uuid4
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 
 class ModerationRequest(BaseModel):
@@ -13,7 +13,90 @@ class ModerationRequest(BaseModel):
         default_factory=lambda: str(uuid4()),
         description="Moderation request ID",
     )
-    image: str = Field(..., description="Image URL or Base64")
+    image: str = Field(default="", description="Image URL or Base64")
+    blob_ref: Optional[str] = Field(
+        default=None,
+        description="Reference to the image bytes in the blob store."
+        " Is used instead of the image.",
+    )
+    image_bytes: Optional[bytes] = Field(
+        default=None,
+        exclude=True,
+        repr=False,
+        description="Raw image bytes. Is used instead of the image."
+        " Is transferred only by the binary codec.",
+    )
+    callback_url: Optional[str] = Field(
+        default=None,
+        description="URL the verdict is POSTed to (webhook).",
+    )
+    lane: Optional[str] = Field(
+        default=None,
+        description="Priority lane of the queue (None - the default one).",
+    )
+    cache_key: Optional[str] = Field(
+        default=None,
+        description="Digest the result is cached by. Is set for the"
+        " requests with callback_url, their results are cached"
+        " by the moderator.",
+    )
+    enqueued_at: Optional[float] = Field(
+        default=None,
+        description="When the request was put into the queue (UNIX time).",
+    )
+    attempt: int = Field(
+        default=0,
+        description="Number of the attempts throttled by the NSFW API.",
+    )
+    timings: Dict[str, float] = Field(
+        default_factory=dict,
+        description="Durations of the stages of the previous attempts"
+        " (seconds).",
+    )
+    preprocessed: bool = Field(
+        default=False,
+        description="The image is preprocessed already (the retries).",
+    )
+    dequeued_at: Optional[float] = Field(
+        default=None,
+        exclude=True,
+        description="When the request was taken by the moderator"
+        " (UNIX time). Is not transferred.",
+    )
+
+    @model_validator(mode="after")
+    def check_image(self) -> "ModerationRequest":
+        """Check that there is an image or a reference to it."""
+        if (
+            not self.image
+            and self.blob_ref is None
+            and self.image_bytes is None
+        ):
+            raise ValueError(
+                "Either image, blob_ref or image_bytes is required."
+            )
+        return self
+
+
+class UrlModerationRequest(BaseModel):
+    """Schema of the request to moderate the image by URL."""
+
+    url: str = Field(
+        ...,
+        max_length=2048,
+        description="Absolute http(s) URL of the image.",
+    )
+    callback_url: Optional[str] = Field(
+        default=None,
+        max_length=2048,
+        description="If set, the request is answered right after it is"
+        " queued and the verdict is POSTed to this URL.",
+    )
+    lane: Optional[str] = Field(
+        default=None,
+        max_length=64,
+        description="Priority lane of the queue (default: the first one).",
+    )
 
 
 class ModerationResponse(BaseModel):
@@ -29,3 +112,35 @@ class ModerationResponse(BaseModel):
     status: Literal["OK", "ERROR"] = Field(
         default="OK", description="Response status."
     )
+    timings: Dict[str, float] = Field(
+        default_factory=dict,
+        description="Durations of the moderator stages (seconds): queue,"
+        " retry, preprocess, limit (waiting for the rate and concurrency"
+        " limits) and upstream (NSFW backend call).",
+    )
+
+    def verdict(self, nsfw_threshold: float) -> Dict[str, str]:
+        """
+        Return the verdict on the image: OK, REJECTED or ERROR.
+
+        :param nsfw_threshold: Images with the higher nsfw score
+        are rejected.
+        """
+        if self.status == "ERROR":
+            return {"status": "ERROR"}
+        if self.nsfw <= nsfw_threshold:
+            return {"status": "OK"}
+        else:
+            return {"status": "REJECTED", "reason": "NSFW content"}
+
+
+class ModerationStatus(BaseModel):
+    """Moderation request status schema."""
+
+    id: str = Field(..., description="Moderation request ID.")
+    status: Literal["QUEUED", "PROCESSING", "DONE"] = Field(
+        ..., description="Moderation request status."
+    )
+    response: Optional[ModerationResponse] = Field(
+        default=None, description="Moderation response (if DONE)."
+    )
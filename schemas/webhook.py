@@ -0,0 +1,24 @@
+"""The module responsible for the schemes for webhooks."""
+
+from typing import Optional
+from uuid import uuid4
+
+from pydantic import BaseModel, Field
+
+from .moderation import ModerationResponse
+
+
+class WebhookJob(BaseModel):
+    """Delivery of the moderation result to the callback URL."""
+
+    id: str = Field(
+        default_factory=lambda: str(uuid4()), description="Delivery ID."
+    )
+    url: str = Field(..., description="Callback URL.")
+    response: ModerationResponse = Field(
+        ..., description="Moderation response."
+    )
+    attempt: int = Field(default=0, description="Number of failed attempts.")
+    last_error: Optional[str] = Field(
+        default=None, description="Error of the last failed attempt."
+    )
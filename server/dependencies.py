@@ -0,0 +1,93 @@
+"""The module responsible for the dependencies of the handlers."""
+
+from typing import Optional
+
+from fastapi import Depends
+from fastapi.requests import HTTPConnection
+
+from blob_store.base import BlobStore
+from con_prod.moderation_requests import create_requests_producer
+from con_prod.moderation_requests.base import BaseModerationRequestsProducer
+from con_prod.moderation_responses.consumer import ModerationResponsesConsumer
+from con_prod.moderation_responses.dispatcher import (
+    ModerationResponsesDispatcher,
+)
+from config.app import Config
+from services.admission import AdmissionController
+from services.near_duplicates import NearDuplicateIndex
+from services.result_cache import ModerationResultCache
+from services.url_cache import UrlValidators
+
+from .resources import Resources
+from .timing import StageTimer
+
+
+def get_resources(connection: HTTPConnection) -> Resources:
+    """Return the resources created in the application lifespan."""
+    return connection.app.state.resources
+
+
+def get_config(resources: Resources = Depends(get_resources)) -> Config:
+    """Return the app config."""
+    return resources.config
+
+
+def get_requests_producer(
+    resources: Resources = Depends(get_resources),
+) -> BaseModerationRequestsProducer:
+    """Return the moderation requests producer on the shared redis pool."""
+    return create_requests_producer(resources.config, resources.redis)
+
+
+def get_responses_consumer(
+    resources: Resources = Depends(get_resources),
+) -> ModerationResponsesConsumer:
+    """Return the moderation responses consumer on the shared redis pool."""
+    return ModerationResponsesConsumer(redis_client=resources.redis)
+
+
+def get_responses_dispatcher(
+    resources: Resources = Depends(get_resources),
+) -> ModerationResponsesDispatcher:
+    """Return the moderation responses dispatcher of the process."""
+    return resources.responses_dispatcher
+
+
+def get_result_cache(
+    resources: Resources = Depends(get_resources),
+) -> ModerationResultCache:
+    """Return the moderation results cache."""
+    return resources.result_cache
+
+
+def get_near_duplicates(
+    resources: Resources = Depends(get_resources),
+) -> Optional[NearDuplicateIndex]:
+    """Return the near-duplicate images index (None if disabled)."""
+    return resources.near_duplicates
+
+
+def get_blob_store(
+    resources: Resources = Depends(get_resources),
+) -> Optional[BlobStore]:
+    """Return the blob store (None if the images are put into the queue)."""
+    return resources.blob_store
+
+
+def get_url_validators(
+    resources: Resources = Depends(get_resources),
+) -> Optional[UrlValidators]:
+    """Return the versions of the images by URL (None if disabled)."""
+    return resources.url_validators
+
+
+def get_admission(
+    resources: Resources = Depends(get_resources),
+) -> Optional[AdmissionController]:
+    """Return the admission control (None if disabled)."""
+    return resources.admission
+
+
+def get_stage_timer(connection: HTTPConnection) -> StageTimer:
+    """Return the stage timer of the request (unused one, if not timed)."""
+    return getattr(connection.state, "stage_timer", None) or StageTimer()
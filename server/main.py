@@ -7,9 +7,13 @@ from fastapi import FastAPI
 from config.app import Config, get_config
 from config.log import get_log_config
 
-from .middlewares.config_middleware import ConfigMiddleware
+from .metrics import MetricsMiddleware
+from .resources import lifespan
 from .routes.healthcheck import router as healthcheck_router
+from .routes.metrics import router as metrics_router
 from .routes.moderation import router as moderation_router
+from .routes.push import router as push_router
+from .timing import ServerTimingMiddleware
 
 tags_metadata = [
     {
@@ -28,14 +32,24 @@ def create_app() -> FastAPI:
     logger.info("Creating FastAPI app...")
     app_ = FastAPI(
         openapi_tags=tags_metadata,
+        lifespan=lifespan,
     )
+    app_.state.config = config
 
     # register routers
     app_.include_router(moderation_router)
+    app_.include_router(push_router)
     app_.include_router(healthcheck_router)
-
-    # register middlewares
-    app_.add_middleware(ConfigMiddleware, config)
+    if config.metrics.enabled:
+        app_.include_router(metrics_router)
+        app_.add_middleware(MetricsMiddleware)
+    server_timing = config.server_timing
+    if server_timing.enabled or server_timing.slow_request_threshold > 0:
+        app_.add_middleware(
+            ServerTimingMiddleware,
+            header=server_timing.enabled,
+            slow_request_threshold=server_timing.slow_request_threshold,
+        )
 
     return app_
 
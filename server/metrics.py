@@ -0,0 +1,98 @@
+"""The module responsible for the metrics of the HTTP server."""
+
+from typing import Any, Awaitable, Callable, MutableMapping
+
+from redis.exceptions import RedisError
+
+from utils.metrics import Counter, Gauge
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+MODERATION_PATHS = ("/moderate/", "/moderate/url", "/moderate/batch")
+
+HTTP_RESPONSES = Counter(
+    "moderation_http_responses_total",
+    "HTTP responses by route and status code (200 - moderated in time,"
+    " 202 - accepted, the result is to be requested later).",
+    ("path", "code"),
+    [
+        (path, code)
+        for path in MODERATION_PATHS
+        for code in ("200", "202", "400", "422", "429", "500", "503")
+    ],
+)
+HTTP_IN_FLIGHT = Gauge(
+    "moderation_http_requests_in_flight",
+    "HTTP requests in progress (including the SSE streams).",
+)
+WAITERS = Gauge(
+    "moderation_result_waiters",
+    "Requests waiting for the moderation results (incl. push subscribers).",
+)
+SERVER_ERRORS = Counter(
+    "moderation_server_errors_total",
+    "Errors of the server by cause: redis - Redis is unavailable,"
+    " moderation - the image was not moderated (ERROR),"
+    " unhandled - other exceptions.",
+    ("cause",),
+    (("redis",), ("moderation",), ("unhandled",)),
+)
+
+
+class MetricsMiddleware(object):
+    """
+    Counts the HTTP responses and the requests in progress.
+
+    A plain ASGI middleware (not BaseHTTPMiddleware), so the requests
+    are not wrapped into extra tasks. The responses are counted
+    by the route template, so the label sets are bounded.
+    """
+
+    def __init__(self, app: ASGIApp):
+        """
+        Init class.
+
+        :param app: ASGI application.
+        """
+        self.__app = app
+
+    @classmethod
+    def __count(cls, scope: Scope, status_code: int) -> None:
+        """Count the response by the route template."""
+        path = getattr(scope.get("route"), "path", None) or "other"
+        HTTP_RESPONSES.labels(path, str(status_code)).inc()
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        """Handle the request."""
+        if scope["type"] != "http":
+            await self.__app(scope, receive, send)
+            return
+
+        started = False
+
+        async def send_counted(message: Message) -> None:
+            """Count the response when it starts."""
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                self.__count(scope, message["status"])
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.__app(scope, receive, send_counted)
+        except Exception as exc:
+            cause = "redis" if isinstance(exc, RedisError) else "unhandled"
+            SERVER_ERRORS.labels(cause).inc()
+            if not started:
+                # answered with 500 by the outer middleware
+                self.__count(scope, 500)
+            raise
+        finally:
+            HTTP_IN_FLIGHT.dec()
@@ -1 +0,0 @@
-"""The package responsible for the middleware of the server."""
@@ -0,0 +1,141 @@
+"""The module responsible for the resources shared by all handlers."""
+
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Optional
+
+import httpx
+from fastapi import FastAPI
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.exceptions import RedisError
+
+from blob_store import create_blob_store
+from blob_store.base import BlobStore
+from con_prod.moderation_requests import queue_depth_collector
+from con_prod.moderation_responses.dispatcher import (
+    ModerationResponsesDispatcher,
+)
+from config.app import MODERATION_RESPONSES_CHANNEL, Config
+from services.admission import AdmissionController
+from services.near_duplicates import NearDuplicateIndex
+from services.result_cache import ModerationResultCache
+from services.url_cache import UrlValidators
+from utils.http import create_httpx_client
+from utils.metrics import REGISTRY
+from utils.redis import create_redis_pool
+
+from .metrics import WAITERS
+
+logger = getLogger("main.server.resources")
+
+
+@dataclass
+class Resources(object):
+    """Resources that live as long as the application."""
+
+    config: Config
+    redis_pool: BlockingConnectionPool
+    redis: Redis
+    result_cache: ModerationResultCache
+    responses_dispatcher: ModerationResponsesDispatcher
+    near_duplicates: Optional[NearDuplicateIndex] = None
+    blob_store: Optional[BlobStore] = None
+    httpx_client: Optional[httpx.AsyncClient] = None
+    url_validators: Optional[UrlValidators] = None
+    admission: Optional[AdmissionController] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
+    """
+    Create the shared resources on startup and release them on shutdown.
+
+    The resources are stored in app.state.resources.
+    """
+    config: Config = app.state.config
+    redis_pool = create_redis_pool(config.redis)
+    redis = Redis(connection_pool=redis_pool)
+    try:
+        await redis.ping()
+    except RedisError as exc:
+        logger.error("Redis is unavailable at startup: %s", str(exc))
+
+    near_duplicates: Optional[NearDuplicateIndex] = None
+    if config.near_duplicates.enabled:
+        near_duplicates = NearDuplicateIndex(
+            max_distance=config.near_duplicates.max_distance,
+            max_size=config.near_duplicates.max_size,
+            refresh_interval=config.near_duplicates.refresh_interval,
+            redis_client=redis,
+        )
+        await near_duplicates.start()
+
+    responses_dispatcher = ModerationResponsesDispatcher(
+        channel=MODERATION_RESPONSES_CHANNEL, redis_client=redis
+    )
+    await responses_dispatcher.start()
+
+    httpx_client: Optional[httpx.AsyncClient] = None
+    url_validators: Optional[UrlValidators] = None
+    if config.url_moderation.revalidate:
+        httpx_client = create_httpx_client(
+            config.http_client, public_only=True
+        )
+        url_validators = UrlValidators(
+            httpx_client=httpx_client,
+            revalidate_after=config.url_moderation.revalidate_after,
+            head_timeout=config.url_moderation.head_timeout,
+            ttl=config.result_cache.ttl,
+            redis_client=redis,
+        )
+
+    admission: Optional[AdmissionController] = None
+    if config.admission.enabled:
+        admission = AdmissionController(config, redis_client=redis)
+        await admission.start()
+
+    app.state.resources = Resources(
+        config=config,
+        redis_pool=redis_pool,
+        redis=redis,
+        result_cache=ModerationResultCache(
+            ttl=config.result_cache.ttl,
+            lru_size=config.result_cache.lru_size,
+            redis_client=redis,
+        ),
+        responses_dispatcher=responses_dispatcher,
+        near_duplicates=near_duplicates,
+        blob_store=create_blob_store(config.blob_store, redis),
+        httpx_client=httpx_client,
+        url_validators=url_validators,
+        admission=admission,
+    )
+    logger.info(
+        "Redis pool created (max connections: %d).",
+        config.redis.max_connections,
+    )
+
+    async def collect_waiters() -> None:
+        """Read the number of the waiters."""
+        WAITERS.set(responses_dispatcher.waiters)
+
+    collectors = [queue_depth_collector(config, redis), collect_waiters]
+    for collector in collectors:
+        REGISTRY.add_collector(collector)
+    try:
+        yield
+    finally:
+        for collector in collectors:
+            REGISTRY.remove_collector(collector)
+        if admission is not None:
+            await admission.stop()
+        if near_duplicates is not None:
+            await near_duplicates.stop()
+        await responses_dispatcher.stop()
+        if httpx_client is not None:
+            await httpx_client.aclose()
+        await redis.aclose()
+        await redis_pool.disconnect()
+        logger.info("Redis pool closed.")
@@ -1,6 +1,22 @@
 """The module responsible for the endpoints for image moderation."""
 
-from fastapi import APIRouter
+import json
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, Response
+from redis.exceptions import RedisError
+
+from con_prod.moderation_requests import get_queue_stats
+from services.near_duplicates import NearDuplicateIndex
+from services.result_cache import ModerationResultCache
+from utils.redis import get_pool_stats
+
+from ..dependencies import (
+    get_near_duplicates,
+    get_resources,
+    get_result_cache,
+)
+from ..resources import Resources
 
 router = APIRouter(tags=["healthcheck"])
 
@@ -9,3 +25,142 @@ router = APIRouter(tags=["healthcheck"])
 async def health():
     """Check health."""
     return {"status": "OK"}
+
+
+@router.get(
+    "/health/redis/",
+    status_code=200,
+    responses={
+        200: {
+            "description": "Redis is available.",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "status": "OK",
+                        "pool": {
+                            "max_connections": 100,
+                            "created_connections": 3,
+                            "in_use_connections": 1,
+                            "idle_connections": 2,
+                        },
+                        "waiters": 1,
+                    },
+                },
+            },
+        },
+        503: {"description": "Redis is unavailable."},
+    },
+)
+async def redis_health(resources: Resources = Depends(get_resources)):
+    """
+    Check redis and return the usage stats of the connection pool.
+
+    waiters - number of requests waiting for the moderation results.
+    """
+    stats: Dict[str, Any] = {
+        "pool": get_pool_stats(resources.redis_pool),
+        "waiters": resources.responses_dispatcher.waiters,
+    }
+    try:
+        await resources.redis.ping()
+    except RedisError:
+        return Response(
+            status_code=503,
+            content=json.dumps({"status": "ERROR", **stats}),
+        )
+    return {"status": "OK", **stats}
+
+
+@router.get(
+    "/health/cache/",
+    status_code=200,
+    responses={
+        200: {
+            "description": "Moderation results cache stats.",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "local_hits": 10,
+                        "redis_hits": 2,
+                        "misses": 5,
+                        "coalesced": 1,
+                        "local_size": 7,
+                        "near_duplicates": {
+                            "hits": 1,
+                            "misses": 4,
+                            "size": 120,
+                        },
+                    },
+                },
+            },
+        },
+    },
+)
+async def cache_stats(
+    result_cache: ModerationResultCache = Depends(get_result_cache),
+    near_duplicates: Optional[NearDuplicateIndex] = Depends(
+        get_near_duplicates
+    ),
+):
+    """Return hit/miss/coalesce counters of the moderation results cache."""
+    stats: Dict[str, Any] = dict(result_cache.stats)
+    if near_duplicates is not None:
+        stats["near_duplicates"] = near_duplicates.stats
+    return stats
+
+
+@router.get(
+    "/health/queue/",
+    status_code=200,
+    responses={
+        200: {
+            "description": "Moderation requests queue stats.",
+            "content": {
+                "application/json": {
+                    "examples": {
+                        "list": {
+                            "value": {
+                                "backend": "list",
+                                "length": 3,
+                                "lanes": {"interactive": 1, "bulk": 2},
+                            },
+                        },
+                        "stream": {
+                            "value": {
+                                "backend": "stream",
+                                "length": 120,
+                                "lag": 3,
+                                "pending": 4,
+                                "consumers": {
+                                    "moderator-1": {
+                                        "pending": 2,
+                                        "idle_ms": 15,
+                                    },
+                                    "moderator-2": {
+                                        "pending": 2,
+                                        "idle_ms": 40,
+                                    },
+                                },
+                            },
+                        },
+                    },
+                },
+            },
+        },
+        503: {"description": "Redis is unavailable."},
+    },
+)
+async def queue_stats(resources: Resources = Depends(get_resources)):
+    """
+    Return the stats of the moderation requests queue.
+
+    For the list backend: the length of each priority lane.
+    For the stream backend: lag - requests not delivered to the moderators
+    yet, pending - delivered, but not processed requests (per moderator).
+    """
+    try:
+        return await get_queue_stats(resources.config, resources.redis)
+    except RedisError:
+        return Response(
+            status_code=503, content=json.dumps({"status": "ERROR"})
+        )
@@ -0,0 +1,13 @@
+"""The module responsible for the metrics endpoint."""
+
+from fastapi import APIRouter, Response
+
+from utils.metrics import CONTENT_TYPE, REGISTRY
+
+router = APIRouter(tags=["healthcheck"])
+
+
+@router.get("/metrics", status_code=200, response_class=Response)
+async def metrics():
+    """Return the metrics in the Prometheus text format."""
+    return Response(content=await REGISTRY.render(), media_type=CONTENT_TYPE)
@@ -1,112 +1,682 @@
 """The module responsible for the endpoints for image moderation."""
 
-import base64
+import asyncio
 import json
+from functools import partial
 from logging import getLogger
 from time import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Union
 
-from fastapi import APIRouter, File, Request, Response, UploadFile
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    Form,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import StreamingResponse
+from starlette.datastructures import UploadFile as FormFile
 
-from con_prod.moderation_requests.producer import ModerationRequestsProducer
+from blob_store.base import BlobStore
+from con_prod.moderation_requests.base import BaseModerationRequestsProducer
 from con_prod.moderation_responses.consumer import ModerationResponsesConsumer
-from config.app import MODERATION_REQUESTS_QUEUE_KEY, Config
-from schemas.moderation import ModerationRequest
+from con_prod.moderation_responses.dispatcher import (
+    ModerationResponsesDispatcher,
+)
+from config.app import BatchConfig, Config, QueueConfig
+from schemas.moderation import (
+    ModerationRequest,
+    ModerationResponse,
+    UrlModerationRequest,
+)
+from services.admission import AdmissionController, QueueOverloadedError
+from services.batch_moderation import (
+    BatchItem,
+    BatchModeration,
+    aiter_archive,
+)
+from services.near_duplicates import NearDuplicateIndex
+from services.result_cache import ModerationResult, ModerationResultCache
+from services.url_cache import (
+    UrlValidators,
+    canonicalize_url,
+    check_public_host,
+)
+
+from ..dependencies import (
+    get_admission,
+    get_blob_store,
+    get_config,
+    get_near_duplicates,
+    get_requests_producer,
+    get_responses_consumer,
+    get_responses_dispatcher,
+    get_result_cache,
+    get_stage_timer,
+    get_url_validators,
+)
+from ..metrics import SERVER_ERRORS
+from ..timing import StageTimer
 
 logger = getLogger("main.server.routes.moderation")
 router = APIRouter(tags=["moderation"])
 
+MODERATION_ERRORS = SERVER_ERRORS.labels("moderation")
 
-@router.post(
-    "/moderate/",
-    status_code=200,
-    responses={
-        200: {
-            "description": "Image was moderated.",
-            "content": {
-                "application/json": {
-                    "examples": {
-                        "success": {"value": {"status": "OK"}},
-                        "NSFW": {
-                            "value": {
-                                "status": "REJECTED",
-                                "reason": "NSFW content",
-                            },
+
+def _moderation_result(
+    moderation_request_id: str,
+    moderation_response: Optional[ModerationResponse],
+    nsfw_threshold: float,
+) -> Union[Response, Dict[str, str]]:
+    """
+    Return the answer of the moderation endpoints.
+
+    :param moderation_request_id: Moderation request ID.
+    :param moderation_response: Moderation response
+    (None if it was not received in time).
+    :param nsfw_threshold: Images with the higher nsfw score are rejected.
+    """
+    if moderation_response is None:
+        return Response(
+            status_code=202,
+            content=json.dumps(
+                {
+                    "status": "ACCEPTED",
+                    "request_id": moderation_request_id,
+                }
+            ),
+        )
+    logger.debug(
+        "Moderation response: %s",
+        moderation_response.model_dump_json(indent=2),
+    )
+    verdict = moderation_response.verdict(nsfw_threshold)
+    if verdict["status"] == "ERROR":
+        MODERATION_ERRORS.inc()
+        return Response(status_code=400, content=json.dumps(verdict))
+    return verdict
+
+
+def _mark_result(
+    timer: StageTimer,
+    moderation_request_id: str,
+    moderation_response: Optional[ModerationResponse],
+) -> None:
+    """Record the stages of getting the moderation result."""
+    if not moderation_request_id:
+        timer.mark("cache")
+        return
+    # the request may be coalesced with the same one of another client
+    timer.request_id = moderation_request_id
+    timer.mark("wait")
+    if (
+        moderation_response is not None
+        and moderation_response.id == moderation_request_id
+    ):
+        timer.add_moderator_timings(moderation_response.timings)
+
+
+async def _check_public_url(url: str) -> str:
+    """
+    Return the canonical URL.
+
+    :raise HTTPException: If the URL is not absolute public http(s) URL.
+    """
+    try:
+        canonical_url = canonicalize_url(url)
+        await check_public_host(canonical_url)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    return canonical_url
+
+
+def _check_lane(config: QueueConfig, lane: Optional[str], default: str) -> str:
+    """
+    Return the priority lane of the request.
+
+    :raise HTTPException: If the lane is unknown.
+    """
+    if lane is None:
+        return default
+    if lane not in config.lane_names:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unknown lane, the lanes are:"
+            f" {', '.join(config.lane_names)}.",
+        )
+    return lane
+
+
+def _overloaded(exc: QueueOverloadedError) -> HTTPException:
+    """Return the 429/503 answer of the rejected request."""
+    return HTTPException(
+        status_code=exc.status_code,
+        detail=str(exc),
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def _admit(admission: Optional[AdmissionController], lane: str) -> bool:
+    """
+    Admit the request that is about to be queued.
+
+    :return: True, if the result is worth waiting for.
+    :raise HTTPException: If the queue is overloaded (429/503).
+    """
+    if admission is None:
+        return True
+    try:
+        return admission.admit(lane)
+    except QueueOverloadedError as exc:
+        raise _overloaded(exc)
+
+
+async def _produce_and_wait(
+    moderation_request: ModerationRequest,
+    requests_producer: BaseModerationRequestsProducer,
+    responses_dispatcher: ModerationResponsesDispatcher,
+    timer: StageTimer,
+    timeout: Optional[float],
+) -> Optional[ModerationResponse]:
+    """
+    Enqueue the request and wait for the moderation response.
+
+    The waiter is registered before the request is queued,
+    so the response published right away is not missed.
+
+    :return: Moderation response or None, if it is not received in time.
+    """
+    waiter = asyncio.create_task(
+        responses_dispatcher.wait(moderation_request.id, timeout=timeout)
+    )
+    try:
+        await requests_producer.produce(moderation_request)
+    except BaseException:
+        waiter.cancel()
+        raise
+    timer.request_id = moderation_request.id
+    timer.mark("enqueue")
+    return await waiter
+
+
+MODERATE_RESPONSES: Dict[Union[int, str], Dict[str, Any]] = {
+    200: {
+        "description": "Image was moderated.",
+        "content": {
+            "application/json": {
+                "examples": {
+                    "success": {"value": {"status": "OK"}},
+                    "NSFW": {
+                        "value": {
+                            "status": "REJECTED",
+                            "reason": "NSFW content",
                         },
                     },
                 },
             },
         },
-        202: {
-            "description": "Moderation request was accepted.",
-            "content": {
-                "application/json": {
-                    "example": {
-                        "status": "ACCEPTED",
-                        "request_id": "<request ID (UUID4)>",
-                    },
+    },
+    202: {
+        "description": "Moderation request was accepted.",
+        "content": {
+            "application/json": {
+                "example": {
+                    "status": "ACCEPTED",
+                    "request_id": "<request ID (UUID4)>",
                 },
             },
         },
-        400: {
-            "description": "An error occurred during verification.",
-            "content": {
-                "application/json": {
-                    "example": {"status": "ERROR"},
-                },
+    },
+    400: {
+        "description": "An error occurred during verification.",
+        "content": {
+            "application/json": {
+                "example": {"status": "ERROR"},
             },
         },
     },
-)
-async def moderate(request: Request, image: UploadFile = File(...)):
+    429: {
+        "description": "The queue is full, retry after Retry-After"
+        " seconds.",
+    },
+    503: {
+        "description": "The queue is overloaded (the predicted wait is too"
+        " long), retry after Retry-After seconds.",
+    },
+}
+
+
+@router.post("/moderate/", status_code=200, responses=MODERATE_RESPONSES)
+async def moderate(
+    image: UploadFile = File(...),
+    callback_url: Optional[str] = Form(
+        None,
+        max_length=2048,
+        description="If set, the request is answered right after it is"
+        " queued and the verdict is POSTed to this URL.",
+    ),
+    lane: Optional[str] = Form(
+        None,
+        max_length=64,
+        description="Priority lane of the queue (default: the first one).",
+    ),
+    config: Config = Depends(get_config),
+    requests_producer: BaseModerationRequestsProducer = Depends(
+        get_requests_producer
+    ),
+    responses_dispatcher: ModerationResponsesDispatcher = Depends(
+        get_responses_dispatcher
+    ),
+    result_cache: ModerationResultCache = Depends(get_result_cache),
+    near_duplicates: Optional[NearDuplicateIndex] = Depends(
+        get_near_duplicates
+    ),
+    blob_store: Optional[BlobStore] = Depends(get_blob_store),
+    admission: Optional[AdmissionController] = Depends(get_admission),
+    timer: StageTimer = Depends(get_stage_timer),
+):
     """
     Check the image on NSFW.
 
     Timeout = 5s. If the timeout is exceeded,
     the 202 code with the task id will be returned.
+    If the result is not expected in time (by the queue depth and
+    the drain rate), 202 is returned without waiting; if the queue
+    is overloaded, the request is rejected with 429/503 and Retry-After.
+    The results are cached by the image content
+    (and by the perceptual hash, if enabled).
+    With callback_url, the cached result is returned right away,
+    else 202 is returned without waiting and the verdict is POSTed
+    to callback_url.
     """
+    if callback_url is not None:
+        await _check_public_url(callback_url)
+    lane = _check_lane(config.queue, lane, config.queue.default_lane)
     image_bytes = await image.read()
-    image_str: str = base64.b64encode(image_bytes).decode("utf-8")
-    config: Config = request.state.config
+    timer.mark("parse")
+
+    async def new_request() -> ModerationRequest:
+        """Return the moderation request of the image."""
+        if blob_store is not None:
+            blob_ref = await blob_store.put(image_bytes)
+            timer.mark("store")
+            return ModerationRequest(
+                blob_ref=blob_ref,
+                callback_url=callback_url,
+                lane=lane,
+                cache_key=cache_key,
+            )
+        return ModerationRequest(
+            image_bytes=image_bytes,
+            callback_url=callback_url,
+            lane=lane,
+            cache_key=cache_key,
+        )
 
-    requests_producer = ModerationRequestsProducer(
-        redis_url=config.redis.url, queue_key=MODERATION_REQUESTS_QUEUE_KEY
+    digest = result_cache.digest(image_bytes)
+    # nobody waits for the result of the callback request to cache it,
+    # so the moderator caches it
+    cache_key = digest if callback_url is not None else None
+    if callback_url is not None:
+        moderation_response = await result_cache.get(digest)
+        if moderation_response is None:
+            _admit(admission, lane)
+            moderation_request = await new_request()
+            await requests_producer.produce(moderation_request)
+            timer.request_id = moderation_request.id
+            timer.mark("enqueue")
+            return _moderation_result(
+                moderation_request.id, None, config.nsfw_threshold
+            )
+        timer.mark("cache")
+        return _moderation_result(
+            "", moderation_response, config.nsfw_threshold
+        )
+
+    async def enqueue_and_wait() -> ModerationResult:
+        """Enqueue the image and wait for the moderation result."""
+        phash: Optional[int] = None
+        if near_duplicates is not None:
+            phash = await near_duplicates.hash_image(image_bytes)
+            timer.mark("phash")
+            if phash is not None:
+                near_duplicate = near_duplicates.lookup(phash)
+                if near_duplicate is not None:
+                    return "", near_duplicate
+
+        sync = _admit(admission, lane)
+        moderation_request = await new_request()
+        if not sync:
+            await requests_producer.produce(moderation_request)
+            timer.request_id = moderation_request.id
+            timer.mark("enqueue")
+            return moderation_request.id, None
+
+        moderation_response = await _produce_and_wait(
+            moderation_request,
+            requests_producer,
+            responses_dispatcher,
+            timer,
+            config.moderation_timeout,
+        )
+
+        if (
+            near_duplicates is not None
+            and phash is not None
+            and moderation_response is not None
+        ):
+            await near_duplicates.add(phash, moderation_response)
+        return moderation_request.id, moderation_response
+
+    moderation_request_id, moderation_response = (
+        await result_cache.get_or_moderate(digest, enqueue_and_wait)
     )
-    moderation_request = ModerationRequest(image=image_str)
-    await requests_producer.produce(moderation_request)
+    _mark_result(timer, moderation_request_id, moderation_response)
 
-    responses_consumer = ModerationResponsesConsumer(
-        redis_url=config.redis.url
+    return _moderation_result(
+        moderation_request_id, moderation_response, config.nsfw_threshold
     )
 
-    start_time = time()
-    moderation_response = await responses_consumer.consume(
-        moderation_request.id,
-        timeout=config.moderation_timeout,
+
+@router.post(
+    "/moderate/url",
+    status_code=200,
+    responses={
+        **MODERATE_RESPONSES,
+        422: {
+            "description": "The URL is not absolute public http(s) URL.",
+        },
+    },
+)
+async def moderate_url(
+    moderation_url_request: UrlModerationRequest,
+    config: Config = Depends(get_config),
+    requests_producer: BaseModerationRequestsProducer = Depends(
+        get_requests_producer
+    ),
+    responses_dispatcher: ModerationResponsesDispatcher = Depends(
+        get_responses_dispatcher
+    ),
+    result_cache: ModerationResultCache = Depends(get_result_cache),
+    url_validators: Optional[UrlValidators] = Depends(get_url_validators),
+    admission: Optional[AdmissionController] = Depends(get_admission),
+    timer: StageTimer = Depends(get_stage_timer),
+):
+    """
+    Check the image by URL on NSFW.
+
+    The image is not downloaded by the server: its URL is put into
+    the queue and the image is fetched by the moderator (or by the NSFW
+    service). The results are cached by the canonical URL and, if
+    revalidation is enabled, by the ETag/Last-Modified of the image.
+    Timeout, callback_url and the admission control are the same
+    as for /moderate/.
+    """
+    url = moderation_url_request.url.strip()
+    canonical_url = await _check_public_url(url)
+    callback_url = moderation_url_request.callback_url
+    if callback_url is not None:
+        await _check_public_url(callback_url)
+    lane = _check_lane(
+        config.queue, moderation_url_request.lane, config.queue.default_lane
     )
-    logger.debug("Getting response time: %.1f", time() - start_time)
+    timer.mark("parse")
 
-    if moderation_response is None:
-        return Response(
-            status_code=202,
-            content=json.dumps(
-                {
-                    "status": "ACCEPTED",
-                    "request_id": moderation_request.id,
-                }
-            ),
+    version = ""
+    if url_validators is not None:
+        version = await url_validators.get_version(url, canonical_url)
+        timer.mark("revalidate")
+    digest = result_cache.digest(f"url:{canonical_url}\n{version}".encode())
+
+    if callback_url is not None:
+        moderation_response = await result_cache.get(digest)
+        if moderation_response is None:
+            _admit(admission, lane)
+            moderation_request = ModerationRequest(
+                image=url,
+                callback_url=callback_url,
+                lane=lane,
+                cache_key=digest,
+            )
+            await requests_producer.produce(moderation_request)
+            timer.request_id = moderation_request.id
+            timer.mark("enqueue")
+            return _moderation_result(
+                moderation_request.id, None, config.nsfw_threshold
+            )
+        timer.mark("cache")
+        return _moderation_result(
+            "", moderation_response, config.nsfw_threshold
         )
-    logger.debug(
-        "Moderation response: %s",
-        moderation_response.model_dump_json(indent=2),
+
+    async def enqueue_and_wait() -> ModerationResult:
+        """Enqueue the image URL and wait for the moderation result."""
+        sync = _admit(admission, lane)
+        moderation_request = ModerationRequest(image=url, lane=lane)
+        if not sync:
+            await requests_producer.produce(moderation_request)
+            timer.request_id = moderation_request.id
+            timer.mark("enqueue")
+            return moderation_request.id, None
+        moderation_response = await _produce_and_wait(
+            moderation_request,
+            requests_producer,
+            responses_dispatcher,
+            timer,
+            config.moderation_timeout,
+        )
+        return moderation_request.id, moderation_response
+
+    moderation_request_id, moderation_response = (
+        await result_cache.get_or_moderate(digest, enqueue_and_wait)
     )
-    if moderation_response.status == "ERROR":
-        return Response(
-            status_code=400, content=json.dumps({"status": "ERROR"})
+    _mark_result(timer, moderation_request_id, moderation_response)
+    return _moderation_result(
+        moderation_request_id, moderation_response, config.nsfw_threshold
+    )
+
+
+async def _batch_items(
+    images: List[FormFile],
+    urls: List[str],
+    archive: Optional[FormFile],
+    config: BatchConfig,
+) -> AsyncIterator[BatchItem]:
+    """Yield the images of the batch request (at most max_images)."""
+
+    async def items() -> AsyncIterator[Callable[[int], BatchItem]]:
+        """Yield the images of all the sources (taking their index)."""
+        for image in images:
+            image_bytes = await image.read(config.max_image_size + 1)
+            name = image.filename or ""
+            if len(image_bytes) > config.max_image_size:
+                yield partial(
+                    BatchItem, name=name, error="Image is too large."
+                )
+            else:
+                yield partial(BatchItem, name=name, image_bytes=image_bytes)
+        for url in urls:
+            try:
+                await check_public_host(canonicalize_url(url))
+            except ValueError as exc:
+                yield partial(BatchItem, name=url, error=str(exc))
+            else:
+                yield partial(BatchItem, name=url, url=url)
+        if archive is not None:
+            try:
+                async for name, data, error in aiter_archive(
+                    archive.file, config.max_image_size
+                ):
+                    yield partial(
+                        BatchItem, name=name, image_bytes=data, error=error
+                    )
+            except ValueError as exc:
+                yield partial(
+                    BatchItem, name=archive.filename or "", error=str(exc)
+                )
+
+    index = 0
+    async for create_item in items():
+        item = create_item(index)
+        if index == config.max_images:
+            yield BatchItem(index, item.name, error="Too many images.")
+            return
+        yield item
+        index += 1
+
+
+@router.post(
+    "/moderate/batch",
+    status_code=200,
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "Moderation results (one JSON per line)"
+            " in completion order.",
+            "content": {
+                "application/x-ndjson": {
+                    "example": {
+                        "index": 0,
+                        "name": "cat.jpg",
+                        "request_id": "<request ID (UUID4)>",
+                        "status": "OK",
+                    },
+                },
+            },
+        },
+        422: {"description": "No images or too many image parts."},
+        429: {"description": "The queue is full."},
+        503: {"description": "The queue is overloaded."},
+    },
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "images": {
+                                "type": "array",
+                                "items": {
+                                    "type": "string",
+                                    "format": "binary",
+                                },
+                            },
+                            "urls": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                            },
+                            "archive": {"type": "string", "format": "binary"},
+                            "lane": {"type": "string"},
+                        },
+                    },
+                },
+            },
+        },
+    },
+)
+async def moderate_batch(
+    request: Request,
+    config: Config = Depends(get_config),
+    requests_producer: BaseModerationRequestsProducer = Depends(
+        get_requests_producer
+    ),
+    responses_dispatcher: ModerationResponsesDispatcher = Depends(
+        get_responses_dispatcher
+    ),
+    result_cache: ModerationResultCache = Depends(get_result_cache),
+    blob_store: Optional[BlobStore] = Depends(get_blob_store),
+    admission: Optional[AdmissionController] = Depends(get_admission),
+):
+    """
+    Check many images on NSFW.
+
+    The images are sent as multipart parts (images), URLs (urls,
+    one per field or per line) or a ZIP/tar archive (archive).
+    The results are streamed as NDJSON in completion order: index
+    and name of the image, status (OK, REJECTED, ERROR or ACCEPTED
+    with the request ID if the result is not ready in time).
+    The images are queued in the bulk lane (lane overrides it),
+    so a large batch does not delay the interactive requests.
+    If the queue is overloaded, the batch is rejected with 429/503
+    and Retry-After.
+    """
+    form = await request.form(
+        max_files=config.batch.max_files + 1,
+        max_fields=config.batch.max_images,
+    )
+    images = [
+        image
+        for image in form.getlist("images")
+        if isinstance(image, FormFile)
+    ]
+    urls = [
+        url.strip()
+        for value in form.getlist("urls")
+        if isinstance(value, str)
+        for url in value.splitlines()
+        if url.strip()
+    ]
+    archive = form.get("archive")
+    if not isinstance(archive, FormFile):
+        archive = None
+    lane = form.get("lane")
+    try:
+        lane = _check_lane(
+            config.queue,
+            lane if isinstance(lane, str) else None,
+            (
+                config.queue.batch_lane
+                if config.queue.batch_lane in config.queue.lane_names
+                else config.queue.default_lane
+            ),
+        )
+        if admission is not None:
+            admission.check(lane)
+    except QueueOverloadedError as exc:
+        await form.close()
+        raise _overloaded(exc)
+    except HTTPException:
+        await form.close()
+        raise
+    if len(images) > config.batch.max_files:
+        await form.close()
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {config.batch.max_files} image parts"
+            " are allowed, send an archive instead.",
         )
-    if moderation_response.nsfw <= 0.7:
-        return {"status": "OK"}
-    else:
-        return {"status": "REJECTED", "reason": "NSFW content"}
+    if not images and not urls and archive is None:
+        await form.close()
+        raise HTTPException(status_code=422, detail="No images.")
+
+    batch_moderation = BatchModeration(
+        requests_producer=requests_producer,
+        responses_dispatcher=responses_dispatcher,
+        result_cache=result_cache,
+        nsfw_threshold=config.nsfw_threshold,
+        max_in_flight=config.batch.max_in_flight,
+        timeout=config.batch.timeout,
+        blob_store=blob_store,
+        lane=lane,
+    )
+
+    async def results() -> AsyncIterator[bytes]:
+        """Stream the results and close the uploaded files."""
+        try:
+            async for result in batch_moderation.moderate(
+                _batch_items(images, urls, archive, config.batch)
+            ):
+                yield json.dumps(result).encode() + b"\n"
+        finally:
+            await form.close()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
 
 @router.get(
@@ -125,6 +695,7 @@ async def moderate(request: Request, image: UploadFile = File(...)):
                                 "reason": "NSFW content",
                             },
                         },
+                        "queued": {"value": {"status": "QUEUED"}},
                         "processing": {"value": {"status": "PROCESSING"}},
                     },
                 },
@@ -138,30 +709,65 @@ async def moderate(request: Request, image: UploadFile = File(...)):
                 },
             },
         },
+        404: {
+            "description": "Unknown (or expired) moderation request.",
+            "content": {
+                "application/json": {
+                    "example": {"status": "NOT_FOUND"},
+                },
+            },
+        },
     },
 )
-async def get_moderation_result(request: Request, moderation_request_id: str):
-    """Return moderation result."""
-    config: Config = request.state.config
-    responses_consumer = ModerationResponsesConsumer(
-        redis_url=config.redis.url
-    )
-    moderation_response = await responses_consumer.consume(
-        moderation_request_id,
-        timeout=config.moderation_timeout,
+async def get_moderation_result(
+    moderation_request_id: str,
+    config: Config = Depends(get_config),
+    wait: float = Query(
+        0,
+        ge=0,
+        le=30,
+        description="How long to wait for the result (seconds).",
+    ),
+    responses_consumer: ModerationResponsesConsumer = Depends(
+        get_responses_consumer
+    ),
+    responses_dispatcher: ModerationResponsesDispatcher = Depends(
+        get_responses_dispatcher
+    ),
+):
+    """
+    Return moderation result.
+
+    The result is not deleted on reading, so it can be requested
+    several times until it expires. If the request is not done yet
+    and wait > 0, the result is waited for up to wait seconds.
+    """
+    moderation_status = await responses_consumer.get_status(
+        moderation_request_id
     )
+    if moderation_status is None:
+        return Response(
+            status_code=404, content=json.dumps({"status": "NOT_FOUND"})
+        )
+
+    moderation_response = moderation_status.response
+    if moderation_response is None and wait > 0:
+        moderation_response = await responses_dispatcher.wait(
+            moderation_request_id, timeout=wait, check_first=True
+        )
+        if moderation_response is None:
+            moderation_status = (
+                await responses_consumer.get_status(moderation_request_id)
+                or moderation_status
+            )
 
     if moderation_response is None:
-        return {"status": "PROCESSING"}
+        return {"status": moderation_status.status}
     logger.debug(
         "Moderation response: %s",
         moderation_response.model_dump_json(indent=2),
     )
-    if moderation_response.status == "ERROR":
-        return Response(
-            status_code=400, content=json.dumps({"status": "ERROR"})
-        )
-    if moderation_response.nsfw <= 0.7:
-        return {"status": "OK"}
-    else:
-        return {"status": "REJECTED", "reason": "NSFW content"}
+    verdict = moderation_response.verdict(config.nsfw_threshold)
+    if verdict["status"] == "ERROR":
+        return Response(status_code=400, content=json.dumps(verdict))
+    return verdict
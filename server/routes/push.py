@@ -0,0 +1,211 @@
+"""The module responsible for pushing the moderation results."""
+
+import asyncio
+import json
+from logging import getLogger
+from time import monotonic
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import StreamingResponse
+
+from con_prod.moderation_responses.consumer import ModerationResponsesConsumer
+from con_prod.moderation_responses.dispatcher import (
+    ModerationResponsesDispatcher,
+)
+from con_prod.moderation_responses.watch import (
+    ModerationResponsesWatch,
+    WatchEvent,
+)
+from config.app import Config
+from schemas import ModerationStatus
+
+from ..dependencies import (
+    get_config,
+    get_responses_consumer,
+    get_responses_dispatcher,
+)
+
+logger = getLogger("main.server.routes.push")
+router = APIRouter(tags=["moderation"])
+
+
+def _event(
+    moderation_request_id: str,
+    moderation_status: Optional[ModerationStatus],
+    nsfw_threshold: float,
+) -> Dict[str, Any]:
+    """Return the pushed message about the request."""
+    event: Dict[str, Any] = {"request_id": moderation_request_id}
+    if moderation_status is None:
+        event["status"] = "NOT_FOUND"
+    elif moderation_status.response is None:
+        event["status"] = moderation_status.status
+    else:
+        event.update(moderation_status.response.verdict(nsfw_threshold))
+    return event
+
+
+def _split_ids(values: List[str]) -> List[str]:
+    """Return the request IDs passed as several values or comma-separated."""
+    return [
+        moderation_request_id.strip()
+        for value in values
+        for moderation_request_id in value.split(",")
+        if moderation_request_id.strip()
+    ]
+
+
+@router.get(
+    "/moderation_results/stream",
+    status_code=200,
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "Server-Sent Events: one result event per request"
+            " (QUEUED/PROCESSING events first for the requests not done).",
+            "content": {
+                "text/event-stream": {
+                    "example": 'event: result\ndata: {"request_id": '
+                    '"<request ID (UUID4)>", "status": "OK"}\n\n',
+                },
+            },
+        },
+        422: {"description": "No request IDs or too many of them."},
+    },
+)
+async def stream_moderation_results(
+    ids: List[str] = Query(
+        ...,
+        description="Moderation request IDs (several values"
+        " or comma-separated).",
+    ),
+    config: Config = Depends(get_config),
+    responses_consumer: ModerationResponsesConsumer = Depends(
+        get_responses_consumer
+    ),
+    responses_dispatcher: ModerationResponsesDispatcher = Depends(
+        get_responses_dispatcher
+    ),
+):
+    """
+    Push the results of the moderation requests (Server-Sent Events).
+
+    The result of each request is sent as soon as it is published.
+    The stream ends when all the results are sent (or after the timeout).
+    """
+    moderation_request_ids = _split_ids(ids)
+    if not moderation_request_ids:
+        raise HTTPException(status_code=422, detail="No request IDs.")
+    watch = ModerationResponsesWatch(
+        responses_dispatcher,
+        responses_consumer,
+        max_requests=config.push.max_requests,
+    )
+    try:
+        events = await watch.add(moderation_request_ids)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
+    def message(event: WatchEvent) -> bytes:
+        """Return the SSE message about the request."""
+        data = json.dumps(_event(*event, config.nsfw_threshold))
+        return f"event: result\ndata: {data}\n\n".encode()
+
+    async def messages() -> AsyncIterator[bytes]:
+        """Yield the results as they are published."""
+        deadline = monotonic() + config.push.timeout
+        try:
+            for event in events:
+                yield message(event)
+            while watch.pending and monotonic() < deadline:
+                events_ = await watch.next(
+                    min(config.push.heartbeat, deadline - monotonic())
+                )
+                if not events_:
+                    # keeps the proxies from closing the idle connection
+                    yield b": ping\n\n"
+                for event in events_:
+                    yield message(event)
+        finally:
+            watch.close()
+
+    return StreamingResponse(
+        messages(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws/moderation_results")
+async def push_moderation_results(
+    websocket: WebSocket,
+    config: Config = Depends(get_config),
+    responses_consumer: ModerationResponsesConsumer = Depends(
+        get_responses_consumer
+    ),
+    responses_dispatcher: ModerationResponsesDispatcher = Depends(
+        get_responses_dispatcher
+    ),
+):
+    """
+    Push the results of the moderation requests (WebSocket).
+
+    The client sends {"subscribe": ["<request ID>", ...]} at any time;
+    the server sends {"request_id": ..., "status": ...} messages:
+    the current status right away and the result as soon as it is
+    published. Invalid messages are answered with {"error": ...}.
+    """
+    await websocket.accept()
+    watch = ModerationResponsesWatch(
+        responses_dispatcher,
+        responses_consumer,
+        max_requests=config.push.max_requests,
+    )
+
+    async def send(events: List[WatchEvent]) -> None:
+        """Send the events to the client."""
+        for event in events:
+            await websocket.send_json(_event(*event, config.nsfw_threshold))
+
+    receive = asyncio.create_task(websocket.receive_text())
+    results = asyncio.create_task(watch.next(config.push.heartbeat))
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {receive, results}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if results in done:
+                await send(results.result())
+                results = asyncio.create_task(
+                    watch.next(config.push.heartbeat)
+                )
+            if receive in done:
+                text = receive.result()
+                receive = asyncio.create_task(websocket.receive_text())
+                try:
+                    message = json.loads(text)
+                    moderation_request_ids = message["subscribe"]
+                    if not isinstance(moderation_request_ids, list) or not all(
+                        isinstance(item, str)
+                        for item in moderation_request_ids
+                    ):
+                        raise TypeError("subscribe must be a list of IDs.")
+                    events = await watch.add(moderation_request_ids)
+                except (ValueError, TypeError, KeyError) as exc:
+                    await websocket.send_json({"error": str(exc)})
+                    continue
+                await send(events)
+    except WebSocketDisconnect:
+        logger.debug("WebSocket client disconnected.")
+    finally:
+        receive.cancel()
+        results.cancel()
+        watch.close()
@@ -0,0 +1,126 @@
+"""The module responsible for timing the stages of the requests."""
+
+from logging import getLogger
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+from .metrics import ASGIApp, Message, Receive, Scope, Send
+
+logger = getLogger("main.server.timing")
+
+
+class StageTimer(object):
+    """
+    Durations of the stages of the request.
+
+    The server stages are measured between the marks by the monotonic
+    clock, the moderator stages are taken from the moderation response.
+    """
+
+    def __init__(self):
+        """Init class."""
+        self.__start = perf_counter()
+        self.__last = self.__start
+        # name, duration (seconds) and where it was measured
+        self.__stages: List[Tuple[str, float, str]] = []
+        self.request_id: Optional[str] = None
+
+    @property
+    def marked(self) -> bool:
+        """Return True, if any stage is recorded."""
+        return bool(self.__stages)
+
+    @property
+    def total(self) -> float:
+        """Return the time since the request started (seconds)."""
+        return perf_counter() - self.__start
+
+    def mark(self, name: str) -> None:
+        """Record the stage lasting from the previous mark till now."""
+        now = perf_counter()
+        self.__stages.append((name, now - self.__last, "server"))
+        self.__last = now
+
+    def add_moderator_timings(self, timings: Dict[str, float]) -> None:
+        """Record the stages measured by the moderator."""
+        self.__stages.extend(
+            (name, seconds, "moderator") for name, seconds in timings.items()
+        )
+
+    def header(self) -> str:
+        """Return the value of the Server-Timing header."""
+        entries = [
+            f'{name};dur={seconds * 1e3:.1f};desc="{source}"'
+            for name, seconds, source in self.__stages
+        ]
+        entries.append(f"total;dur={self.total * 1e3:.1f}")
+        return ", ".join(entries)
+
+    def timeline(self) -> str:
+        """Return the stages for the log."""
+        return " ".join(
+            f"{source}.{name}={seconds * 1e3:.1f}ms"
+            for name, seconds, source in self.__stages
+        )
+
+
+class ServerTimingMiddleware(object):
+    """
+    Times the requests.
+
+    Puts the StageTimer into the request state (the handlers mark
+    the stages), returns the Server-Timing header and logs the timeline
+    of the slow requests.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        header: bool = True,
+        slow_request_threshold: float = 0.0,
+    ):
+        """
+        Init class.
+
+        :param app: ASGI application.
+        :param header: Return the Server-Timing header.
+        :param slow_request_threshold: Log the timeline of the requests
+        that take longer (seconds, 0 - disabled).
+        """
+        self.__app = app
+        self.__header = header
+        self.__slow_request_threshold = slow_request_threshold
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        """Handle the request."""
+        if scope["type"] != "http":
+            await self.__app(scope, receive, send)
+            return
+
+        timer = StageTimer()
+        scope.setdefault("state", {})["stage_timer"] = timer
+
+        async def send_timed(message: Message) -> None:
+            """Add the Server-Timing header to the response."""
+            if self.__header and message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timer.header().encode()))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.__app(scope, receive, send_timed)
+        finally:
+            total = timer.total
+            # the streams (SSE, batches) are long by design, not timed
+            if timer.marked and 0 < self.__slow_request_threshold <= total:
+                logger.warning(
+                    "Slow request %s %s (%s): %.1f ms: %s",
+                    scope["method"],
+                    scope["path"],
+                    timer.request_id or "-",
+                    total * 1e3,
+                    timer.timeline(),
+                )
@@ -0,0 +1,267 @@
+"""The module responsible for the admission control of the server."""
+
+import asyncio
+import math
+from logging import getLogger
+from time import monotonic
+from typing import Dict, Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from con_prod.moderation_requests import get_queue_stats
+from config.app import MODERATION_DEQUEUED_KEY, Config
+from utils.metrics import Counter, Gauge
+from utils.redis import RedisMixin
+
+logger = getLogger("main.services.admission")
+
+# the longest Retry-After of the rejected requests (seconds)
+MAX_RETRY_AFTER = 60
+
+ADMISSIONS = Counter(
+    "moderation_admissions_total",
+    "Admission decisions: sync - the result is waited for, async - 202"
+    " at once (the predicted wait is over the budget), queue_full"
+    " (429) and overloaded (503) - rejected.",
+    ("decision",),
+    (("sync",), ("async",), ("queue_full",), ("overloaded",)),
+)
+DRAIN_RATE = Gauge(
+    "moderation_drain_rate",
+    "Smoothed rate the moderators take the queued requests at (per second).",
+)
+PREDICTED_WAIT = Gauge(
+    "moderation_predicted_wait_seconds",
+    "Predicted queue wait of a new request by priority lane"
+    " (+Inf - the moderators do not take the requests).",
+    ("lane",),
+)
+
+
+class QueueOverloadedError(Exception):
+    """The request is rejected, the queue is too deep or too slow."""
+
+    def __init__(self, status_code: int, retry_after: float):
+        """
+        Init class.
+
+        :param status_code: 429 - the queue is full,
+        503 - the predicted wait is too long.
+        :param retry_after: When to retry (seconds).
+        """
+        super().__init__(
+            "Moderation queue is full."
+            if status_code == 429
+            else "Moderation queue is overloaded."
+        )
+        self.status_code = status_code
+        self.retry_after = (
+            min(max(math.ceil(retry_after), 1), MAX_RETRY_AFTER)
+            if retry_after < math.inf
+            else MAX_RETRY_AFTER
+        )
+
+
+class AdmissionController(RedisMixin):
+    """
+    Admission control by the predicted wait in the queue.
+
+    The depth of the lanes and the number of the requests taken
+    by the moderators are sampled in the background, so the decision
+    is made without a Redis round trip. The drain rate is smoothed
+    and is measured only while the queue is backlogged (otherwise
+    it is the arrival rate, not the capacity). A lane gets the share
+    of the drain rate by its weight among the busy lanes, a lane
+    with weight 0 waits for all the queued requests. Between
+    the samples the depth is corrected by the requests admitted
+    by this server and the drained ones. Until the moderators are seen
+    taking the requests, the drain rate is unknown and the requests
+    are admitted.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        redis_client: Optional[Redis] = None,
+        redis_url: Optional[str] = None,
+    ):
+        """
+        Init class.
+
+        :param config: App config (the queue and the admission configs).
+        :param redis_client: Redis client.
+        :param redis_url: Redis url
+        :raise ValueError: If redis_client and redis_url are None.
+        """
+        super().__init__(redis_client=redis_client, redis_url=redis_url)
+        self.__config = config
+        self.__interval = config.admission.interval
+        self.__smoothing = config.admission.smoothing
+        self.__sync_budget = (
+            config.admission.sync_budget or config.moderation_timeout
+        )
+        self.__max_wait = config.admission.max_wait
+        self.__max_depth = config.admission.max_depth
+        self.__default_lane = config.queue.default_lane
+        if config.queue.backend == "list":
+            self.__weights = dict(config.queue.lanes)
+            # a lane with a positive weight is served at least once
+            # per lane_max_wait
+            self.__min_lane_rate = 1 / config.queue.lane_max_wait
+        else:
+            # one stream for all the lanes
+            self.__weights = {self.__default_lane: 1}
+            self.__min_lane_rate = 0.0
+        self.__depths: Dict[str, int] = dict.fromkeys(self.__weights, 0)
+        self.__admitted: Dict[str, int] = dict.fromkeys(self.__weights, 0)
+        self.__rate: Optional[float] = None
+        self.__dequeued: Optional[int] = None
+        self.__sampled_at = monotonic()
+        self.__task: Optional["asyncio.Task[None]"] = None
+
+    @property
+    def drain_rate(self) -> Optional[float]:
+        """Return the smoothed drain rate (None until it is measured)."""
+        return self.__rate
+
+    async def start(self) -> None:
+        """Take the first sample and start sampling in the background."""
+        try:
+            await self.sample()
+        except RedisError as exc:
+            logger.error("Failed to sample the queue: %s", str(exc))
+        self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self) -> None:
+        """Stop sampling."""
+        if self.__task is not None:
+            self.__task.cancel()
+            await asyncio.gather(self.__task, return_exceptions=True)
+            self.__task = None
+
+    async def __run(self) -> None:
+        """Sample the queue every interval."""
+        while True:
+            await asyncio.sleep(self.__interval)
+            try:
+                await self.sample()
+            except RedisError as exc:
+                logger.warning("Failed to sample the queue: %s", str(exc))
+
+    async def sample(self) -> None:
+        """Read the depth of the lanes and update the drain rate."""
+        async with self.get_redis_conn() as redis_client:
+            stats = await get_queue_stats(self.__config, redis_client)
+            dequeued = int(
+                await redis_client.get(MODERATION_DEQUEUED_KEY) or 0
+            )
+        now = monotonic()
+        if stats["backend"] == "stream":
+            depths = {self.__default_lane: stats["lag"]}
+        else:
+            depths = stats["lanes"]
+
+        backlogged = any(self.__depths.values()) or any(depths.values())
+        elapsed = now - self.__sampled_at
+        if self.__dequeued is not None and elapsed > 0 and backlogged:
+            # the counter may be reset (Redis restart)
+            rate = max(dequeued - self.__dequeued, 0) / elapsed
+            if self.__rate is not None:
+                self.__rate = (
+                    self.__smoothing * rate
+                    + (1 - self.__smoothing) * self.__rate
+                )
+            elif rate > 0:
+                # no dequeues yet may be the long first calls
+                self.__rate = rate
+            if self.__rate is not None:
+                DRAIN_RATE.set(self.__rate)
+        self.__dequeued = dequeued
+        self.__sampled_at = now
+        self.__depths = {lane: depths.get(lane, 0) for lane in self.__weights}
+        self.__admitted = dict.fromkeys(self.__weights, 0)
+        for lane in self.__weights:
+            PREDICTED_WAIT.labels(lane).set(self.predicted_wait(lane))
+
+    def __lane(self, lane: str) -> str:
+        """Return the lane the requests of the lane are queued in."""
+        return lane if lane in self.__weights else self.__default_lane
+
+    def __lane_rate(self, lane: str) -> Optional[float]:
+        """Return the drain rate of the lane (None if unknown)."""
+        if self.__rate is None:
+            return None
+        if self.__rate == 0 or not self.__weights[lane]:
+            return 0.0
+        busy_weight = sum(
+            weight
+            for name, weight in self.__weights.items()
+            if name == lane or self.__depths[name] + self.__admitted[name]
+        )
+        share = self.__weights[lane] / busy_weight if busy_weight else 1.0
+        return max(self.__rate * share, self.__min_lane_rate)
+
+    def __depth(self, lane: str) -> float:
+        """Return the estimated depth of the lane."""
+        depth: float = self.__depths[lane] + self.__admitted[lane]
+        lane_rate = self.__lane_rate(lane)
+        if lane_rate:
+            depth -= lane_rate * (monotonic() - self.__sampled_at)
+        return max(depth, 0.0)
+
+    def predicted_wait(self, lane: str) -> float:
+        """Return the predicted queue wait of a new request (seconds)."""
+        lane = self.__lane(lane)
+        if self.__weights[lane]:
+            depth = self.__depth(lane)
+            lane_rate = self.__lane_rate(lane)
+        else:
+            # served only when the other lanes are empty
+            depth = sum(self.__depth(name) for name in self.__weights)
+            lane_rate = self.__rate
+        if depth == 0 or lane_rate is None:
+            return 0.0
+        if lane_rate == 0:
+            # the moderators do not take the requests
+            return math.inf
+        return depth / lane_rate
+
+    def check(self, lane: str) -> float:
+        """
+        Check that the request can be queued.
+
+        :return: Predicted queue wait (seconds).
+        :raise QueueOverloadedError: If the request is rejected.
+        """
+        if self.__max_depth:
+            excess = (
+                sum(self.__depth(name) for name in self.__weights)
+                - self.__max_depth
+            )
+            if excess >= 0:
+                ADMISSIONS.labels("queue_full").inc()
+                raise QueueOverloadedError(
+                    429,
+                    (excess + 1) / self.__rate if self.__rate else math.inf,
+                )
+        wait = self.predicted_wait(lane)
+        if self.__max_wait and wait > self.__max_wait:
+            ADMISSIONS.labels("overloaded").inc()
+            raise QueueOverloadedError(503, wait - self.__max_wait)
+        return wait
+
+    def admit(self, lane: str) -> bool:
+        """
+        Admit the request that is about to be queued.
+
+        :return: True, if the result is expected within the sync budget
+        (it is worth waiting for), else the request is to be answered
+        with 202 at once.
+        :raise QueueOverloadedError: If the request is rejected.
+        """
+        wait = self.check(lane)
+        self.__admitted[self.__lane(lane)] += 1
+        sync = wait <= self.__sync_budget
+        ADMISSIONS.labels("sync" if sync else "async").inc()
+        return sync
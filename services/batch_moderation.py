@@ -0,0 +1,342 @@
+"""The module responsible for moderating batches of images."""
+
+import asyncio
+import tarfile
+import zipfile
+from dataclasses import dataclass
+from logging import getLogger
+from typing import (
+    Any,
+    AsyncIterator,
+    BinaryIO,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from redis.exceptions import RedisError
+
+from blob_store.base import BlobStore
+from con_prod.moderation_requests.base import BaseModerationRequestsProducer
+from con_prod.moderation_responses.dispatcher import (
+    ModerationResponsesDispatcher,
+)
+from schemas.moderation import ModerationRequest, ModerationResponse
+
+from .result_cache import ModerationResultCache
+
+logger = getLogger("main.services.batch_moderation")
+
+# name, image bytes and the reason the entry is rejected
+ArchiveEntry = Tuple[str, Optional[bytes], Optional[str]]
+
+
+@dataclass
+class BatchItem(object):
+    """Image of the batch: its bytes, its URL or the reason it is rejected."""
+
+    index: int
+    name: str
+    image_bytes: Optional[bytes] = None
+    url: Optional[str] = None
+    error: Optional[str] = None
+
+
+def _is_hidden(path: str) -> bool:
+    """Return True for the service files of the archivers."""
+    name = path.rsplit("/", 1)[-1]
+    return path.startswith("__MACOSX/") or name.startswith(".")
+
+
+def iter_archive(
+    fileobj: BinaryIO, max_image_size: int
+) -> Iterator[ArchiveEntry]:
+    """
+    Yield the images of the ZIP or tar (optionally compressed) archive.
+
+    The entries are read one by one, so only one image is in memory.
+
+    :param fileobj: Seekable archive file.
+    :param max_image_size: Larger entries are rejected (bytes).
+    :raise ValueError: If the file is not a ZIP or tar archive.
+    """
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as zip_archive:
+            for info in zip_archive.infolist():
+                if info.is_dir() or _is_hidden(info.filename):
+                    continue
+                if info.file_size > max_image_size:
+                    yield info.filename, None, "Image is too large."
+                    continue
+                try:
+                    with zip_archive.open(info) as entry:
+                        # the size in the header is not trusted
+                        data = entry.read(max_image_size + 1)
+                except (zipfile.BadZipFile, OSError, ValueError) as exc:
+                    yield info.filename, None, f"Cannot extract: {exc}"
+                    continue
+                if len(data) > max_image_size:
+                    yield info.filename, None, "Image is too large."
+                    continue
+                yield info.filename, data, None
+        return
+
+    fileobj.seek(0)
+    try:
+        tar_archive = tarfile.open(fileobj=fileobj, mode="r:*")
+    except tarfile.TarError as exc:
+        raise ValueError("Archive must be ZIP or tar.") from exc
+    with tar_archive:
+        for member in tar_archive:
+            if not member.isfile() or _is_hidden(member.name):
+                continue
+            if member.size > max_image_size:
+                yield member.name, None, "Image is too large."
+                continue
+            member_file = tar_archive.extractfile(member)
+            if member_file is None:
+                continue
+            with member_file:
+                yield member.name, member_file.read(), None
+
+
+async def aiter_archive(
+    fileobj: BinaryIO, max_image_size: int
+) -> AsyncIterator[ArchiveEntry]:
+    """Yield the images of the archive, reading it in a thread."""
+    entries = iter_archive(fileobj, max_image_size)
+    while True:
+        entry = await asyncio.to_thread(next, entries, None)
+        if entry is None:
+            return
+        yield entry
+
+
+class BatchModeration(object):
+    """
+    Moderation of a batch of images.
+
+    The images are enqueued in chunks (one pipelined round trip each)
+    and the results are yielded in completion order. At most
+    max_in_flight images of the batch wait for moderation at a time,
+    so the memory is bounded and a huge batch does not take the whole
+    queue from interactive traffic.
+    """
+
+    def __init__(
+        self,
+        requests_producer: BaseModerationRequestsProducer,
+        responses_dispatcher: ModerationResponsesDispatcher,
+        result_cache: ModerationResultCache,
+        nsfw_threshold: float,
+        max_in_flight: int = 32,
+        timeout: float = 60.0,
+        blob_store: Optional[BlobStore] = None,
+        lane: Optional[str] = None,
+    ):
+        """
+        Init class.
+
+        :param requests_producer: Moderation requests producer.
+        :param responses_dispatcher: Moderation responses dispatcher.
+        :param result_cache: Moderation results cache (by image content).
+        :param nsfw_threshold: Images with the higher nsfw score
+        are rejected.
+        :param max_in_flight: Maximum number of images waiting
+        for moderation.
+        :param timeout: How long to wait for the result of an image
+        (seconds). Then its request ID is returned.
+        :param blob_store: Store of the images. If None, the images
+        are put into the queue.
+        :param lane: Priority lane of the requests.
+        """
+        self.__requests_producer = requests_producer
+        self.__responses_dispatcher = responses_dispatcher
+        self.__result_cache = result_cache
+        self.__lane = lane
+        self.__nsfw_threshold = nsfw_threshold
+        self.__max_in_flight = max_in_flight
+        self.__timeout = timeout
+        self.__blob_store = blob_store
+
+    def __result(
+        self,
+        item: BatchItem,
+        moderation_request_id: str,
+        moderation_response: Optional[ModerationResponse],
+    ) -> Dict[str, Any]:
+        """Return the result line of the image."""
+        result: Dict[str, Any] = {"index": item.index, "name": item.name}
+        if moderation_request_id:
+            result["request_id"] = moderation_request_id
+        if moderation_response is None:
+            result["status"] = "ACCEPTED"
+        else:
+            result.update(moderation_response.verdict(self.__nsfw_threshold))
+        return result
+
+    @classmethod
+    def __error(cls, item: BatchItem, detail: str) -> Dict[str, Any]:
+        """Return the result line of the rejected image."""
+        return {
+            "index": item.index,
+            "name": item.name,
+            "status": "ERROR",
+            "detail": detail,
+        }
+
+    async def __request(self, item: BatchItem) -> ModerationRequest:
+        """Return the moderation request of the image."""
+        if item.url is not None:
+            return ModerationRequest(image=item.url, lane=self.__lane)
+        if self.__blob_store is not None and item.image_bytes is not None:
+            return ModerationRequest(
+                blob_ref=await self.__blob_store.put(item.image_bytes),
+                lane=self.__lane,
+            )
+        return ModerationRequest(
+            image_bytes=item.image_bytes, lane=self.__lane
+        )
+
+    async def __wait(
+        self,
+        item: BatchItem,
+        moderation_request: ModerationRequest,
+        digest: Optional[str],
+    ) -> Dict[str, Any]:
+        """Wait for the moderation result of the image."""
+        try:
+            moderation_response = await self.__responses_dispatcher.wait(
+                moderation_request.id, timeout=self.__timeout
+            )
+        except RedisError as exc:
+            # the result can be requested later by the request ID
+            logger.warning("Failed to get the result: %s", str(exc))
+            moderation_response = None
+        if moderation_response is not None and digest is not None:
+            await self.__result_cache.set(digest, moderation_response)
+        return self.__result(item, moderation_request.id, moderation_response)
+
+    async def __delete_blobs(
+        self, chunk: List[Tuple[BatchItem, ModerationRequest, Optional[str]]]
+    ) -> None:
+        """Delete the images of the chunk that was not enqueued."""
+        if self.__blob_store is None:
+            return
+        results = await asyncio.gather(
+            *(
+                self.__blob_store.delete(moderation_request.blob_ref)
+                for _, moderation_request, _ in chunk
+                if moderation_request.blob_ref is not None
+            ),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if result is not None]
+        if errors:
+            # they expire by themselves
+            logger.warning(
+                "Failed to delete %d images: %s", len(errors), str(errors[0])
+            )
+
+    async def __enqueue(
+        self, chunk: List[Tuple[BatchItem, ModerationRequest, Optional[str]]]
+    ) -> Set[asyncio.Task[Dict[str, Any]]]:
+        """
+        Enqueue the chunk of images in one round trip.
+
+        :return: Tasks waiting for the results.
+        :raise RedisError: If the requests are not enqueued.
+        """
+        # the waiters are registered before the results can be published
+        tasks = {
+            asyncio.create_task(self.__wait(item, moderation_request, digest))
+            for item, moderation_request, digest in chunk
+        }
+        try:
+            await self.__requests_producer.produce_batch(
+                [moderation_request for _, moderation_request, _ in chunk]
+            )
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return tasks
+
+    async def moderate(
+        self, items: AsyncIterator[BatchItem]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Moderate the images and yield the results in completion order.
+
+        A result is a dict with the index and the name of the image,
+        the status (OK, REJECTED, ERROR or ACCEPTED if the result
+        was not received in time) and the request ID.
+        """
+        pending: Set[asyncio.Task[Dict[str, Any]]] = set()
+        chunk: List[Tuple[BatchItem, ModerationRequest, Optional[str]]] = []
+
+        async def flush() -> AsyncIterator[Dict[str, Any]]:
+            """Enqueue the chunk (yields the errors only)."""
+            try:
+                pending.update(await self.__enqueue(chunk))
+            except RedisError as exc:
+                logger.error("Failed to enqueue the batch: %s", str(exc))
+                await self.__delete_blobs(chunk)
+                for item, _, _ in chunk:
+                    yield self.__error(item, "Queue is unavailable.")
+            chunk.clear()
+
+        try:
+            async for item in items:
+                if item.error is not None:
+                    yield self.__error(item, item.error)
+                    continue
+
+                digest: Optional[str] = None
+                if item.image_bytes is not None:
+                    digest = self.__result_cache.digest(item.image_bytes)
+                    cached = await self.__result_cache.get(digest)
+                    if cached is not None:
+                        yield self.__result(item, "", cached)
+                        continue
+                try:
+                    moderation_request = await self.__request(item)
+                except Exception as exc:
+                    logger.error("Invalid image %s: %r", item.name, exc)
+                    yield self.__error(item, "Invalid image.")
+                    continue
+                item.image_bytes = None
+                chunk.append((item, moderation_request, digest))
+
+                if len(pending) + len(chunk) >= self.__max_in_flight:
+                    async for error in flush():
+                        yield error
+                for task in [task for task in pending if task.done()]:
+                    pending.discard(task)
+                    yield task.result()
+                while len(pending) >= self.__max_in_flight:
+                    done, _ = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        pending.discard(task)
+                        yield task.result()
+
+            if chunk:
+                async for error in flush():
+                    yield error
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    pending.discard(task)
+                    yield task.result()
+        finally:
+            # the client has gone: stop waiting (the images are moderated)
+            for task in pending:
+                task.cancel()
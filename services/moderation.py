@@ -1,16 +1,112 @@
 """The module responsible for nsfw image moderation."""
 
 import asyncio
+import random
+from contextlib import nullcontext
 from logging import getLogger
+from time import perf_counter, time
+from typing import Any, Dict, List, Optional, Tuple
 
-from api.nsfw_moderation.base import NSFWClient
-from api.nsfw_moderation.clarifai import ClarifaiClient
-from con_prod.moderation_requests.consumer import ModerationRequestsConsumer
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from api.nsfw_moderation import create_nsfw_client
+from api.nsfw_moderation.base import NSFWClient, NSFWClientThrottledError
+from blob_store.base import BlobStore
+from con_prod.moderation_requests import (
+    create_requests_consumer,
+    create_requests_producer,
+    get_queue_stats,
+    queue_depth_collector,
+)
+from con_prod.moderation_requests.base import BaseModerationRequestsConsumer
+from con_prod.moderation_requests.delayed import DelayedModerationRequests
 from con_prod.moderation_responses.producer import ModerationResponsesProducer
+from con_prod.webhooks.queue import WebhooksQueue
+from config.app import MODERATION_REQUESTS_DELAYED_KEY, Config
 from schemas.moderation import ModerationRequest, ModerationResponse
+from schemas.webhook import WebhookJob
+from services.preprocessing import ImagePreprocessor
+from services.result_cache import ModerationResultCache
+from utils.adaptive_limiter import AdaptiveConcurrencyLimiter
+from utils.http import ConnectionStats, create_httpx_client
+from utils.metrics import (
+    QUEUE_WAIT_BUCKETS,
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    serve_metrics,
+)
+from utils.rate_limiter import RateLimiter
 
 logger = getLogger("main.services.moderation")
 
+QUEUE_WAIT = Histogram(
+    "moderation_queue_wait_seconds",
+    "Time from enqueueing the request to taking it by the moderator"
+    " by priority lane.",
+    ("lane",),
+    buckets=QUEUE_WAIT_BUCKETS,
+)
+UPSTREAM_LATENCY = Histogram(
+    "moderation_upstream_seconds",
+    "Latency of the NSFW backend calls by outcome.",
+    ("outcome",),
+    (("ok",), ("throttled",), ("error",)),
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "moderation_upstream_in_flight", "NSFW backend calls in progress."
+)
+RESULTS = Counter(
+    "moderation_results_total",
+    "Published moderation results by status.",
+    ("status",),
+    (("OK",), ("ERROR",)),
+)
+MODERATOR_ERRORS = Counter(
+    "moderation_moderator_errors_total",
+    "Errors of the moderator by cause: throttled - the backend throttled"
+    " the call, retries_exhausted - the throttled requests answered"
+    " with ERROR, redis - Redis is unavailable, unexpected - other.",
+    ("cause",),
+    (("throttled",), ("retries_exhausted",), ("redis",), ("unexpected",)),
+)
+
+
+def _add_stage(stages: Dict[str, float], name: str, seconds: float) -> None:
+    """Add the duration to the stage (the stages repeat on retries)."""
+    stages[name] = stages.get(name, 0.0) + seconds
+
+
+def _timings(
+    moderation_request: ModerationRequest, stages: Dict[str, float]
+) -> Dict[str, float]:
+    """
+    Return the stage durations of the request (seconds).
+
+    The queue wait is measured by the wall clock (the request is queued
+    by another process), the other stages - by the monotonic clock.
+    """
+    # the stages of the previous (throttled) attempts
+    timings: Dict[str, float] = dict(moderation_request.timings)
+    if (
+        moderation_request.enqueued_at is not None
+        and moderation_request.dequeued_at is not None
+    ):
+        _add_stage(
+            timings,
+            "queue",
+            max(
+                0.0,
+                moderation_request.dequeued_at
+                - moderation_request.enqueued_at,
+            ),
+        )
+    for name, seconds in stages.items():
+        _add_stage(timings, name, seconds)
+    return {name: round(seconds, 6) for name, seconds in timings.items()}
+
 
 class NSFWModerator(object):
     """NSFW moderator."""
@@ -18,9 +114,21 @@ class NSFWModerator(object):
     def __init__(
         self,
         nsfw_client: NSFWClient,
-        request_consumer: ModerationRequestsConsumer,
+        request_consumer: BaseModerationRequestsConsumer,
         response_producer: ModerationResponsesProducer,
-        delay: float = 1.0,
+        rate_limiter: Optional[RateLimiter] = None,
+        concurrency: int = 1,
+        batch_size: int = 1,
+        batch_max_delay: float = 0.0,
+        blob_store: Optional[BlobStore] = None,
+        concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+        max_retries: int = 5,
+        retry_base_delay: float = 1.0,
+        retry_max_delay: float = 30.0,
+        preprocessor: Optional[ImagePreprocessor] = None,
+        webhooks: Optional[WebhooksQueue] = None,
+        result_cache: Optional[ModerationResultCache] = None,
+        delayed: Optional[DelayedModerationRequests] = None,
     ):
         """
         Init class.
@@ -28,86 +136,527 @@ class NSFWModerator(object):
         :param nsfw_client: NSFW API client.
         :param request_consumer: Moderation requests consumer.
         :param response_producer: Moderation responses producer.
-        :param delay: Delay after making api request.
+        :param rate_limiter: Limiter of the requests to the NSFW API.
+        If None, the requests are not limited.
+        :param concurrency: Number of moderations in progress at the same time.
+        :param batch_size: Maximum number of images moderated in one request
+        to the NSFW API. If 1, the images are moderated one by one.
+        :param batch_max_delay: Maximum time to wait for the batch to be full.
+        :param blob_store: Store of the images referenced by the requests.
+        The images are deleted after moderation.
+        :param concurrency_limiter: Adaptive limiter of the requests
+        in progress (adjusted by the latency and the throttling of the API).
+        :param max_retries: How many times the throttled requests are
+        retried before they are answered with ERROR.
+        :param retry_base_delay: Base of the exponential retry delay
+        (seconds). The delay is randomized (jitter).
+        :param retry_max_delay: Maximum retry delay (seconds)
+        (not counting Retry-After of the API).
+        :param preprocessor: Downscales the images before moderation.
+        :param webhooks: Queue of the webhooks. The results of the requests
+        with callback_url are put into it.
+        :param result_cache: Cache of the results. The results
+        of the requests with cache_key are put into it (nobody waits
+        for them on the server).
+        :param delayed: Requests waiting for a retry. If None,
+        the throttled requests are answered with ERROR.
+        :raise ValueError: If concurrency or batch_size is not positive.
         """
-        self.__delay = delay
+        if concurrency < 1:
+            raise ValueError("Concurrency must be positive.")
+        if batch_size < 1:
+            raise ValueError("Batch size must be positive.")
         self.__api = nsfw_client
         self.__request_consumer = request_consumer
         self.__response_producer = response_producer
+        self.__rate_limiter = rate_limiter or RateLimiter()
+        self.__concurrency = concurrency
+        self.__batch_size = batch_size
+        self.__batch_max_delay = batch_max_delay
+        self.__blob_store = blob_store
+        self.__concurrency_limiter = concurrency_limiter
+        self.__max_retries = max_retries
+        self.__retry_base_delay = retry_base_delay
+        self.__retry_max_delay = retry_max_delay
+        self.__preprocessor = preprocessor
+        self.__webhooks = webhooks
+        self.__result_cache = result_cache
+        self.__delayed = delayed
+        self.__retried = 0
 
-    async def __produce_with_min_delay(
-        self, moderation_response: ModerationResponse
-    ) -> None:
-        """
-        Make a minimum delay.
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Return the retry counter and the adaptive limit."""
+        stats: Dict[str, Any] = {"retried": self.__retried}
+        if self.__concurrency_limiter is not None:
+            stats["concurrency_limiter"] = self.__concurrency_limiter.stats
+        return stats
 
-        The function minimizes the delay during sending the moderation results
-        to the queue. If the sending ended before the delay,
-        the function waits for the delay to end.
-        If the delay ended before sending,
-        the function waits for sending to complete.
+    async def __consume(self) -> List[ModerationRequest]:
+        """Consume a moderation request or a batch of them."""
+        if self.__batch_size == 1:
+            return [await self.__request_consumer.consume()]
+        return await self.__request_consumer.consume_batch(
+            max_size=self.__batch_size, max_delay=self.__batch_max_delay
+        )
 
-        :param moderation_response: Moderation response.
+    async def __moderate(
+        self,
+        moderation_requests: List[ModerationRequest],
+        stages: Dict[str, float],
+    ) -> List[ModerationResponse]:
         """
-        produce_task = asyncio.create_task(
-            self.__response_producer.produce(moderation_response)
+        Moderate the images within the rate and concurrency limits.
+
+        :param stages: Durations of the stages (seconds), the limit
+        and the upstream durations are added to it.
+        :raise NSFWClientThrottledError: If the API throttled the request.
+        """
+        waiting = perf_counter()
+        async with self.__rate_limiter:
+            async with self.__concurrency_limiter or nullcontext():
+                start = perf_counter()
+                _add_stage(stages, "limit", start - waiting)
+                outcome = "error"
+                UPSTREAM_IN_FLIGHT.inc()
+                try:
+                    if len(moderation_requests) == 1:
+                        responses = [
+                            await self.__api.moderate(moderation_requests[0])
+                        ]
+                    else:
+                        responses = await self.__api.moderate_batch(
+                            moderation_requests
+                        )
+                    outcome = "ok"
+                except NSFWClientThrottledError as exc:
+                    outcome = "throttled"
+                    MODERATOR_ERRORS.labels("throttled").inc()
+                    if self.__concurrency_limiter is not None:
+                        self.__concurrency_limiter.on_throttle(exc.retry_after)
+                    raise
+                finally:
+                    UPSTREAM_IN_FLIGHT.dec()
+                    UPSTREAM_LATENCY.labels(outcome).observe(
+                        perf_counter() - start
+                    )
+                    _add_stage(stages, "upstream", perf_counter() - start)
+                if self.__concurrency_limiter is not None:
+                    self.__concurrency_limiter.on_success(
+                        perf_counter() - start
+                    )
+                return responses
+
+    def __retry_delay(
+        self, attempt: int, retry_after: Optional[float]
+    ) -> float:
+        """Return the delay before the retry: Retry-After + full jitter."""
+        backoff = min(
+            self.__retry_max_delay, self.__retry_base_delay * 2**attempt
         )
+        return (retry_after or 0.0) + random.uniform(0, backoff)
+
+    async def __retry_later(
+        self,
+        moderation_requests: List[ModerationRequest],
+        api_requests: List[ModerationRequest],
+        exc: NSFWClientThrottledError,
+        stages: Dict[str, float],
+    ) -> Tuple[List[ModerationRequest], List[ModerationResponse]]:
+        """
+        Schedule the throttled requests to be queued again later.
 
-        await asyncio.sleep(self.__delay)
+        The requests wait for the retry in redis with the preprocessed
+        images (they are not preprocessed again) and are acknowledged
+        at once, so they are neither held by the moderator nor reclaimed
+        by another one meanwhile.
 
-        if not produce_task.done():
-            await produce_task
+        :param api_requests: The requests sent to the NSFW API.
+        :return: The requests that are not retried (no retries left
+        or too many requests wait for a retry) and their ERROR responses.
+        """
+        scheduled: List[Tuple[ModerationRequest, float]] = []
+        retried: List[ModerationRequest] = []
+        exhausted: List[ModerationRequest] = []
+        for request, api_request in zip(moderation_requests, api_requests):
+            if self.__delayed is None or request.attempt >= self.__max_retries:
+                exhausted.append(request)
+                continue
+            delay = self.__retry_delay(request.attempt, exc.retry_after)
+            timings = _timings(request, stages)
+            _add_stage(timings, "retry", delay)
+            scheduled.append(
+                (
+                    api_request.model_copy(
+                        update={
+                            "attempt": request.attempt + 1,
+                            "timings": timings,
+                            "preprocessed": self.__preprocessor is not None,
+                            "dequeued_at": None,
+                        }
+                    ),
+                    delay,
+                )
+            )
+            retried.append(request)
 
-    async def run(self):
-        """Run NSFW moderation."""
-        logger.info("Start NSFW moderator.")
+        if scheduled:
+            assert self.__delayed is not None
+            if await self.__delayed.schedule(scheduled):
+                logger.warning(
+                    "NSFW API throttled %d requests (%d), retry in %.1f s.",
+                    len(retried),
+                    exc.status_code,
+                    min(delay for _, delay in scheduled),
+                )
+                self.__retried += len(retried)
+                await self.__request_consumer.ack(retried)
+                # the preprocessed images are retried instead
+                await self.__delete_blobs(
+                    [
+                        request
+                        for request, (delayed, _) in zip(retried, scheduled)
+                        if request.blob_ref != delayed.blob_ref
+                    ]
+                )
+            else:
+                logger.error("Too many requests wait for a retry.")
+                exhausted.extend(retried)
+
+        if exhausted:
+            logger.error(
+                "NSFW API throttled %d requests, no retries left.",
+                len(exhausted),
+            )
+            MODERATOR_ERRORS.labels("retries_exhausted").inc(len(exhausted))
+        return exhausted, [
+            ModerationResponse(id=request.id, status="ERROR")
+            for request in exhausted
+        ]
+
+    async def __process(
+        self, moderation_requests: List[ModerationRequest]
+    ) -> None:
+        """
+        Moderate the requests and publish the results.
+
+        The throttled requests are retried later (without holding
+        the worker), then answered with ERROR.
+        """
+        stages: Dict[str, float] = {}
+        api_requests = moderation_requests
+        if self.__preprocessor is not None:
+            start = perf_counter()
+            api_requests = await self.__preprocessor.preprocess_batch(
+                moderation_requests
+            )
+            _add_stage(stages, "preprocess", perf_counter() - start)
+        try:
+            moderation_resps: List[ModerationResponse] = await self.__moderate(
+                api_requests, stages
+            )
+        except NSFWClientThrottledError as exc:
+            moderation_requests, moderation_resps = await self.__retry_later(
+                moderation_requests, api_requests, exc, stages
+            )
+            if not moderation_requests:
+                return
+
+        for moderation_request, moderation_resp in zip(
+            moderation_requests, moderation_resps
+        ):
+            moderation_resp.timings = _timings(moderation_request, stages)
+            RESULTS.labels(moderation_resp.status).inc()
+            logger.info(
+                "Moderation results %s: nsfw=%.4f; sfw=%.4f",
+                moderation_resp.id,
+                moderation_resp.nsfw,
+                moderation_resp.sfw,
+            )
+
+        await asyncio.gather(
+            *(
+                self.__response_producer.produce(moderation_resp)
+                for moderation_resp in moderation_resps
+            )
+        )
+        logger.debug("Moderation results sent for consumer.")
+        await self.__cache_results(moderation_requests, moderation_resps)
+        await self.__push_webhooks(moderation_requests, moderation_resps)
+        await self.__request_consumer.ack(moderation_requests)
+
+        await self.__delete_blobs(moderation_requests)
+
+    async def __work(self, worker_id: int) -> None:
+        """Consume moderation requests and moderate them."""
+        logger.debug("Start worker %d.", worker_id)
         while True:
             try:
-                moderation_request: ModerationRequest = (
-                    await self.__request_consumer.consume()
+                moderation_requests: List[ModerationRequest] = (
+                    await self.__consume()
                 )
+                if not moderation_requests:
+                    continue
                 logger.info(
-                    "Request for nsfw moderation %s", moderation_request.id
+                    "Request for nsfw moderation %s",
+                    ", ".join(request.id for request in moderation_requests),
                 )
+                self.__mark_dequeued(moderation_requests)
+                await self.__process(moderation_requests)
+            except RedisError as exc:
+                MODERATOR_ERRORS.labels("redis").inc()
+                logger.error("Redis error. %s", str(exc))
+            except Exception as exc:
+                MODERATOR_ERRORS.labels("unexpected").inc()
+                logger.critical("Unexpected error. %s", str(exc))
 
-                moderation_resp: ModerationResponse = (
-                    await self.__api.moderate(moderation_request)
+    @classmethod
+    def __mark_dequeued(
+        cls, moderation_requests: List[ModerationRequest]
+    ) -> None:
+        """Stamp the requests and observe how long they were queued."""
+        now = time()
+        for request in moderation_requests:
+            request.dequeued_at = now
+            if request.enqueued_at is not None:
+                # the clocks of the hosts may differ a little
+                QUEUE_WAIT.labels(request.lane or "default").observe(
+                    max(0.0, now - request.enqueued_at)
                 )
-                logger.info(
-                    "Moderation results: nsfw=%.4f; sfw=%.4f",
-                    moderation_resp.nsfw,
-                    moderation_resp.sfw,
+
+    async def __cache_results(
+        self,
+        moderation_requests: List[ModerationRequest],
+        moderation_resps: List[ModerationResponse],
+    ) -> None:
+        """Cache the results of the requests with cache_key."""
+        if self.__result_cache is None:
+            return
+        await asyncio.gather(
+            *(
+                self.__result_cache.set(request.cache_key, moderation_resp)
+                for request, moderation_resp in zip(
+                    moderation_requests, moderation_resps
                 )
+                if request.cache_key is not None
+            )
+        )
+
+    async def __push_webhooks(
+        self,
+        moderation_requests: List[ModerationRequest],
+        moderation_resps: List[ModerationResponse],
+    ) -> None:
+        """Queue the delivery of the results to the callback URLs."""
+        jobs = [
+            WebhookJob(url=request.callback_url, response=moderation_resp)
+            for request, moderation_resp in zip(
+                moderation_requests, moderation_resps
+            )
+            if request.callback_url is not None
+        ]
+        if not jobs:
+            return
+        if self.__webhooks is None:
+            logger.warning("%d webhooks are not sent (disabled).", len(jobs))
+            return
+        await self.__webhooks.push(jobs)
 
-                await self.__produce_with_min_delay(moderation_resp)
-                logger.debug("Moderation result sent for consumer.")
+    async def __delete_blobs(
+        self, moderation_requests: List[ModerationRequest]
+    ) -> None:
+        """Delete the images of the moderated requests from the blob store."""
+        if self.__blob_store is None:
+            return
+        await asyncio.gather(
+            *(
+                self.__blob_store.delete(request.blob_ref)
+                for request in moderation_requests
+                if request.blob_ref is not None
+            )
+        )
+
+    async def __purge_expired_blobs(self, interval: float = 60.0) -> None:
+        """Periodically delete the expired images of lost requests."""
+        assert self.__blob_store is not None
+        while True:
+            try:
+                purged = await self.__blob_store.purge_expired()
+                if purged:
+                    logger.info("Purged %d expired blobs.", purged)
             except Exception as exc:
-                logger.critical("Unexpected error. %s", str(exc))
+                logger.error("Failed to purge expired blobs. %s", str(exc))
+            await asyncio.sleep(interval)
+
+    async def __move_delayed(self, interval: float = 0.5) -> None:
+        """Periodically queue the requests due for a retry."""
+        assert self.__delayed is not None
+        while True:
+            try:
+                moved = await self.__delayed.move_due()
+                if moved:
+                    logger.info("%d requests are queued for a retry.", moved)
+            except Exception as exc:
+                logger.error("Failed to queue the retries. %s", str(exc))
+            await asyncio.sleep(interval)
+
+    async def run(self):
+        """Run NSFW moderation."""
+        logger.info(
+            "Start NSFW moderator (concurrency: %d).", self.__concurrency
+        )
+        async with asyncio.TaskGroup() as task_group:
+            for worker_id in range(self.__concurrency):
+                task_group.create_task(self.__work(worker_id))
+            if self.__blob_store is not None:
+                task_group.create_task(self.__purge_expired_blobs())
+            if self.__delayed is not None:
+                task_group.create_task(self.__move_delayed())
+
+
+async def log_stats(
+    config: Config,
+    redis_client: Redis,
+    nsfw_client: NSFWClient,
+    connection_stats: Optional[ConnectionStats] = None,
+    moderator: Optional[NSFWModerator] = None,
+    interval: float = 60.0,
+) -> None:
+    """
+    Periodically log the stats of the queue and of the NSFW client.
+
+    :param connection_stats: Connection reuse stats of the HTTP client.
+    :param moderator: Moderator (retries and the adaptive limit).
+    """
+    while True:
+        try:
+            logger.info(
+                "Queue stats: %s", await get_queue_stats(config, redis_client)
+            )
+        except Exception as exc:
+            logger.error("Failed to get queue stats. %s", str(exc))
+        if nsfw_client.stats:
+            logger.info("NSFW client stats: %s", nsfw_client.stats)
+        if connection_stats is not None:
+            logger.info("HTTP client stats: %s", connection_stats.as_dict())
+        if moderator is not None:
+            logger.info("Moderator stats: %s", moderator.stats)
+        await asyncio.sleep(interval)
 
 
 async def launch_moderator():
     """Launch nsfw moderator."""
     import logging.config
 
-    from redis.asyncio import Redis
-
-    from config.app import MODERATION_REQUESTS_QUEUE_KEY, Config, get_config
+    from blob_store import create_blob_store
+    from config.app import MODERATION_RESPONSES_CHANNEL, get_config
     from config.log import get_log_config
 
     config: Config = get_config()
     logging.config.dictConfig(get_log_config(config.debug))
 
-    async with Redis.from_url(config.redis.url) as redis:
+    connection_stats = ConnectionStats()
+    async with (
+        Redis.from_url(config.redis.url) as redis,
+        create_httpx_client(
+            config.http_client, connection_stats
+        ) as httpx_client,
+        # the images by URL are downloaded only from the public addresses
+        create_httpx_client(
+            config.http_client, public_only=True
+        ) as image_client,
+    ):
+        blob_store = create_blob_store(config.blob_store, redis)
+        nsfw_client = create_nsfw_client(
+            config,
+            blob_store=blob_store,
+            httpx_client=httpx_client,
+            image_client=image_client,
+        )
+        await nsfw_client.warm_up()
+        preprocessor: Optional[ImagePreprocessor] = None
+        if config.preprocessing.enabled:
+            preprocessor = ImagePreprocessor(
+                max_size=config.preprocessing.max_size,
+                fmt=config.preprocessing.format,
+                quality=config.preprocessing.quality,
+                workers=config.preprocessing.workers or None,
+                blob_store=blob_store,
+            )
+        adaptive = config.adaptive_concurrency
+        concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None
+        concurrency = config.moderator.concurrency
+        if adaptive.enabled:
+            concurrency_limiter = AdaptiveConcurrencyLimiter(
+                initial_limit=adaptive.initial_limit,
+                min_limit=adaptive.min_limit,
+                max_limit=adaptive.max_limit,
+                backoff=adaptive.backoff,
+                latency_tolerance=adaptive.latency_tolerance,
+            )
+            # the limiter decides how many workers call the API
+            concurrency = adaptive.max_limit
         moderator = NSFWModerator(
-            nsfw_client=ClarifaiClient(config=config.clarifai),
-            request_consumer=ModerationRequestsConsumer(
+            nsfw_client=nsfw_client,
+            request_consumer=create_requests_consumer(config, redis),
+            response_producer=ModerationResponsesProducer(
+                redis_client=redis,
+                binary=config.binary_messages,
+                channel=MODERATION_RESPONSES_CHANNEL,
+                ttl=config.result_ttl,
+            ),
+            rate_limiter=RateLimiter(
+                rate=config.moderator.rate_limit,
+                burst=config.moderator.rate_burst,
+                max_concurrency=concurrency,
+            ),
+            concurrency=concurrency,
+            batch_size=config.moderator.batch_size,
+            batch_max_delay=config.moderator.batch_max_delay,
+            blob_store=blob_store,
+            concurrency_limiter=concurrency_limiter,
+            max_retries=config.moderator.max_retries,
+            retry_base_delay=config.moderator.retry_base_delay,
+            retry_max_delay=config.moderator.retry_max_delay,
+            preprocessor=preprocessor,
+            webhooks=WebhooksQueue(
+                redis_client=redis,
+                dead_letter_max_len=config.webhooks.dead_letter_max_len,
+            ),
+            # only written to, the server reads it
+            result_cache=ModerationResultCache(
+                ttl=config.result_cache.ttl, lru_size=0, redis_client=redis
+            ),
+            delayed=DelayedModerationRequests(
+                key=MODERATION_REQUESTS_DELAYED_KEY,
+                requests_producer=create_requests_producer(config, redis),
+                max_size=config.moderator.max_delayed,
+                binary=config.binary_messages,
                 redis_client=redis,
-                queue_key=MODERATION_REQUESTS_QUEUE_KEY,
             ),
-            response_producer=ModerationResponsesProducer(redis_client=redis),
         )
 
-        await moderator.run()
+        try:
+            async with asyncio.TaskGroup() as task_group:
+                task_group.create_task(moderator.run())
+                if config.metrics.enabled and config.metrics.port:
+                    REGISTRY.add_collector(
+                        queue_depth_collector(config, redis)
+                    )
+                    task_group.create_task(serve_metrics(config.metrics.port))
+                task_group.create_task(
+                    log_stats(
+                        config,
+                        redis,
+                        nsfw_client,
+                        connection_stats,
+                        moderator,
+                    )
+                )
+        finally:
+            await nsfw_client.close()
+            if preprocessor is not None:
+                preprocessor.close()
 
 
 if __name__ == "__main__":
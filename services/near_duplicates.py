@@ -0,0 +1,310 @@
+"""The module responsible for finding near-duplicate images."""
+
+import asyncio
+import io
+from collections import OrderedDict
+from logging import getLogger
+from typing import Dict, Generic, List, Optional, Tuple, TypeVar
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from schemas.moderation import ModerationResponse
+from utils.redis import RedisMixin
+
+try:
+    from PIL import Image, UnidentifiedImageError
+except ImportError:  # Pillow is only needed if the index is enabled
+    Image = None  # type: ignore[assignment]
+    UnidentifiedImageError = OSError  # type: ignore[assignment,misc]
+
+logger = getLogger("main.services.near_duplicates")
+
+T = TypeVar("T")
+
+HASH_BITS: int = 64
+
+
+def dhash(image_bytes: bytes) -> int:
+    """
+    Return the 64-bit difference hash (dHash) of the image.
+
+    The hash does not change (or changes by a few bits) when the image
+    is re-compressed, resized or its metadata is stripped.
+
+    :raise RuntimeError: If Pillow is not installed.
+    :raise ValueError: If the image cannot be decoded.
+    """
+    if Image is None:
+        raise RuntimeError("Pillow is required to compute perceptual hashes.")
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # JPEG images are decoded at a reduced scale, which is much faster
+            image.draft("L", (64, 64))
+            pixels = list(
+                image.convert("L")
+                .resize((9, 8), Image.Resampling.LANCZOS)
+                .getdata()
+            )
+    except (UnidentifiedImageError, OSError) as exc:
+        raise ValueError("Cannot decode the image.") from exc
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+class HammingIndex(Generic[T]):
+    """
+    In-memory index of 64-bit hashes searchable by Hamming distance.
+
+    Multi-index hashing: the hash is split into max_distance + 1 chunks.
+    Two hashes within max_distance bits of each other have at least one
+    equal chunk, so only the hashes sharing a chunk are compared.
+    """
+
+    def __init__(self, max_distance: int, max_size: Optional[int] = None):
+        """
+        Init class.
+
+        :param max_distance: Maximum Hamming distance of a match.
+        :param max_size: Maximum number of hashes, the oldest added ones
+        are evicted. If None, the index is not limited.
+        :raise ValueError: If max_distance is negative or too large.
+        """
+        if not 0 <= max_distance < HASH_BITS // 2:
+            raise ValueError(
+                f"Max distance must be in [0, {HASH_BITS // 2 - 1}]."
+            )
+        self.__max_distance = max_distance
+        chunks = max_distance + 1
+        bounds = [HASH_BITS * i // chunks for i in range(chunks + 1)]
+        self.__chunks: List[Tuple[int, int]] = [
+            (start, (1 << (end - start)) - 1)
+            for start, end in zip(bounds, bounds[1:])
+        ]
+        self.__tables: List[Dict[int, List[int]]] = [{} for _ in range(chunks)]
+        self.__max_size = max_size
+        self.__values: OrderedDict[int, T] = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of hashes in the index."""
+        return len(self.__values)
+
+    def add(self, hash_: int, value: T) -> None:
+        """
+        Add the hash with the value (replace the value if it exists).
+
+        The added (or replaced) hash becomes the newest one.
+        """
+        if hash_ in self.__values:
+            self.__values.move_to_end(hash_)
+        else:
+            if (
+                self.__max_size is not None
+                and len(self.__values) >= self.__max_size
+            ):
+                self.remove(next(iter(self.__values)))
+            for (shift, mask), table in zip(self.__chunks, self.__tables):
+                table.setdefault((hash_ >> shift) & mask, []).append(hash_)
+        self.__values[hash_] = value
+
+    def remove(self, hash_: int) -> None:
+        """Remove the hash if it exists."""
+        if hash_ not in self.__values:
+            return
+        del self.__values[hash_]
+        for (shift, mask), table in zip(self.__chunks, self.__tables):
+            chunk = (hash_ >> shift) & mask
+            candidates = table[chunk]
+            candidates.remove(hash_)
+            if not candidates:
+                del table[chunk]
+
+    def search(self, hash_: int) -> Optional[Tuple[int, T]]:
+        """Return the distance and the value of the nearest match or None."""
+        value = self.__values.get(hash_)
+        if value is not None:
+            return 0, value
+
+        best_hash: Optional[int] = None
+        best_distance = self.__max_distance + 1
+        for (shift, mask), table in zip(self.__chunks, self.__tables):
+            for candidate in table.get((hash_ >> shift) & mask, ()):
+                distance = (hash_ ^ candidate).bit_count()
+                if distance < best_distance:
+                    best_hash, best_distance = candidate, distance
+        if best_hash is None:
+            return None
+        return best_distance, self.__values[best_hash]
+
+
+class NearDuplicateIndex(RedisMixin):
+    """
+    Index of moderation results by perceptual hash of the image.
+
+    The index is held in memory and persisted to a redis stream,
+    so it survives restarts and is shared between the server processes:
+    each process loads the stream on startup and reads the results added
+    by the others every refresh_interval. Both the stream and the index
+    keep max_size newest results.
+    """
+
+    KEY: str = "moderation_phash_log"
+
+    def __init__(
+        self,
+        max_distance: int,
+        max_size: int = 100000,
+        refresh_interval: float = 5.0,
+        redis_client: Optional[Redis] = None,
+        redis_url: Optional[str] = None,
+    ):
+        """
+        Init class.
+
+        :param max_distance: Maximum Hamming distance between the hashes
+        of the images considered the same.
+        :param max_size: Maximum number of the results (approximate
+        for the stream).
+        :param refresh_interval: How often the results added by the other
+        processes are read (seconds).
+        :param redis_client: Redis client.
+        :param redis_url: Redis url
+        :raise ValueError: If redis_client and redis_url are None.
+        :raise RuntimeError: If Pillow is not installed.
+        """
+        if Image is None:
+            raise RuntimeError(
+                "Pillow is required for the near-duplicate index."
+            )
+        super().__init__(redis_client=redis_client, redis_url=redis_url)
+        self.__index: HammingIndex[Tuple[float, float]] = HammingIndex(
+            max_distance, max_size
+        )
+        self.__max_size = max_size
+        self.__refresh_interval = refresh_interval
+        # ID of the last read entry of the stream
+        self.__last_id = "0-0"
+        self.__task: Optional["asyncio.Task[None]"] = None
+        self.__stats: Dict[str, int] = {"hits": 0, "misses": 0}
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters."""
+        return dict(self.__stats, size=len(self.__index))
+
+    async def start(self) -> None:
+        """Load the index and start refreshing it in the background."""
+        try:
+            await self.refresh()
+            logger.info(
+                "Near-duplicate index loaded (%d).", len(self.__index)
+            )
+        except RedisError as exc:
+            logger.error("Failed to load near-duplicate index: %s", str(exc))
+        self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self) -> None:
+        """Stop refreshing."""
+        if self.__task is not None:
+            self.__task.cancel()
+            await asyncio.gather(self.__task, return_exceptions=True)
+            self.__task = None
+
+    async def __run(self) -> None:
+        """Refresh the index every refresh_interval."""
+        while True:
+            await asyncio.sleep(self.__refresh_interval)
+            try:
+                await self.refresh()
+            except RedisError as exc:
+                logger.warning(
+                    "Failed to refresh near-duplicate index: %s", str(exc)
+                )
+
+    async def refresh(self, count: int = 1000) -> None:
+        """Read the results added to the stream since the last read."""
+        async with self.get_redis_conn() as redis_client:
+            while True:
+                result = await redis_client.xread(
+                    {self.KEY: self.__last_id}, count=count
+                )
+                # RESP2 reply: [[stream key, entries]]
+                if not isinstance(result, list) or not result:
+                    return
+                _, entries = result[0]
+                for entry_id, fields in entries:
+                    self.__last_id = (
+                        entry_id.decode()
+                        if isinstance(entry_id, bytes)
+                        else entry_id
+                    )
+                    try:
+                        moderation_response = (
+                            ModerationResponse.model_validate_json(
+                                fields[b"response"]
+                            )
+                        )
+                        self.__index.add(
+                            int(fields[b"phash"], 16),
+                            (
+                                moderation_response.sfw,
+                                moderation_response.nsfw,
+                            ),
+                        )
+                    except (KeyError, ValueError) as exc:
+                        logger.warning(
+                            "Invalid perceptual hash entry: %s", str(exc)
+                        )
+                if len(entries) < count:
+                    return
+
+    @staticmethod
+    async def hash_image(image_bytes: bytes) -> Optional[int]:
+        """Return the perceptual hash or None if the image is not decoded."""
+        try:
+            return await asyncio.to_thread(dhash, image_bytes)
+        except ValueError as exc:
+            logger.warning("Failed to hash image: %s", str(exc))
+            return None
+
+    def lookup(
+        self, phash: int, moderation_request_id: str = ""
+    ) -> Optional[ModerationResponse]:
+        """Return the result of a near-duplicate image or None."""
+        found = self.__index.search(phash)
+        if found is None:
+            self.__stats["misses"] += 1
+            return None
+        self.__stats["hits"] += 1
+        distance, (sfw, nsfw) = found
+        logger.debug("Near-duplicate found (distance %d).", distance)
+        return ModerationResponse(id=moderation_request_id, sfw=sfw, nsfw=nsfw)
+
+    async def add(
+        self, phash: int, moderation_response: ModerationResponse
+    ) -> None:
+        """Add the result to the index. Unsuccessful results are skipped."""
+        if moderation_response.status != "OK":
+            return
+        self.__index.add(
+            phash, (moderation_response.sfw, moderation_response.nsfw)
+        )
+        try:
+            async with self.get_redis_conn() as redis_client:
+                await redis_client.xadd(
+                    self.KEY,
+                    {
+                        "phash": f"{phash:016x}",
+                        "response": moderation_response.model_dump_json(),
+                    },
+                    maxlen=self.__max_size,
+                    approximate=True,
+                )
+        except RedisError as exc:
+            logger.warning("Failed to persist perceptual hash: %s", str(exc))
@@ -0,0 +1,152 @@
+"""The module responsible for preprocessing the images before moderation."""
+
+import asyncio
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from logging import getLogger
+from typing import List, Optional
+
+from blob_store.base import BlobStore
+from schemas.moderation import ModerationRequest
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is only needed if preprocessing is enabled
+    Image = None  # type: ignore[assignment]
+    ImageOps = None  # type: ignore[assignment]
+
+logger = getLogger("main.services.preprocessing")
+
+
+def downscale_image(
+    image_bytes: bytes, max_size: int, fmt: str = "JPEG", quality: int = 85
+) -> bytes:
+    """
+    Bound the image dimensions and re-encode it without metadata.
+
+    Runs in the process pool, so it is a module-level function.
+
+    :param image_bytes: Image.
+    :param max_size: Maximum width and height (the aspect ratio is kept).
+    :param fmt: Output format: JPEG or WEBP.
+    :param quality: Output quality (1-100).
+    :return: Re-encoded image or the original one, if it is smaller.
+    :raise ValueError: If the image cannot be decoded.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as source:
+            # JPEG is decoded right at the reduced scale
+            source.draft("RGB", (max_size, max_size))
+            image = ImageOps.exif_transpose(source).convert("RGB")
+            image.thumbnail((max_size, max_size), Image.Resampling.BILINEAR)
+            buffer = io.BytesIO()
+            image.save(buffer, format=fmt, quality=quality)
+    except OSError as exc:
+        raise ValueError(f"Cannot decode the image: {exc}") from exc
+    if buffer.tell() >= len(image_bytes):
+        return image_bytes
+    return buffer.getvalue()
+
+
+class ImagePreprocessor(object):
+    """
+    Downscales and re-encodes the images in a process pool.
+
+    The classifiers look at a small input, so sending full-resolution
+    photos only costs bandwidth and upstream latency.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 512,
+        fmt: str = "JPEG",
+        quality: int = 85,
+        workers: Optional[int] = None,
+        blob_store: Optional[BlobStore] = None,
+    ):
+        """
+        Init class.
+
+        :param max_size: Maximum width and height of the images.
+        :param fmt: Output format: JPEG or WEBP.
+        :param quality: Output quality (1-100).
+        :param workers: Number of processes. If None, the number of CPUs.
+        :param blob_store: Store of the images referenced by the requests.
+        :raise RuntimeError: If Pillow is not installed.
+        """
+        if Image is None:
+            raise RuntimeError("Pillow is required to preprocess images.")
+        self.__max_size = max_size
+        self.__fmt = fmt
+        self.__quality = quality
+        self.__blob_store = blob_store
+        self.__executor = ProcessPoolExecutor(workers or os.cpu_count())
+
+    def close(self) -> None:
+        """Shut down the process pool."""
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __image_bytes(
+        self, moderation_request: ModerationRequest
+    ) -> Optional[bytes]:
+        """Return the image of the request (None for the URL images)."""
+        if moderation_request.image_bytes is not None:
+            return moderation_request.image_bytes
+        if moderation_request.blob_ref is not None:
+            if self.__blob_store is None:
+                return None
+            return await self.__blob_store.get(moderation_request.blob_ref)
+        return None
+
+    async def preprocess(
+        self, moderation_request: ModerationRequest
+    ) -> ModerationRequest:
+        """
+        Return the request with the downscaled image.
+
+        The URL images and the images that cannot be decoded
+        are left as is (the NSFW client decides what to do with them),
+        the retried requests are preprocessed already.
+        """
+        if moderation_request.preprocessed:
+            return moderation_request
+        try:
+            image_bytes = await self.__image_bytes(moderation_request)
+            if image_bytes is None:
+                return moderation_request
+            downscaled = await asyncio.get_running_loop().run_in_executor(
+                self.__executor,
+                partial(
+                    downscale_image,
+                    image_bytes,
+                    self.__max_size,
+                    self.__fmt,
+                    self.__quality,
+                ),
+            )
+        except Exception as exc:
+            logger.warning(
+                "Image %s is not preprocessed: %r", moderation_request.id, exc
+            )
+            return moderation_request
+        logger.debug(
+            "Image %s preprocessed: %d -> %d bytes",
+            moderation_request.id,
+            len(image_bytes),
+            len(downscaled),
+        )
+        return moderation_request.model_copy(
+            update={"image_bytes": downscaled, "blob_ref": None}
+        )
+
+    async def preprocess_batch(
+        self, moderation_requests: List[ModerationRequest]
+    ) -> List[ModerationRequest]:
+        """Return the requests with the downscaled images."""
+        return list(
+            await asyncio.gather(
+                *(self.preprocess(request) for request in moderation_requests)
+            )
+        )
@@ -0,0 +1,183 @@
+"""The module responsible for caching moderation results by image content."""
+
+import asyncio
+import hashlib
+from collections import OrderedDict
+from logging import getLogger
+from time import monotonic
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from schemas.moderation import ModerationResponse
+from utils.redis import RedisMixin
+
+logger = getLogger("main.services.result_cache")
+
+ModerationResult = Tuple[str, Optional[ModerationResponse]]
+
+
+class ModerationResultCache(RedisMixin):
+    """
+    Two-tier cache of moderation results keyed by image digest.
+
+    The first tier is an in-process LRU, the second one is redis keys
+    with TTL. Concurrent moderations of the same image are coalesced:
+    only the first one is performed, the others wait for its result.
+    """
+
+    KEY_PREFIX: str = "moderation_cache:"
+
+    def __init__(
+        self,
+        ttl: int,
+        lru_size: int,
+        redis_client: Optional[Redis] = None,
+        redis_url: Optional[str] = None,
+    ):
+        """
+        Init class.
+
+        :param ttl: Time to live of the results (seconds).
+        :param lru_size: Maximum number of results in the in-process LRU.
+        :param redis_client: Redis client.
+        :param redis_url: Redis url
+        :raise ValueError: If redis_client and redis_url are None.
+        """
+        super().__init__(redis_client=redis_client, redis_url=redis_url)
+        self.__ttl = ttl
+        self.__lru_size = lru_size
+        self.__lru: OrderedDict[str, Tuple[float, ModerationResponse]] = (
+            OrderedDict()
+        )
+        self.__in_flight: Dict[str, asyncio.Future[ModerationResult]] = {}
+        self.__stats: Dict[str, int] = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+        }
+
+    @staticmethod
+    def digest(image_bytes: bytes) -> str:
+        """Return the digest of the image content."""
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/coalesce counters."""
+        return dict(self.__stats, local_size=len(self.__lru))
+
+    def __get_local(self, digest: str) -> Optional[ModerationResponse]:
+        """Return the result from the in-process LRU."""
+        item = self.__lru.get(digest)
+        if item is None:
+            return None
+        expires_at, moderation_response = item
+        if expires_at < monotonic():
+            del self.__lru[digest]
+            return None
+        self.__lru.move_to_end(digest)
+        return moderation_response
+
+    def __set_local(
+        self, digest: str, moderation_response: ModerationResponse
+    ) -> None:
+        """Put the result into the in-process LRU."""
+        self.__lru[digest] = (monotonic() + self.__ttl, moderation_response)
+        self.__lru.move_to_end(digest)
+        while len(self.__lru) > self.__lru_size:
+            self.__lru.popitem(last=False)
+
+    async def get(self, digest: str) -> Optional[ModerationResponse]:
+        """Return the cached result or None."""
+        moderation_response = self.__get_local(digest)
+        if moderation_response is not None:
+            self.__stats["local_hits"] += 1
+            return moderation_response
+
+        try:
+            async with self.get_redis_conn() as redis_client:
+                response_str = await redis_client.get(self.KEY_PREFIX + digest)
+        except RedisError as exc:
+            logger.warning("Failed to get cached result: %s", str(exc))
+            response_str = None
+        if response_str is None:
+            self.__stats["misses"] += 1
+            return None
+
+        self.__stats["redis_hits"] += 1
+        moderation_response = ModerationResponse.model_validate_json(
+            response_str
+        )
+        self.__set_local(digest, moderation_response)
+        return moderation_response
+
+    async def set(
+        self, digest: str, moderation_response: ModerationResponse
+    ) -> None:
+        """Cache the result. Unsuccessful results are not cached."""
+        if moderation_response.status != "OK":
+            return
+        self.__set_local(digest, moderation_response)
+        try:
+            async with self.get_redis_conn() as redis_client:
+                await redis_client.set(
+                    self.KEY_PREFIX + digest,
+                    moderation_response.model_dump_json(),
+                    ex=self.__ttl,
+                )
+        except RedisError as exc:
+            logger.warning("Failed to cache result: %s", str(exc))
+
+    async def get_or_moderate(
+        self,
+        digest: str,
+        moderate: Callable[[], Awaitable[ModerationResult]],
+    ) -> ModerationResult:
+        """
+        Return the cached result or moderate the image.
+
+        If the image with the same digest is already being moderated
+        in this process, waits for that moderation instead.
+
+        :param digest: Image digest.
+        :param moderate: Function that enqueues the image and waits for
+        the result. Returns the moderation request ID and the result
+        (None if the result was not received in time).
+        :return: Moderation request ID (empty for cached results)
+        and the result.
+        """
+        moderation_response = await self.get(digest)
+        if moderation_response is not None:
+            return "", moderation_response
+
+        in_flight = self.__in_flight.get(digest)
+        if in_flight is not None:
+            self.__stats["coalesced"] += 1
+            logger.debug("Join the moderation of the image %s", digest)
+            return await asyncio.shield(in_flight)
+
+        future: asyncio.Future[ModerationResult] = (
+            asyncio.get_running_loop().create_future()
+        )
+        self.__in_flight[digest] = future
+        try:
+            result = await moderate()
+            future.set_result(result)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # mark the exception as retrieved if nobody joined
+            future.exception()
+            raise
+        finally:
+            del self.__in_flight[digest]
+
+        _, moderation_response = result
+        if moderation_response is not None:
+            await self.set(digest, moderation_response)
+        return result
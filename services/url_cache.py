@@ -0,0 +1,199 @@
+"""The module responsible for caching moderation results by image URL."""
+
+import hashlib
+from logging import getLogger
+from time import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import httpcore
+import httpx
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from utils.http import NonPublicAddressError, resolve_public_host
+from utils.redis import RedisMixin
+
+logger = getLogger("main.services.url_cache")
+
+DEFAULT_PORTS: Dict[str, int] = {"http": 80, "https": 443}
+# timeout of the resolution of the URL host (seconds)
+RESOLVE_TIMEOUT: float = 2.0
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Return the canonical form of the image URL.
+
+    The scheme and the host are lowercased, the default port
+    and the fragment are dropped, the empty path becomes "/".
+    The query is kept as is (its order may matter to the origin).
+
+    :raise ValueError: If the URL is not absolute http(s) URL
+    or contains credentials.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        raise ValueError("Only absolute http(s) URLs are supported.")
+    if parts.username is not None or parts.password is not None:
+        raise ValueError("URLs with credentials are not supported.")
+
+    host = parts.hostname.lower()
+    if ":" in host:  # IPv6
+        host = f"[{host}]"
+    port = parts.port
+    netloc = (
+        host if port in (None, DEFAULT_PORTS[scheme]) else f"{host}:{port}"
+    )
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+async def check_public_host(
+    url: str, timeout: Optional[float] = RESOLVE_TIMEOUT
+) -> None:
+    """
+    Check that the host of the canonical URL resolves to public addresses.
+
+    This rejects the URL early; the connections to the URLs
+    of the users are checked again when they are made
+    (create_httpx_client with public_only).
+
+    :raise ValueError: If any address of the host is not global
+    or the host cannot be resolved.
+    """
+    parts = urlsplit(url)
+    try:
+        await resolve_public_host(
+            parts.hostname or "",
+            parts.port or DEFAULT_PORTS.get(parts.scheme, 443),
+            timeout,
+        )
+    except NonPublicAddressError:
+        raise ValueError("Private hosts are not supported.")
+    except (httpcore.ConnectError, httpcore.ConnectTimeout):
+        raise ValueError("The host cannot be resolved.")
+
+
+class UrlValidators(RedisMixin):
+    """
+    Versions of the images by URL (from ETag/Last-Modified).
+
+    The version is a part of the results cache key, so when the image
+    behind the URL changes, its result is not reused. The version is
+    revalidated with a HEAD request at most once per revalidate_after
+    seconds. If the origin does not return the validators, the version
+    is empty and the result is reused until it expires.
+    """
+
+    KEY_PREFIX: str = "moderation_url_version:"
+
+    def __init__(
+        self,
+        httpx_client: httpx.AsyncClient,
+        revalidate_after: int,
+        head_timeout: float,
+        ttl: int,
+        redis_client: Optional[Redis] = None,
+        redis_url: Optional[str] = None,
+    ):
+        """
+        Init class.
+
+        :param httpx_client: HTTP client for the HEAD requests
+        (connecting only to the public addresses).
+        :param revalidate_after: How long the version is trusted (seconds).
+        :param head_timeout: Timeout of the HEAD request (seconds).
+        :param ttl: Time to live of the versions (seconds).
+        :param redis_client: Redis client.
+        :param redis_url: Redis url
+        :raise ValueError: If redis_client and redis_url are None.
+        """
+        super().__init__(redis_client=redis_client, redis_url=redis_url)
+        self.__client = httpx_client
+        self.__revalidate_after = revalidate_after
+        self.__head_timeout = head_timeout
+        self.__ttl = ttl
+        self.__stats: Dict[str, int] = {
+            "fresh": 0,
+            "revalidated": 0,
+            "changed": 0,
+            "head_errors": 0,
+        }
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Return the revalidation counters."""
+        return dict(self.__stats)
+
+    async def __head(self, url: str) -> Optional[str]:
+        """
+        Return the version of the image from its validators.
+
+        :return: Version ("" if the origin returns no validators)
+        or None, if the HEAD request failed.
+        """
+        try:
+            resp = await self.__client.head(url, timeout=self.__head_timeout)
+        except httpx.HTTPError as exc:
+            logger.debug("HEAD %s failed: %r", url, exc)
+            return None
+        if not resp.is_success:
+            logger.debug("HEAD %s returned %d", url, resp.status_code)
+            return None
+        etag = resp.headers.get("ETag")
+        if etag:
+            return f"etag:{etag}"
+        last_modified = resp.headers.get("Last-Modified")
+        if last_modified:
+            return f"last-modified:{last_modified}"
+        return ""
+
+    async def get_version(self, url: str, canonical_url: str) -> str:
+        """
+        Return the current version of the image.
+
+        :param url: Image URL (the HEAD request is sent to it).
+        :param canonical_url: Canonical URL (the key of the version).
+        """
+        key = (
+            self.KEY_PREFIX
+            + hashlib.sha256(canonical_url.encode()).hexdigest()
+        )
+        try:
+            async with self.get_redis_conn() as redis_client:
+                stored = await redis_client.hgetall(key)
+        except RedisError as exc:
+            logger.warning("Failed to get URL version: %s", str(exc))
+            stored = {}
+
+        version: Optional[str] = None
+        if stored:
+            value = stored[b"version"]
+            version = value.decode() if isinstance(value, bytes) else value
+            if time() - float(stored[b"checked_at"]) < self.__revalidate_after:
+                self.__stats["fresh"] += 1
+                return version
+
+        current = await self.__head(url)
+        if current is None:
+            self.__stats["head_errors"] += 1
+            # the image cannot be checked now: keep the known version
+            current = version or ""
+        else:
+            self.__stats["revalidated"] += 1
+        if version is not None and current != version:
+            self.__stats["changed"] += 1
+            logger.info("Image %s has changed.", canonical_url)
+
+        try:
+            async with self.get_redis_conn() as redis_client:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    pipe.hset(
+                        key, mapping={"version": current, "checked_at": time()}
+                    )
+                    pipe.expire(key, self.__ttl)
+                    await pipe.execute()
+        except RedisError as exc:
+            logger.warning("Failed to save URL version: %s", str(exc))
+        return current
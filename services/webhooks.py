@@ -0,0 +1,307 @@
+"""The module responsible for delivering the moderation results by webhooks."""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import random
+from collections import Counter
+from logging import getLogger
+from typing import Any, Dict, Optional, Set
+from urllib.parse import urlsplit
+
+import httpx
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from con_prod.webhooks.queue import WebhooksQueue
+from config.app import Config
+from schemas.webhook import WebhookJob
+from utils.http import (
+    NonPublicAddressError,
+    create_httpx_client,
+    parse_retry_after,
+)
+
+logger = getLogger("main.services.webhooks")
+
+RETRYABLE_STATUS_CODES = frozenset((408, 425, 429))
+
+
+class WebhookRejectedError(Exception):
+    """The callback rejected the webhook, so it will not succeed on retry."""
+
+
+class WebhookDispatcher(object):
+    """
+    Delivers the moderation results to the callback URLs.
+
+    The jobs are POSTed by a pooled HTTP client, at most max_concurrency
+    at a time and at most per_host_concurrency to one host (the jobs
+    of a busy host wait in the retry set, so a slow host does not take
+    the slots of the others). The failed deliveries are retried with
+    an exponential randomized delay, then put into the dead-letter list.
+    The callbacks are expected to be public: the client is to connect
+    only to the public addresses and the redirects are not followed.
+    """
+
+    def __init__(
+        self,
+        queue: WebhooksQueue,
+        httpx_client: httpx.AsyncClient,
+        nsfw_threshold: float,
+        max_concurrency: int = 64,
+        per_host_concurrency: int = 4,
+        max_attempts: int = 8,
+        retry_base_delay: float = 1.0,
+        retry_max_delay: float = 300.0,
+        timeout: float = 10.0,
+        secret: Optional[str] = None,
+        busy_host_delay: float = 0.5,
+    ):
+        """
+        Init class.
+
+        :param queue: Queue of the webhooks.
+        :param httpx_client: HTTP client (connecting only to the public
+        addresses).
+        :param nsfw_threshold: Images with the higher nsfw score
+        are rejected.
+        :param max_concurrency: Maximum number of deliveries in progress.
+        :param per_host_concurrency: Maximum number of deliveries
+        in progress to one host.
+        :param max_attempts: Number of attempts before the job
+        is dead-lettered.
+        :param retry_base_delay: Base of the exponential retry delay
+        (seconds).
+        :param retry_max_delay: Maximum retry delay (seconds)
+        (not counting Retry-After of the callback).
+        :param timeout: Timeout of the delivery (seconds).
+        :param secret: Key of the body signature (X-Signature header).
+        :param busy_host_delay: Delay of the job to the busy host (seconds).
+        """
+        self.__queue = queue
+        self.__client = httpx_client
+        self.__nsfw_threshold = nsfw_threshold
+        self.__slots = asyncio.Semaphore(max_concurrency)
+        self.__per_host_concurrency = per_host_concurrency
+        self.__max_attempts = max_attempts
+        self.__retry_base_delay = retry_base_delay
+        self.__retry_max_delay = retry_max_delay
+        self.__timeout = timeout
+        self.__secret = secret.encode() if secret else None
+        self.__busy_host_delay = busy_host_delay
+        self.__host_in_flight: Counter[str] = Counter()
+        self.__deliveries: Set[asyncio.Task[None]] = set()
+        self.__stats: Dict[str, int] = {
+            "delivered": 0,
+            "retried": 0,
+            "dead": 0,
+            "deferred": 0,
+        }
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Return the delivery counters."""
+        return dict(self.__stats, in_flight=len(self.__deliveries))
+
+    def __body(self, job: WebhookJob) -> bytes:
+        """Return the body of the webhook."""
+        payload = {
+            "request_id": job.response.id,
+            **job.response.verdict(self.__nsfw_threshold),
+            "nsfw": job.response.nsfw,
+        }
+        return json.dumps(payload).encode()
+
+    def __headers(self, job: WebhookJob, body: bytes) -> Dict[str, str]:
+        """Return the headers of the webhook."""
+        headers = {
+            "Content-Type": "application/json",
+            # the same for all the attempts, so the receiver can dedupe
+            "Idempotency-Key": job.id,
+        }
+        if self.__secret is not None:
+            signature = hmac.new(self.__secret, body, hashlib.sha256)
+            headers["X-Signature"] = f"sha256={signature.hexdigest()}"
+        return headers
+
+    def __retry_delay(
+        self, attempt: int, retry_after: Optional[float] = None
+    ) -> float:
+        """Return the randomized exponential delay (full jitter)."""
+        cap = min(self.__retry_max_delay, self.__retry_base_delay * 2**attempt)
+        return (retry_after or 0.0) + random.uniform(0.0, cap)
+
+    async def __post(self, job: WebhookJob) -> Optional[float]:
+        """
+        POST the webhook.
+
+        :return: None, if the webhook is delivered, else Retry-After
+        of the callback (0 if it is not set).
+        :raise httpx.HTTPError: If the request failed.
+        :raise WebhookRejectedError: If the callback answered with 4xx
+        (except 408, 425 and 429).
+        """
+        body = self.__body(job)
+        resp = await self.__client.post(
+            job.url,
+            content=body,
+            headers=self.__headers(job, body),
+            timeout=self.__timeout,
+            follow_redirects=False,
+        )
+        if resp.is_success:
+            return None
+        job.last_error = f"HTTP {resp.status_code}"
+        if resp.status_code in RETRYABLE_STATUS_CODES or resp.is_server_error:
+            return parse_retry_after(resp.headers.get("Retry-After")) or 0.0
+        raise WebhookRejectedError(job.last_error)
+
+    async def __deliver(self, job: WebhookJob, host: str) -> None:
+        """Deliver the webhook and schedule the retry if it failed."""
+        try:
+            rejected = False
+            retry_after: Optional[float] = 0.0
+            try:
+                retry_after = await self.__post(job)
+            except httpx.HTTPError as exc:
+                job.last_error = repr(exc)
+                # the callback resolves to a private address
+                rejected = isinstance(exc.__cause__, NonPublicAddressError)
+            except WebhookRejectedError:
+                rejected = True
+            if retry_after is None:
+                self.__stats["delivered"] += 1
+                logger.debug("Webhook %s delivered.", job.id)
+                return
+
+            job.attempt += 1
+            if rejected or job.attempt >= self.__max_attempts:
+                self.__stats["dead"] += 1
+                logger.warning(
+                    "Webhook %s to %s failed: %s. Dead-lettered.",
+                    job.id,
+                    host,
+                    job.last_error,
+                )
+                await self.__queue.dead_letter(job)
+                return
+            delay = self.__retry_delay(job.attempt, retry_after)
+            self.__stats["retried"] += 1
+            logger.info(
+                "Webhook %s to %s failed: %s. Retry in %.1f s.",
+                job.id,
+                host,
+                job.last_error,
+                delay,
+            )
+            await self.__queue.retry_later(job, delay)
+        except RedisError as exc:
+            logger.error("Webhook %s is lost: %s", job.id, str(exc))
+        finally:
+            self.__host_in_flight[host] -= 1
+            if not self.__host_in_flight[host]:
+                del self.__host_in_flight[host]
+            self.__slots.release()
+
+    async def __move_due(self, interval: float = 0.5) -> None:
+        """Periodically move the jobs due for a retry to the queue."""
+        while True:
+            try:
+                await self.__queue.move_due()
+            except RedisError as exc:
+                logger.error("Failed to move the retries: %s", str(exc))
+            await asyncio.sleep(interval)
+
+    async def run(self) -> None:
+        """Deliver the webhooks until cancelled."""
+        mover = asyncio.create_task(self.__move_due())
+        try:
+            while True:
+                await self.__slots.acquire()
+                started = False
+                try:
+                    job = await self.__queue.pop()
+                    if job is None:
+                        continue
+                    host = urlsplit(job.url).netloc
+                    if (
+                        self.__host_in_flight[host]
+                        >= self.__per_host_concurrency
+                    ):
+                        self.__stats["deferred"] += 1
+                        await self.__queue.retry_later(
+                            job, self.__busy_host_delay
+                        )
+                        continue
+                    self.__host_in_flight[host] += 1
+                    task = asyncio.create_task(self.__deliver(job, host))
+                    self.__deliveries.add(task)
+                    task.add_done_callback(self.__deliveries.discard)
+                    started = True
+                except RedisError as exc:
+                    logger.error("Failed to get a webhook: %s", str(exc))
+                    await asyncio.sleep(1.0)
+                finally:
+                    if not started:
+                        self.__slots.release()
+        finally:
+            mover.cancel()
+            for task in self.__deliveries:
+                task.cancel()
+
+
+async def log_stats(
+    queue: WebhooksQueue, dispatcher: WebhookDispatcher, interval: float = 60.0
+) -> None:
+    """Periodically log the stats of the queue and of the dispatcher."""
+    while True:
+        try:
+            logger.info("Webhooks queue stats: %s", await queue.stats())
+        except RedisError as exc:
+            logger.error("Failed to get webhooks queue stats. %s", str(exc))
+        logger.info("Webhooks stats: %s", dispatcher.stats)
+        await asyncio.sleep(interval)
+
+
+async def launch_webhook_dispatcher():
+    """Launch the webhook dispatcher."""
+    import logging.config
+
+    from config.app import get_config
+    from config.log import get_log_config
+
+    config: Config = get_config()
+    logging.config.dictConfig(get_log_config(config.debug))
+
+    webhooks = config.webhooks
+    async with (
+        Redis.from_url(config.redis.url) as redis,
+        create_httpx_client(
+            config.http_client, public_only=True
+        ) as httpx_client,
+    ):
+        queue = WebhooksQueue(
+            redis_client=redis,
+            dead_letter_max_len=webhooks.dead_letter_max_len,
+        )
+        dispatcher = WebhookDispatcher(
+            queue=queue,
+            httpx_client=httpx_client,
+            nsfw_threshold=config.nsfw_threshold,
+            max_concurrency=webhooks.max_concurrency,
+            per_host_concurrency=webhooks.per_host_concurrency,
+            max_attempts=webhooks.max_attempts,
+            retry_base_delay=webhooks.retry_base_delay,
+            retry_max_delay=webhooks.retry_max_delay,
+            timeout=webhooks.timeout,
+            secret=webhooks.secret,
+        )
+        async with asyncio.TaskGroup() as task_group:
+            task_group.create_task(dispatcher.run())
+            task_group.create_task(log_stats(queue, dispatcher))
+
+
+if __name__ == "__main__":
+    asyncio.run(launch_webhook_dispatcher())
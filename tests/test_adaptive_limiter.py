@@ -0,0 +1,86 @@
+"""Tests of the AIMD concurrency limiter."""
+
+import asyncio
+from time import monotonic
+
+import pytest
+
+from utils.adaptive_limiter import AdaptiveConcurrencyLimiter
+
+
+def test_additive_increase_multiplicative_decrease():
+    """The limit grows by one per limit of successes, halves on 429."""
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=8)
+
+    for _ in range(4):
+        limiter.on_success(0.01)
+    # +1/limit per success: 4.92 after four of them
+    assert limiter.limit == 4
+    limiter.on_success(0.01)
+    assert limiter.limit == 5
+
+    limiter.on_throttle()
+    assert limiter.limit == 2
+    assert limiter.stats["throttles"] == 1
+
+    for _ in range(3):
+        limiter.on_throttle()
+    assert limiter.limit == 1
+
+    for _ in range(200):
+        limiter.on_success(0.01)
+    assert limiter.limit == 8
+
+
+def test_latency_inflation_decreases_limit():
+    """The latency over the tolerance times the baseline cuts the limit."""
+    limiter = AdaptiveConcurrencyLimiter(
+        initial_limit=10, max_limit=10, min_samples=5
+    )
+    for _ in range(5):
+        limiter.on_success(0.01)
+    assert limiter.limit == 10
+    assert limiter.stats["baseline_ms"] == pytest.approx(10.0)
+
+    for _ in range(5):
+        limiter.on_success(0.1)
+    assert limiter.limit < 10
+
+
+def test_limit_and_retry_after_are_enforced():
+    """At most limit requests run, none starts until Retry-After."""
+
+    async def run() -> None:
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=2)
+        peak = 0
+
+        async def request() -> None:
+            nonlocal peak
+            async with limiter:
+                peak = max(peak, limiter.in_flight)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(request() for _ in range(6)))
+        assert peak == 2
+        assert limiter.in_flight == 0
+
+        limiter.on_throttle(retry_after=0.1)
+        start = monotonic()
+        async with limiter:
+            assert monotonic() - start >= 0.09
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"initial_limit": 0},
+        {"initial_limit": 8, "max_limit": 4},
+        {"backoff": 1.0},
+    ],
+)
+def test_invalid_parameters(kwargs):
+    """Inconsistent limits and backoff are rejected."""
+    with pytest.raises(ValueError):
+        AdaptiveConcurrencyLimiter(**kwargs)
@@ -0,0 +1,199 @@
+"""Tests of the admission control by the predicted queue wait."""
+
+import asyncio
+import math
+from dataclasses import replace
+from typing import Dict
+
+import pytest
+
+from con_prod.moderation_requests.lanes import lane_queue_key
+from config.app import (
+    MODERATION_DEQUEUED_KEY,
+    MODERATION_REQUESTS_QUEUE_KEY,
+    AdmissionConfig,
+    Config,
+    QueueConfig,
+    get_config,
+)
+from services import admission
+from services.admission import AdmissionController, QueueOverloadedError
+
+fakeredis = pytest.importorskip("fakeredis")
+
+LANES = (("interactive", 8), ("bulk", 1), ("backfill", 0))
+
+
+class Clock(object):
+    """Fake monotonic clock."""
+
+    def __init__(self):
+        """Init class."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Return the time."""
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    """Replace the clock of the controller."""
+    fake_clock = Clock()
+    monkeypatch.setattr(admission, "monotonic", fake_clock)
+    return fake_clock
+
+
+def create_config(**admission_config) -> Config:
+    """Return the config of the list queue with three lanes."""
+    return replace(
+        get_config(),
+        moderation_timeout=5.0,
+        queue=QueueConfig(lanes=LANES),
+        admission=AdmissionConfig(smoothing=1.0, **admission_config),
+    )
+
+
+async def sample_queue(
+    controller: AdmissionController,
+    redis_client,
+    clock: Clock,
+    depths: Dict[str, int],
+    dequeued_per_second: int,
+) -> None:
+    """Sample the queue twice, a second apart, to measure the drain rate."""
+    lanes = [name for name, _ in LANES]
+    for lane, depth in depths.items():
+        key = lane_queue_key(MODERATION_REQUESTS_QUEUE_KEY, lane, lanes[0])
+        await redis_client.delete(key)
+        if depth:
+            await redis_client.rpush(key, *[b"request"] * depth)
+    await controller.sample()
+    await redis_client.incrby(MODERATION_DEQUEUED_KEY, dequeued_per_second)
+    clock.now += 1.0
+    await controller.sample()
+
+
+def test_requests_are_admitted_until_drain_rate_is_known(clock: Clock):
+    """Without the drain rate the wait is not predicted."""
+
+    async def run() -> None:
+        redis_client = fakeredis.FakeAsyncRedis()
+        controller = AdmissionController(
+            create_config(), redis_client=redis_client
+        )
+        await controller.sample()
+        assert controller.drain_rate is None
+        assert controller.predicted_wait("interactive") == 0.0
+        assert controller.admit("interactive") is True
+
+    asyncio.run(run())
+
+
+def test_wait_is_predicted_by_lane_share(clock: Clock):
+    """A busy lane drains at its share, the lane with weight 0 last."""
+
+    async def run() -> None:
+        redis_client = fakeredis.FakeAsyncRedis()
+        controller = AdmissionController(
+            create_config(), redis_client=redis_client
+        )
+        await sample_queue(
+            controller,
+            redis_client,
+            clock,
+            {"interactive": 80, "bulk": 10, "backfill": 90},
+            dequeued_per_second=9,
+        )
+        assert controller.drain_rate == pytest.approx(9.0)
+        # interactive gets 8/9 of the drain rate, bulk - 1/9
+        assert controller.predicted_wait("interactive") == pytest.approx(10)
+        assert controller.predicted_wait("bulk") == pytest.approx(10)
+        # waits for all the queued requests
+        assert controller.predicted_wait("backfill") == pytest.approx(20)
+        # unknown lanes are queued in the default one
+        assert controller.predicted_wait("unknown") == pytest.approx(10)
+
+    asyncio.run(run())
+
+
+def test_sync_budget_and_rejections(clock: Clock):
+    """Long waits get 202, too long ones 503, a full queue 429."""
+
+    async def run() -> None:
+        redis_client = fakeredis.FakeAsyncRedis()
+        controller = AdmissionController(
+            create_config(max_wait=60.0, max_depth=1000),
+            redis_client=redis_client,
+        )
+        await sample_queue(
+            controller,
+            redis_client,
+            clock,
+            {"interactive": 8, "bulk": 0, "backfill": 0},
+            dequeued_per_second=2,
+        )
+        # 4 s wait is within the moderation timeout
+        assert controller.admit("interactive") is True
+
+        await sample_queue(
+            controller,
+            redis_client,
+            clock,
+            {"interactive": 100, "bulk": 0, "backfill": 0},
+            dequeued_per_second=2,
+        )
+        assert controller.admit("interactive") is False
+
+        await sample_queue(
+            controller,
+            redis_client,
+            clock,
+            {"interactive": 200, "bulk": 0, "backfill": 0},
+            dequeued_per_second=2,
+        )
+        with pytest.raises(QueueOverloadedError) as exc_info:
+            controller.admit("interactive")
+        assert exc_info.value.status_code == 503
+        assert exc_info.value.retry_after == 40
+
+        await sample_queue(
+            controller,
+            redis_client,
+            clock,
+            {"interactive": 0, "bulk": 0, "backfill": 1000},
+            dequeued_per_second=2,
+        )
+        with pytest.raises(QueueOverloadedError) as exc_info:
+            controller.check("interactive")
+        assert exc_info.value.status_code == 429
+
+    asyncio.run(run())
+
+
+def test_admitted_requests_count_until_next_sample(clock: Clock):
+    """The requests admitted between the samples deepen the queue."""
+
+    async def run() -> None:
+        redis_client = fakeredis.FakeAsyncRedis()
+        controller = AdmissionController(
+            create_config(max_depth=0), redis_client=redis_client
+        )
+        await sample_queue(
+            controller,
+            redis_client,
+            clock,
+            {"interactive": 8, "bulk": 0, "backfill": 0},
+            dequeued_per_second=8,
+        )
+        assert controller.predicted_wait("interactive") == pytest.approx(1)
+        for _ in range(8):
+            controller.admit("interactive")
+        assert controller.predicted_wait("interactive") == pytest.approx(2)
+
+        # the moderators stopped taking the requests
+        clock.now += 1.0
+        await controller.sample()
+        assert controller.predicted_wait("interactive") == math.inf
+
+    asyncio.run(run())
@@ -0,0 +1,93 @@
+"""Tests of the blob stores."""
+
+import asyncio
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from blob_store import create_blob_store
+from blob_store.base import BlobNotFoundError, BlobStore
+from blob_store.filesystem import FileSystemBlobStore
+from blob_store.redis_store import RedisBlobStore
+from config.app import BlobStoreConfig
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def check_round_trip(store: BlobStore) -> None:
+    """Put, get and delete a blob."""
+
+    async def run() -> None:
+        ref = await store.put(b"\x00image\xff")
+        assert await store.get(ref) == b"\x00image\xff"
+        await store.delete(ref)
+        with pytest.raises(BlobNotFoundError):
+            await store.get(ref)
+        # deleting a missing blob is not an error
+        await store.delete(ref)
+
+    asyncio.run(run())
+
+
+def test_redis_round_trip():
+    """The blobs are kept in redis keys."""
+    check_round_trip(
+        RedisBlobStore(ttl=60, redis_client=fakeredis.FakeAsyncRedis())
+    )
+
+
+def test_filesystem_round_trip(tmp_path: Path):
+    """The blobs are kept in files."""
+    check_round_trip(FileSystemBlobStore(directory=str(tmp_path), ttl=60))
+
+
+def test_filesystem_rejects_paths(tmp_path: Path):
+    """A reference is a blob name, not a path."""
+    (tmp_path / "secret").write_bytes(b"secret")
+    store = FileSystemBlobStore(directory=str(tmp_path / "blobs"), ttl=60)
+
+    with pytest.raises(BlobNotFoundError):
+        asyncio.run(store.get("../secret"))
+
+
+def test_filesystem_purges_expired(tmp_path: Path):
+    """The blobs older than TTL are deleted."""
+    store = FileSystemBlobStore(directory=str(tmp_path), ttl=60)
+
+    async def run() -> None:
+        old_ref = await store.put(b"old")
+        new_ref = await store.put(b"new")
+        expired = time.time() - 120
+        os.utime(tmp_path / old_ref, (expired, expired))
+
+        assert await store.purge_expired() == 1
+        assert await store.get(new_ref) == b"new"
+        with pytest.raises(BlobNotFoundError):
+            await store.get(old_ref)
+
+    asyncio.run(run())
+
+
+def test_create_blob_store(tmp_path: Path):
+    """The backend is chosen by config, inline needs no store."""
+    redis_client = fakeredis.FakeAsyncRedis()
+
+    assert (
+        create_blob_store(BlobStoreConfig(backend="inline"), redis_client)
+        is None
+    )
+    assert isinstance(
+        create_blob_store(BlobStoreConfig(backend="redis"), redis_client),
+        RedisBlobStore,
+    )
+    assert isinstance(
+        create_blob_store(
+            BlobStoreConfig(backend="filesystem", directory=str(tmp_path)),
+            redis_client,
+        ),
+        FileSystemBlobStore,
+    )
+    with pytest.raises(ValueError):
+        create_blob_store(BlobStoreConfig(backend="s3"), redis_client)
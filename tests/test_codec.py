@@ -0,0 +1,78 @@
+"""Tests of the wire format of the queue messages."""
+
+import pytest
+
+from con_prod.codec import (
+    MAGIC,
+    decode_request,
+    decode_response,
+    encode_request,
+    encode_response,
+)
+from schemas import ModerationRequest, ModerationResponse
+
+IMAGE = bytes(range(256))
+
+
+def test_request_frame_carries_raw_image():
+    """The image bytes follow the JSON header as is."""
+    moderation_request = ModerationRequest(image_bytes=IMAGE, lane="bulk")
+
+    data = encode_request(moderation_request)
+    assert data[0] == MAGIC
+    assert data.endswith(IMAGE)
+
+    decoded = decode_request(data)
+    assert decoded.id == moderation_request.id
+    assert decoded.image_bytes == IMAGE
+    assert decoded.lane == "bulk"
+
+
+def test_frames_and_legacy_json_are_decoded_side_by_side():
+    """The JSON messages queued before the upgrade are still decoded."""
+    with_image = ModerationRequest(image_bytes=IMAGE)
+    by_url = ModerationRequest(image="https://example.com/image.png")
+    messages = [
+        encode_request(with_image),
+        encode_request(with_image, binary=False),
+        # legacy JSON messages are read from redis as bytes or str
+        encode_request(by_url, binary=False).decode(),
+        encode_request(by_url),
+    ]
+
+    decoded = [decode_request(message) for message in messages]
+    assert [request.id for request in decoded] == [
+        with_image.id,
+        with_image.id,
+        by_url.id,
+        by_url.id,
+    ]
+    assert decoded[0].image_bytes == IMAGE
+    assert decoded[3].image == by_url.image
+    assert decoded[3].image_bytes is None
+
+
+def test_response_frame_and_json():
+    """The responses are decoded from both formats."""
+    moderation_response = ModerationResponse(id="1", sfw=0.25, nsfw=0.75)
+
+    for binary in (True, False):
+        decoded = decode_response(
+            encode_response(moderation_response, binary=binary)
+        )
+        assert decoded == moderation_response
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        bytes((MAGIC,)),
+        bytes((MAGIC, 1, 0, 0, 0, 100)) + b"{}",
+        bytes((MAGIC, 2, 0, 0, 0, 2)) + b"{}",
+        b"not json",
+    ],
+)
+def test_invalid_messages_raise_value_error(data: bytes):
+    """Truncated frames, unknown versions and garbage are rejected."""
+    with pytest.raises(ValueError):
+        decode_request(data)
@@ -0,0 +1,108 @@
+"""Tests of the weighted order of the priority lanes."""
+
+from collections import Counter
+from typing import Dict, List
+
+import pytest
+
+from con_prod.moderation_requests import lanes
+from con_prod.moderation_requests.lanes import LaneScheduler, lane_queue_key
+
+
+class Clock(object):
+    """Fake monotonic clock."""
+
+    def __init__(self):
+        """Init class."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Return the time."""
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    """Replace the clock of the scheduler."""
+    fake_clock = Clock()
+    monkeypatch.setattr(lanes, "monotonic", fake_clock)
+    return fake_clock
+
+
+def serve(
+    scheduler: LaneScheduler, depths: Dict[str, int], count: int
+) -> List[str]:
+    """Take count requests one by one from the non-empty lanes."""
+    taken: List[str] = []
+    for _ in range(count):
+        for lane in scheduler.order():
+            if depths[lane]:
+                depths[lane] -= 1
+                scheduler.served(lane, 1)
+                taken.append(lane)
+                break
+            scheduler.idle(lane)
+    return taken
+
+
+def test_busy_lanes_are_served_by_weights(clock: Clock):
+    """The busy lanes get the requests in proportion to the weights."""
+    scheduler = LaneScheduler([("interactive", 8), ("bulk", 1)], 30.0)
+
+    taken = serve(scheduler, {"interactive": 1000, "bulk": 1000}, 90)
+    assert Counter(taken) == {"interactive": 80, "bulk": 10}
+
+
+def test_idle_lane_does_not_bank_credit(clock: Clock):
+    """A lane back from idle gets its share, not a burst."""
+    scheduler = LaneScheduler([("interactive", 1), ("bulk", 1)], 30.0)
+    serve(scheduler, {"interactive": 0, "bulk": 100}, 50)
+
+    taken = serve(scheduler, {"interactive": 100, "bulk": 100}, 10)
+    # within one request of the fair share (the pass catches up
+    # with the last served one)
+    assert Counter(taken)["bulk"] >= 4
+
+
+def test_zero_weight_lane_is_served_only_when_others_are_empty(
+    clock: Clock,
+):
+    """The lane with weight 0 is last, even when it waits for long."""
+    scheduler = LaneScheduler(
+        [("interactive", 8), ("backfill", 0), ("bulk", 1)], 30.0
+    )
+    depths = {"interactive": 20, "backfill": 5, "bulk": 5}
+
+    clock.now = 100.0
+    assert scheduler.order()[-1] == "backfill"
+    taken = serve(scheduler, depths, 30)
+    assert taken[-5:] == ["backfill"] * 5
+    assert "backfill" not in taken[:-5]
+
+
+def test_starving_lane_goes_first(clock: Clock):
+    """The lane not served for max_wait seconds is served next."""
+    scheduler = LaneScheduler([("interactive", 100), ("bulk", 1)], 30.0)
+    scheduler.served("bulk", 1)
+    clock.now = 10.0
+    scheduler.served("interactive", 1)
+    assert scheduler.order() == ["interactive", "bulk"]
+
+    clock.now = 31.0
+    assert scheduler.order() == ["bulk", "interactive"]
+    scheduler.served("bulk", 1)
+    assert scheduler.order()[0] == "interactive"
+
+
+def test_invalid_lanes():
+    """There must be a lane, the weights must not be negative."""
+    with pytest.raises(ValueError):
+        LaneScheduler([], 30.0)
+    with pytest.raises(ValueError):
+        LaneScheduler([("interactive", -1)], 30.0)
+
+
+def test_default_lane_uses_queue_key():
+    """The requests queued before the lanes are in the default lane."""
+    assert lane_queue_key("queue", "interactive", "interactive") == "queue"
+    assert lane_queue_key("queue", "bulk", "interactive") == "queue:bulk"
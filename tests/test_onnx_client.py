@@ -0,0 +1,157 @@
+"""Tests of the local NSFW classifier on a tiny ONNX model."""
+
+import asyncio
+import io
+import math
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import pytest
+
+from config.app import HttpClientConfig, LocalModelConfig
+from schemas.moderation import ModerationRequest, ModerationResponse
+from utils.http import create_httpx_client
+
+pytest.importorskip("numpy")
+onnx = pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+Image = pytest.importorskip("PIL.Image")
+
+from api.nsfw_moderation.onnx_client import OnnxNSFWClient  # noqa: E402
+
+SIZE = 4
+
+
+def save_model(path: Path, batch_size: Optional[int] = None) -> str:
+    """
+    Save the model returning the mean of each RGB channel.
+
+    So the score of class i is the mean of channel i of the image.
+    """
+    from onnx import TensorProto, helper
+
+    batch = batch_size if batch_size is not None else "N"
+    graph = helper.make_graph(
+        [
+            helper.make_node(
+                "ReduceMean",
+                ["image"],
+                ["scores"],
+                axes=[2, 3],
+                keepdims=0,
+            )
+        ],
+        "channel_means",
+        [
+            helper.make_tensor_value_info(
+                "image", TensorProto.FLOAT, [batch, 3, SIZE, SIZE]
+            )
+        ],
+        [
+            helper.make_tensor_value_info(
+                "scores", TensorProto.FLOAT, [batch, 3]
+            )
+        ],
+    )
+    model = helper.make_model(
+        graph, opset_imports=[helper.make_opsetid("", 13)]
+    )
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    onnx.save(model, str(path))
+    return str(path)
+
+
+def png(color: Tuple[int, int, int]) -> bytes:
+    """Return the PNG image of one color."""
+    buf = io.BytesIO()
+    Image.new("RGB", (SIZE, SIZE), color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def moderate(
+    model_path: str, images: List[Union[bytes, str]], **config
+) -> List[ModerationResponse]:
+    """Moderate the images (bytes or URLs) with the local client."""
+
+    async def run() -> List[ModerationResponse]:
+        async with create_httpx_client(
+            HttpClientConfig(), public_only=True
+        ) as httpx_client:
+            client = OnnxNSFWClient(
+                LocalModelConfig(
+                    path=model_path,
+                    input_size=SIZE,
+                    max_batch_size=2,
+                    **config,
+                ),
+                httpx_client=httpx_client,
+            )
+            try:
+                return await client.moderate_batch(
+                    [
+                        (
+                            ModerationRequest(id=str(i), image=image)
+                            if isinstance(image, str)
+                            else ModerationRequest(
+                                id=str(i), image_bytes=image
+                            )
+                        )
+                        for i, image in enumerate(images)
+                    ]
+                )
+            finally:
+                await client.close()
+
+    return asyncio.run(run())
+
+
+def test_probabilities_are_mapped_by_labels(tmp_path: Path):
+    """The probabilities of the nsfw labels are summed as is."""
+    model_path = save_model(tmp_path / "model.onnx")
+    colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+
+    responses = moderate(model_path, [png(color) for color in colors])
+    assert [resp.id for resp in responses] == ["0", "1", "2"]
+    assert [resp.status for resp in responses] == ["OK"] * 3
+    assert [resp.nsfw for resp in responses] == pytest.approx([0, 1, 0])
+    assert [resp.sfw for resp in responses] == pytest.approx([1, 0, 1])
+
+    responses = moderate(
+        model_path, [png(color) for color in colors], nsfw_labels=(1, 2)
+    )
+    assert [resp.nsfw for resp in responses] == pytest.approx([0, 1, 1])
+
+
+def test_logits_are_converted_with_softmax(tmp_path: Path):
+    """The outputs that are not probabilities go through softmax."""
+    model_path = save_model(tmp_path / "model.onnx")
+
+    responses = moderate(model_path, [png((0, 255, 255)), png((0, 0, 0))])
+    # softmax of (0, 1, 1) and of (0, 0, 0)
+    expected = math.e / (1 + 2 * math.e)
+    assert [resp.nsfw for resp in responses] == pytest.approx(
+        [expected, 1 / 3], abs=1e-5
+    )
+
+
+def test_fixed_batch_and_invalid_image(tmp_path: Path):
+    """The partial batch is padded, an invalid image fails alone."""
+    model_path = save_model(tmp_path / "model.onnx", batch_size=4)
+
+    responses = moderate(
+        model_path, [png((0, 255, 0)), b"not an image", png((255, 0, 0))]
+    )
+    assert [resp.status for resp in responses] == ["OK", "ERROR", "OK"]
+    assert responses[0].nsfw == pytest.approx(1)
+    assert responses[2].nsfw == pytest.approx(0)
+
+
+def test_private_image_url_is_not_downloaded(tmp_path: Path):
+    """The image URL resolving to a private address fails alone."""
+    model_path = save_model(tmp_path / "model.onnx")
+
+    responses = moderate(
+        model_path, ["http://127.0.0.1:9/image.png", png((0, 255, 0))]
+    )
+    assert [resp.status for resp in responses] == ["ERROR", "OK"]
@@ -0,0 +1,116 @@
+"""Tests of the cache of the moderation results."""
+
+import asyncio
+from typing import List
+
+import pytest
+
+from schemas.moderation import ModerationResponse
+from services.result_cache import ModerationResult, ModerationResultCache
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def create_cache(redis_client=None) -> ModerationResultCache:
+    """Return the cache on a fake redis."""
+    return ModerationResultCache(
+        ttl=60,
+        lru_size=10,
+        redis_client=redis_client or fakeredis.FakeAsyncRedis(),
+    )
+
+
+def test_only_ok_results_are_cached():
+    """The unsuccessful results are moderated again."""
+
+    async def run() -> None:
+        cache = create_cache()
+        await cache.set("error", ModerationResponse(id="1", status="ERROR"))
+        assert await cache.get("error") is None
+
+        await cache.set("ok", ModerationResponse(id="2", sfw=0.9, nsfw=0.1))
+        cached = await cache.get("ok")
+        assert cached is not None and cached.nsfw == pytest.approx(0.1)
+        assert cache.stats["local_hits"] == 1
+        assert cache.stats["misses"] == 1
+
+    asyncio.run(run())
+
+
+def test_redis_hit_fills_local_cache():
+    """The result cached by another process is read from redis once."""
+
+    async def run() -> None:
+        redis_client = fakeredis.FakeAsyncRedis()
+        await create_cache(redis_client).set(
+            "ok", ModerationResponse(id="1", sfw=0.2, nsfw=0.8)
+        )
+        cache = create_cache(redis_client)
+        for _ in range(2):
+            cached = await cache.get("ok")
+            assert cached is not None and cached.nsfw == pytest.approx(0.8)
+        assert cache.stats["redis_hits"] == 1
+        assert cache.stats["local_hits"] == 1
+
+    asyncio.run(run())
+
+
+def test_concurrent_moderations_are_coalesced():
+    """The same image moderated concurrently is moderated once."""
+
+    async def run() -> None:
+        cache = create_cache()
+        calls: List[str] = []
+
+        async def moderate() -> ModerationResult:
+            calls.append("moderate")
+            await asyncio.sleep(0.01)
+            return "request", ModerationResponse(
+                id="request", sfw=0.9, nsfw=0.1
+            )
+
+        results = await asyncio.gather(
+            *(cache.get_or_moderate("digest", moderate) for _ in range(5))
+        )
+        assert calls == ["moderate"]
+        assert [request_id for request_id, _ in results] == ["request"] * 5
+        assert cache.stats["coalesced"] == 4
+
+        request_id, cached = await cache.get_or_moderate("digest", moderate)
+        assert request_id == "" and cached is not None
+        assert calls == ["moderate"]
+
+    asyncio.run(run())
+
+
+def test_failed_moderation_is_not_cached():
+    """The waiters get the error, the next call moderates again."""
+
+    async def run() -> None:
+        cache = create_cache()
+        calls: List[str] = []
+
+        async def fail() -> ModerationResult:
+            calls.append("fail")
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream")
+
+        results = await asyncio.gather(
+            *(cache.get_or_moderate("digest", fail) for _ in range(3)),
+            return_exceptions=True,
+        )
+        assert calls == ["fail"]
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+        async def timeout() -> ModerationResult:
+            calls.append("timeout")
+            return "request", None
+
+        assert await cache.get_or_moderate("digest", timeout) == (
+            "request",
+            None,
+        )
+        assert await cache.get("digest") is None
+        assert calls == ["fail", "timeout"]
+
+    asyncio.run(run())
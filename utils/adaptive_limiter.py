@@ -0,0 +1,162 @@
+"""The module responsible for the adaptive concurrency limit."""
+
+import asyncio
+from time import monotonic
+from types import TracebackType
+from typing import Any, Dict, Optional, Type
+
+from .latency import RollingLatency
+
+
+class AdaptiveConcurrencyLimiter(object):
+    """
+    AIMD concurrency limiter.
+
+    The limit grows by one per limit of successful requests (additive
+    increase) and is cut by the backoff factor (multiplicative decrease)
+    when the upstream throttles us (429/5xx) or its latency inflates
+    over the tolerance times the baseline (the low percentile
+    of the recent latency). On throttling, no request is started
+    until Retry-After passes.
+
+    Usage:
+        async with limiter:
+            start = monotonic()
+            await make_request()
+            limiter.on_success(monotonic() - start)
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        backoff: float = 0.5,
+        latency_tolerance: float = 2.0,
+        min_samples: int = 20,
+    ):
+        """
+        Init class.
+
+        :param initial_limit: Initial number of requests in progress.
+        :param min_limit: Minimum limit.
+        :param max_limit: Maximum limit.
+        :param backoff: Factor of the limit on throttling.
+        :param latency_tolerance: The latency above the baseline
+        multiplied by the tolerance decreases the limit.
+        :param min_samples: Number of latency samples needed
+        to detect the latency inflation.
+        :raise ValueError: If the limits are inconsistent
+        or backoff is not in (0, 1).
+        """
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError("Limits must satisfy 1 <= min <= initial <= max.")
+        if not 0 < backoff < 1:
+            raise ValueError("Backoff must be in (0, 1).")
+        self.__limit = float(initial_limit)
+        self.__min_limit = min_limit
+        self.__max_limit = max_limit
+        self.__backoff = backoff
+        self.__latency_tolerance = latency_tolerance
+        self.__min_samples = min_samples
+        self.__latency = RollingLatency()
+        self.__in_flight = 0
+        self.__paused_until = 0.0
+        self.__condition = asyncio.Condition()
+        self.__throttles = 0
+
+    @property
+    def limit(self) -> int:
+        """Return the current limit."""
+        return int(self.__limit)
+
+    @property
+    def in_flight(self) -> int:
+        """Return the number of requests in progress."""
+        return self.__in_flight
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Return the limit and the throttling counter."""
+        baseline = self.__baseline()
+        return {
+            "limit": self.limit,
+            "in_flight": self.__in_flight,
+            "throttles": self.__throttles,
+            "baseline_ms": (
+                round(baseline * 1e3, 1) if baseline is not None else None
+            ),
+        }
+
+    def __baseline(self) -> Optional[float]:
+        """Return the latency without queuing upstream (seconds)."""
+        if len(self.__latency) < self.__min_samples:
+            return None
+        return self.__latency.percentile(10)
+
+    def __decrease(self) -> None:
+        """Cut the limit (multiplicative decrease)."""
+        self.__limit = max(
+            float(self.__min_limit), self.__limit * self.__backoff
+        )
+
+    def on_success(self, latency: float) -> None:
+        """
+        Adjust the limit after the successful request.
+
+        :param latency: Latency of the request (seconds).
+        """
+        baseline = self.__baseline()
+        self.__latency.add(latency)
+        if (
+            baseline is not None
+            and latency > baseline * self.__latency_tolerance
+        ):
+            # the upstream queues our requests: gentle decrease
+            self.__limit = max(float(self.__min_limit), self.__limit * 0.95)
+        else:
+            self.__limit = min(
+                float(self.__max_limit), self.__limit + 1 / self.__limit
+            )
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        """
+        Cut the limit after the throttled request.
+
+        :param retry_after: Delay requested by the upstream (seconds).
+        No request is started until it passes.
+        """
+        self.__throttles += 1
+        self.__decrease()
+        if retry_after:
+            self.__paused_until = max(
+                self.__paused_until, monotonic() + retry_after
+            )
+
+    async def __aenter__(self) -> "AdaptiveConcurrencyLimiter":
+        """Wait until the limit and the pause allow one more request."""
+        async with self.__condition:
+            while True:
+                pause = self.__paused_until - monotonic()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self.__condition.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.__in_flight < self.limit:
+                    break
+                await self.__condition.wait()
+            self.__in_flight += 1
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        """Release the slot."""
+        async with self.__condition:
+            self.__in_flight -= 1
+            self.__condition.notify_all()
@@ -0,0 +1,220 @@
+"""The module responsible for the pooled HTTP client."""
+
+import asyncio
+import ipaddress
+import socket
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterable, Optional
+
+import httpcore
+import httpx
+
+from config.app import HttpClientConfig
+
+
+class ConnectionStats(object):
+    """
+    Connection reuse stats of the HTTP client.
+
+    Counts the requests and the new connections (TCP connects)
+    with the httpcore trace extension.
+    """
+
+    def __init__(self):
+        """Init class."""
+        self.requests = 0
+        self.connections = 0
+
+    async def on_request(self, request: httpx.Request) -> None:
+        """Count the request and trace its connection (request hook)."""
+        self.requests += 1
+        request.extensions["trace"] = self.__trace
+
+    async def __trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        """Count the new connections."""
+        if event_name == "connection.connect_tcp.complete":
+            self.connections += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the stats (reuse ratio - share of reused connections)."""
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "reuse_ratio": (
+                round(1 - self.connections / self.requests, 4)
+                if self.requests
+                else None
+            ),
+        }
+
+
+class NonPublicAddressError(httpcore.ConnectError):
+    """The host resolves to a private, loopback or other non-global address."""
+
+
+async def resolve_public_host(
+    host: str, port: int, timeout: Optional[float] = None
+) -> str:
+    """
+    Resolve the host and return the address to connect to.
+
+    All the addresses of the host must be global, so the host
+    cannot alternate between a public and a private address.
+
+    :raise NonPublicAddressError: If any address is not global.
+    :raise httpcore.ConnectError: If the host cannot be resolved.
+    :raise httpcore.ConnectTimeout: If the resolution timed out.
+    """
+    try:
+        async with asyncio.timeout(timeout):
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, port, type=socket.SOCK_STREAM
+            )
+    except TimeoutError as exc:
+        raise httpcore.ConnectTimeout(f"Resolving {host} timed out.") from exc
+    except OSError as exc:
+        raise httpcore.ConnectError(
+            f"Failed to resolve {host}: {exc}"
+        ) from exc
+    if not infos:
+        raise httpcore.ConnectError(f"{host} has no addresses.")
+    for info in infos:
+        # the IPv6 address may have the scope ("fe80::1%eth0")
+        address = str(info[4][0]).split("%")[0]
+        if not ipaddress.ip_address(address).is_global:
+            raise NonPublicAddressError(
+                f"{host} resolves to a non-public address {address}."
+            )
+    return str(infos[0][4][0])
+
+
+class PublicNetworkBackend(httpcore.AsyncNetworkBackend):
+    """
+    Network backend that connects only to the public addresses.
+
+    The host is resolved and checked on every connect and the connection
+    is made to the checked address, so the name cannot be re-resolved
+    to a private address in between (DNS rebinding). The redirects
+    open their connections here too. TLS is still verified against
+    the host name.
+    """
+
+    def __init__(self):
+        """Init class."""
+        self.__backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        local_address: Optional[str] = None,
+        socket_options: Optional[Iterable[Any]] = None,
+    ) -> httpcore.AsyncNetworkStream:
+        """Connect to the checked address of the host."""
+        address = await resolve_public_host(host, port, timeout)
+        return await self.__backend.connect_tcp(
+            address,
+            port,
+            timeout=timeout,
+            local_address=local_address,
+            socket_options=socket_options,
+        )
+
+    async def connect_unix_socket(
+        self,
+        path: str,
+        timeout: Optional[float] = None,
+        socket_options: Optional[Iterable[Any]] = None,
+    ) -> httpcore.AsyncNetworkStream:
+        """Refuse to connect to the unix socket."""
+        raise NonPublicAddressError("Unix sockets are not supported.")
+
+    async def sleep(self, seconds: float) -> None:
+        """Sleep (the connection retries)."""
+        await self.__backend.sleep(seconds)
+
+
+class PublicHTTPTransport(httpx.AsyncHTTPTransport):
+    """HTTP transport that connects only to the public addresses."""
+
+    def __init__(self, http2: bool, limits: httpx.Limits):
+        """
+        Init class.
+
+        :param http2: Enable HTTP/2.
+        :param limits: Limits of the connection pool.
+        """
+        # the parent __init__ is not called: it would build a pool
+        # with the default network backend (the transport uses only
+        # the pool)
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            http2=http2,
+            network_backend=PublicNetworkBackend(),
+        )
+
+
+def create_httpx_client(
+    config: HttpClientConfig,
+    stats: Optional[ConnectionStats] = None,
+    public_only: bool = False,
+) -> httpx.AsyncClient:
+    """
+    Create the long-lived HTTP client with the connection pool.
+
+    The client must be closed (aclose) when it is no longer needed.
+
+    :param config: HTTP client config.
+    :param stats: Connection reuse stats updated by the client.
+    :param public_only: Connect only to the public addresses (the URLs
+    of the users), the other connects fail with httpx.ConnectError
+    caused by NonPublicAddressError. The proxies from the environment
+    are not used then, as they would be checked instead of the hosts.
+    """
+    limits = httpx.Limits(
+        max_connections=config.max_connections,
+        max_keepalive_connections=config.max_keepalive_connections,
+        keepalive_expiry=config.keepalive_expiry,
+    )
+    return httpx.AsyncClient(
+        http2=config.http2,
+        limits=limits,
+        transport=(
+            PublicHTTPTransport(http2=config.http2, limits=limits)
+            if public_only
+            else None
+        ),
+        trust_env=not public_only,
+        timeout=httpx.Timeout(
+            config.timeout,
+            connect=config.connect_timeout,
+            pool=config.pool_timeout,
+        ),
+        event_hooks={"request": [stats.on_request]} if stats else None,
+    )
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse the Retry-After header (seconds or HTTP date).
+
+    :return: Delay (seconds) or None, if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
@@ -0,0 +1,57 @@
+"""The module responsible for the latency statistics."""
+
+from collections import deque
+from statistics import fmean
+from typing import Deque, Dict, List, Optional
+
+
+class RollingLatency(object):
+    """
+    Latency statistics over the last window samples.
+
+    The sorted samples are cached until the next sample is added,
+    so the percentiles are cheap to read repeatedly.
+    """
+
+    def __init__(self, window: int = 1000):
+        """
+        Init class.
+
+        :param window: Number of the last samples kept.
+        """
+        self.__samples: Deque[float] = deque(maxlen=window)
+        self.__sorted: Optional[List[float]] = None
+
+    def __len__(self) -> int:
+        """Return the number of the samples."""
+        return len(self.__samples)
+
+    def add(self, seconds: float) -> None:
+        """Add the latency sample (seconds)."""
+        self.__samples.append(seconds)
+        self.__sorted = None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Return the percentile of the samples (seconds).
+
+        :param q: Percentile (0-100).
+        :return: Percentile or None, if there are no samples.
+        """
+        if not self.__samples:
+            return None
+        if self.__sorted is None:
+            self.__sorted = sorted(self.__samples)
+        index = min(int(len(self.__sorted) * q / 100), len(self.__sorted) - 1)
+        return self.__sorted[index]
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        """Return the mean, p50 and p99 of the samples (milliseconds)."""
+        p50, p99 = self.percentile(50), self.percentile(99)
+        if p50 is None or p99 is None:
+            return {"mean_ms": None, "p50_ms": None, "p99_ms": None}
+        return {
+            "mean_ms": round(fmean(self.__samples) * 1e3, 1),
+            "p50_ms": round(p50 * 1e3, 1),
+            "p99_ms": round(p99 * 1e3, 1),
+        }
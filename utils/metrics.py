@@ -0,0 +1,386 @@
+"""The module responsible for the metrics in the Prometheus text format."""
+
+import asyncio
+import math
+from bisect import bisect_left
+from logging import getLogger
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+logger = getLogger("main.utils.metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+# waiting in the queue may take much longer than a call
+QUEUE_WAIT_BUCKETS: Tuple[float, ...] = LATENCY_BUCKETS + (120.0, 300.0)
+
+# called before rendering to update the gauges (e.g. the queue depth)
+Collector = Callable[[], Awaitable[None]]
+
+
+def _format_value(value: float) -> str:
+    """Return the sample value in the text format."""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Return the label set in the text format."""
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            value.replace("\\", "\\\\")
+            .replace("\n", "\\n")
+            .replace('"', '\\"'),
+        )
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class CounterValue(object):
+    """Value of the counter with a label set."""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        """Init class."""
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Increase the counter."""
+        self.value += amount
+
+
+class GaugeValue(CounterValue):
+    """Value of the gauge with a label set."""
+
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0) -> None:
+        """Decrease the gauge."""
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        """Set the gauge."""
+        self.value = value
+
+
+class HistogramValue(object):
+    """Value of the histogram with a label set."""
+
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        """
+        Init class.
+
+        :param buckets: Sorted upper bounds of the buckets (without +Inf).
+        """
+        self.buckets = buckets
+        # not cumulative, the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Add the observation."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metric(object):
+    """
+    Metric with its values by label set.
+
+    The metrics are updated from the event loop only, so the values
+    are plain attributes without locks. The label sets known in advance
+    are created on registration, so the hot path is a dict lookup
+    (or no lookup at all, if the value is kept by the caller).
+    """
+
+    type_name: str = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        labelvalues: Iterable[Sequence[str]] = (),
+        registry: Optional["Registry"] = None,
+    ):
+        """
+        Init class.
+
+        :param name: Metric name.
+        :param documentation: Help text.
+        :param labelnames: Label names.
+        :param labelvalues: Label sets created in advance.
+        :param registry: Registry of the metric. If None, the default one.
+        :raise ValueError: If the name is already registered.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        if not self.labelnames:
+            self._values[()] = self._new_value()
+        for values in labelvalues:
+            self.labels(*values)
+        (registry or REGISTRY).register(self)
+
+    def _new_value(self) -> Any:
+        """Return the new value of a label set."""
+        raise NotImplementedError
+
+    def _labels(self, values: Tuple[str, ...]) -> Any:
+        """Return the value of the label set (created, if it is new)."""
+        value = self._values.get(values)
+        if value is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(
+                    f"{self.name} takes labels {self.labelnames}."
+                )
+            value = self._values[values] = self._new_value()
+        return value
+
+    def labels(self, *values: str) -> Any:
+        """Return the value of the label set."""
+        return self._labels(values)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """Yield the samples: name suffix, labels and value."""
+        for values, value in self._values.items():
+            yield "", _format_labels(self.labelnames, values), value.value
+
+    def render(self) -> str:
+        """Return the metric in the text format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing counter."""
+
+    type_name = "counter"
+
+    def _new_value(self) -> CounterValue:
+        """Return the new value of a label set."""
+        return CounterValue()
+
+    def labels(self, *values: str) -> CounterValue:
+        """Return the counter of the label set."""
+        return self._labels(values)
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Increase the counter without labels."""
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+
+    type_name = "gauge"
+
+    def _new_value(self) -> GaugeValue:
+        """Return the new value of a label set."""
+        return GaugeValue()
+
+    def labels(self, *values: str) -> GaugeValue:
+        """Return the gauge of the label set."""
+        return self._labels(values)
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Increase the gauge without labels."""
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        """Decrease the gauge without labels."""
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        """Set the gauge without labels."""
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    """Distribution of the observations by buckets."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        labelvalues: Iterable[Sequence[str]] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        registry: Optional["Registry"] = None,
+    ):
+        """
+        Init class.
+
+        :param buckets: Upper bounds of the buckets (without +Inf).
+        The other params are the same as for Metric.
+        """
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(
+            name=name,
+            documentation=documentation,
+            labelnames=labelnames,
+            labelvalues=labelvalues,
+            registry=registry,
+        )
+
+    def _new_value(self) -> HistogramValue:
+        """Return the new value of a label set."""
+        return HistogramValue(self.buckets)
+
+    def labels(self, *values: str) -> HistogramValue:
+        """Return the histogram of the label set."""
+        return self._labels(values)
+
+    def observe(self, value: float) -> None:
+        """Add the observation without labels."""
+        self.labels().observe(value)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """Yield the cumulative buckets, the sum and the count."""
+        names = self.labelnames + ("le",)
+        for values, value in self._values.items():
+            total = 0
+            bounds = self.buckets + (math.inf,)
+            for bound, count in zip(bounds, value.counts):
+                total += count
+                labels = _format_labels(
+                    names, values + (_format_value(bound),)
+                )
+                yield "_bucket", labels, total
+            labels = _format_labels(self.labelnames, values)
+            yield "_sum", labels, value.sum
+            yield "_count", labels, total
+
+
+class Registry(object):
+    """Metrics and collectors of the process."""
+
+    def __init__(self):
+        """Init class."""
+        self.__metrics: Dict[str, Metric] = {}
+        self.__collectors: List[Collector] = []
+
+    def register(self, metric: Metric) -> None:
+        """
+        Register the metric.
+
+        :raise ValueError: If the name is already registered.
+        """
+        if metric.name in self.__metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self.__metrics[metric.name] = metric
+
+    def add_collector(self, collector: Collector) -> None:
+        """Add the collector called before each rendering."""
+        self.__collectors.append(collector)
+
+    def remove_collector(self, collector: Collector) -> None:
+        """Remove the collector (if it was added)."""
+        if collector in self.__collectors:
+            self.__collectors.remove(collector)
+
+    async def render(self) -> str:
+        """Run the collectors and return the metrics in the text format."""
+        for collector in list(self.__collectors):
+            try:
+                await collector()
+            except Exception as exc:
+                logger.warning("Metrics collector failed: %r", exc)
+        return (
+            "\n".join(metric.render() for metric in self.__metrics.values())
+            + "\n"
+        )
+
+
+REGISTRY = Registry()
+
+
+async def serve_metrics(
+    port: int, host: str = "0.0.0.0", registry: Optional[Registry] = None
+) -> None:
+    """
+    Serve GET /metrics on the port until cancelled.
+
+    A minimal HTTP/1.0 server for the processes without a web framework
+    (one request per connection).
+    """
+    registry = registry or REGISTRY
+
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Answer one request."""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5.0)
+            while (await asyncio.wait_for(reader.readline(), 5.0)).strip():
+                pass  # the headers are not needed
+            parts = request_line.decode("latin-1").split()
+            if (
+                len(parts) >= 2
+                and parts[0] == "GET"
+                and (parts[1].split("?", 1)[0] in ("/metrics", "/"))
+            ):
+                status = "200 OK"
+                body = (await registry.render()).encode()
+            else:
+                status = "404 Not Found"
+                body = b"Not Found\n"
+            writer.write(
+                (
+                    f"HTTP/1.0 {status}\r\n"
+                    f"Content-Type: {CONTENT_TYPE}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as exc:
+            logger.debug("Metrics request failed: %r", exc)
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info("Serving metrics on %s:%d.", host, port)
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,100 @@
+"""The module responsible for limiting the rate of requests."""
+
+import asyncio
+from time import monotonic
+from types import TracebackType
+from typing import Optional, Type
+
+
+class RateLimiter(object):
+    """
+    Token bucket rate limiter with a cap on concurrent requests.
+
+    Usage:
+        async with rate_limiter:
+            await make_request()
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: int = 1,
+        max_concurrency: Optional[int] = None,
+    ):
+        """
+        Init class.
+
+        :param rate: Requests per second. If None, the rate is not limited.
+        :param burst: Bucket capacity (how many requests can be made at once
+        after a period of inactivity).
+        :param max_concurrency: Maximum number of requests in progress.
+        If None, the number of requests in progress is not limited.
+        :raise ValueError: If rate, burst or max_concurrency is not positive.
+        """
+        if rate is not None and rate <= 0:
+            raise ValueError("Rate must be positive.")
+        if burst < 1:
+            raise ValueError("Burst must be positive.")
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("Max concurrency must be positive.")
+        self.__rate = rate
+        self.__capacity = float(burst)
+        self.__tokens = float(burst)
+        self.__updated_at = monotonic()
+        self.__lock = asyncio.Lock()
+        self.__semaphore: Optional[asyncio.Semaphore] = (
+            asyncio.Semaphore(max_concurrency)
+            if max_concurrency is not None
+            else None
+        )
+        self.__in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        """Return the number of requests in progress."""
+        return self.__in_flight
+
+    def __refill(self) -> None:
+        """Add the tokens accumulated since the last refill."""
+        assert self.__rate is not None
+        now = monotonic()
+        self.__tokens = min(
+            self.__capacity,
+            self.__tokens + (now - self.__updated_at) * self.__rate,
+        )
+        self.__updated_at = now
+
+    async def acquire_token(self) -> None:
+        """Wait for a token. The waiters are served in FIFO order."""
+        if self.__rate is None:
+            return
+        async with self.__lock:
+            self.__refill()
+            if self.__tokens < 1:
+                await asyncio.sleep((1 - self.__tokens) / self.__rate)
+                self.__refill()
+            self.__tokens -= 1
+
+    async def __aenter__(self) -> "RateLimiter":
+        """Wait for a free slot and a token."""
+        if self.__semaphore is not None:
+            await self.__semaphore.acquire()
+        try:
+            await self.acquire_token()
+        except BaseException:
+            if self.__semaphore is not None:
+                self.__semaphore.release()
+            raise
+        self.__in_flight += 1
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        """Release the slot."""
+        self.__in_flight -= 1
+        if self.__semaphore is not None:
+            self.__semaphore.release()
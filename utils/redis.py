@@ -8,12 +8,18 @@ from typing import (
     AsyncGenerator,
     Callable,
     Coroutine,
+    Dict,
+    List,
     Optional,
+    Tuple,
     TypeVar,
+    Union,
     overload,
 )
 
-from redis.asyncio import Redis
+from redis.asyncio import BlockingConnectionPool, ConnectionPool, Redis
+
+from config.app import RedisConfig
 
 logger = getLogger("total.utils.redis")
 
@@ -36,6 +42,33 @@ async def redis_conn(
         await redis_client.close()
 
 
+def create_redis_pool(redis_config: RedisConfig) -> BlockingConnectionPool:
+    """
+    Create a bounded redis connection pool.
+
+    When all connections are in use, a client waits for a free connection
+    (at most redis_config.pool_timeout seconds) instead of opening a new one.
+    """
+    return BlockingConnectionPool.from_url(
+        redis_config.url,
+        max_connections=redis_config.max_connections,
+        timeout=redis_config.pool_timeout,
+        health_check_interval=redis_config.health_check_interval,
+    )
+
+
+def get_pool_stats(pool: ConnectionPool) -> Dict[str, int]:
+    """Return usage stats of the redis connection pool."""
+    in_use = len(pool._in_use_connections)
+    idle = len(pool._available_connections)
+    return {
+        "max_connections": pool.max_connections,
+        "created_connections": in_use + idle,
+        "in_use_connections": in_use,
+        "idle_connections": idle,
+    }
+
+
 def redis_decorator(redis_url: str):
     """Decorate func and add redis client in kwargs."""
 
@@ -95,19 +128,24 @@ class RedisMixin(object):
 class RedisProdMixin(RedisMixin):
     """Redis publisher mixin."""
 
-    async def rpush(self, key: str, value: str):
+    async def rpush(self, key: str, value: Union[str, bytes]):
         """RPUSH value in list with key value."""
         async with self.get_redis_conn() as redis_client:
-            logger.debug("RPUSH value %s to key %s", value, key)
+            logger.debug("RPUSH value (%d bytes) to key %s", len(value), key)
             await redis_client.rpush(key, value)
 
 
+def _as_bytes(value: Union[str, bytes]) -> bytes:
+    """Return the reply value as bytes (the client does not decode them)."""
+    return value if isinstance(value, bytes) else value.encode()
+
+
 class RedisConMixin(RedisMixin):
     """Redis subscriber mixin."""
 
     async def blpop(
         self, key: str, timeout: Optional[float] = None
-    ) -> Optional[str]:
+    ) -> Optional[bytes]:
         """BLPOP value from list with key."""
         async with self.get_redis_conn() as redis_client:
             result = await redis_client.blpop([key], timeout=timeout)
@@ -115,5 +153,30 @@ class RedisConMixin(RedisMixin):
                 return None
             else:
                 _, value = result
-            logger.debug("BLPOP from key %s value %s", key, str(value))
-            return value
+            logger.debug("BLPOP from key %s value (%d bytes)", key, len(value))
+            return _as_bytes(value)
+
+    async def blpop_first(
+        self, keys: List[str], timeout: Optional[float] = None
+    ) -> Optional[Tuple[str, bytes]]:
+        """BLPOP value from the first non-empty list of keys."""
+        async with self.get_redis_conn() as redis_client:
+            result = await redis_client.blpop(keys, timeout=timeout)
+            if result is None:
+                return None
+            key, value = result
+            if isinstance(key, bytes):
+                key = key.decode()
+            logger.debug("BLPOP from key %s value (%d bytes)", key, len(value))
+            return key, _as_bytes(value)
+
+    async def lpop(self, key: str, count: int = 1) -> List[bytes]:
+        """LPOP up to count values from list with key."""
+        async with self.get_redis_conn() as redis_client:
+            values = await redis_client.lpop(key, count)
+            if values is None:
+                return []
+            if not isinstance(values, list):
+                values = [values]
+            logger.debug("LPOP from key %s %d values", key, len(values))
+            return [_as_bytes(value) for value in values]